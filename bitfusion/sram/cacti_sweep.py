@@ -16,6 +16,8 @@ class CactiSweep(object):
         self.cfg_file = os.path.join(os.path.dirname(os.path.abspath(self.csv_file)), 'sweep.cfg')
         if default_dict is not None:
             self.default_dict.update(default_dict)
+        # get_data_clean results, cleared whenever a row is added
+        self._clean_cache = {}
         if os.path.isfile(self.csv_file):
             self._df = pandas.read_csv(csv_file)
         else:
@@ -108,12 +110,16 @@ class CactiSweep(object):
             row_dict = index_dict.copy()
             row_dict.update(self._run_cacti(index_dict))
             self._df = self._df.append(pandas.DataFrame([row_dict]), ignore_index=True)
+            self._clean_cache = {}
             self.update_csv()
             return self.locate(index_dict)
         else:
             return data
 
     def get_data_clean(self, index_dict):
+        key = tuple(sorted(index_dict.items()))
+        if key in self._clean_cache:
+            return self._clean_cache[key]
         data = self.get_data(index_dict)
         cols = [
                 'size (bytes)',
@@ -128,7 +134,8 @@ class CactiSweep(object):
                 'area_mm^2',
                 'technology (u)',
                 ]
-        return data[cols]
+        self._clean_cache[key] = data[cols]
+        return self._clean_cache[key]
 
 if __name__ == "__main__":
     cache_sweep_data = CactiSweep()
@@ -1,11 +1,16 @@
 import argparse
 import logging
 
+from collections import namedtuple
+
 from dnnweaver2.graph import Graph, get_default_graph
 from dnnweaver2.tensorOps.cnn import conv2D, maxPool, flatten, matmul, addBias, batch_norm, reorg, concat, leakyReLU, add
 from dnnweaver2 import get_tensor
 import logging
 from dnnweaver2.scalar.dtypes import FQDtype, FixedPoint
+import bitfusion.src.simulator.fusion as fusion
+import bitfusion.src.simulator.roofline as roofline
+from bitfusion.src.simulator.stats import Stats
 
 import os
 
@@ -122,6 +127,71 @@ def get_bench_numbers(graph, sim_obj, batch_size=1):
             stats[opname] = s
     return stats
 
+def get_bench_numbers_fused(graph, sim_obj, batch_size=1):
+    """
+    Like get_bench_numbers, with fused producer/consumer layers. Returns
+    (stats, fused stats, list of fusion.FusionPair); see
+    fusion.get_fused_stats
+    """
+    stats = get_bench_numbers(graph, sim_obj, batch_size)
+    tilings = fusion.get_layer_tilings(graph, sim_obj)
+    fused, pairs = fusion.get_fused_stats(graph, stats, tilings, sim_obj.accelerator)
+    return stats, fused, pairs
+
+def get_bench_roofline(graph, sim_obj, batch_size=1):
+    """
+    Like get_bench_numbers, with the roofline of each layer. Returns
+    (stats, list of roofline.LayerRoofline); see roofline.get_roofline_table
+    and roofline.get_roofline_json to print it
+    """
+    stats = get_bench_numbers(graph, sim_obj, batch_size)
+    return stats, roofline.get_roofline_report(graph, sim_obj, stats)
+
+# One point of the batch-size curve of a network
+#   cycles: total cycles for a batch
+#   latency: seconds for a batch
+#   throughput: inputs per second
+#   energy: energy for a batch, as Stats.get_energy
+BatchPoint = namedtuple('BatchPoint', ['batch_size', 'cycles', 'latency', 'throughput', 'energy'])
+
+def get_bench_batch_curve(graph, sim_obj, batch_sizes):
+    """
+    Returns the latency/throughput curve of graph over batch_sizes as a
+    list of BatchPoint. The batch dimension of every layer is replaced by
+    each batch size, and the layers are searched for all batch sizes at
+    once (see Simulator.get_batch_stats) instead of re-simulating graph for
+    each of them.
+    """
+    batch_sizes = list(batch_sizes)
+    totals = [Stats() for B in batch_sizes]
+    for opname, op in graph.op_registry.iteritems():
+        batch_stats = sim_obj.get_batch_stats(op, batch_sizes)
+        if batch_stats is None:
+            continue
+        for total, s in zip(totals, batch_stats):
+            total += s
+
+    energy_cost = sim_obj.get_energy_cost()
+    frequency = float(sim_obj.accelerator.frequency)
+    curve = []
+    for B, total in zip(batch_sizes, totals):
+        latency = total.total_cycles / frequency
+        curve.append(BatchPoint(B, total.total_cycles, latency, B / latency,
+                                total.get_energy(energy_cost)))
+    return curve
+
+def get_bench_pareto(graph, sim_obj):
+    """
+    Returns a list of (opname, Pareto frontier) for the layers of graph, to
+    be combined with pareto.select_network_point
+    """
+    fronts = []
+    for opname, op in graph.op_registry.iteritems():
+        points = sim_obj.get_pareto_points(op)
+        if points is not None:
+            fronts.append((opname, points))
+    return fronts
+
 def get_alex_net():
     '''
     AlexNet
@@ -5,7 +5,7 @@ from src.simulator.simulator import Simulator
 from src.simulator.stats import Stats, get_energy_from_results
 from src.utils.utils import *
 import src.benchmarks.benchmarks as benchmarks
-from src.sweep.sweep import check_pandas_or_run
+from src.sweep.sweep import check_pandas_or_run, load_sweep_results
 from scipy.stats import gmean
 
 def optimize_area_allocation(
@@ -21,7 +21,7 @@ def optimize_area_allocation(
     ##################################################
     # Get stats for systolic array
     core_csv = os.path.join(results_dir, 'systolic_array_synth.csv')
-    core_synth_data = pandas.read_csv(core_csv)
+    core_synth_data = PandasLookupIndex(pandas.read_csv(core_csv))
 
     ##################################################
     # Get stats for SRAM
@@ -30,6 +30,8 @@ def optimize_area_allocation(
     sram_csv = 'hardware_sweep/sram_results.csv'
     sram_data = get_sram_dataframe(tech_node, voltage, int(frequency * 1.e-6), './sram/data',
                                    logpath='./sram/mcpat.sram/SampleScirpts/RunLog')
+    # Looked up inside the nested buffer-size loops below
+    sram_data = PandasLookupIndex(sram_data)
 
     ##################################################
     # Get stats for SRAM
@@ -78,10 +80,7 @@ def optimize_area_allocation(
 
     # Generate baseline numbers
     sim_sweep_csv = os.path.join(results_dir, 'bitfusion-sim-sweep.csv')
-    if os.path.exists(sim_sweep_csv):
-        sim_sweep_df = pandas.read_csv(os.path.join(results_dir, 'bitfusion-sim-sweep.csv'))
-    else:
-        sim_sweep_df = pandas.DataFrame(columns=sim_sweep_columns)
+    sim_sweep_df = load_sweep_results(sim_sweep_csv, sim_sweep_columns)
     batch_size = 16
     df = check_pandas_or_run(sim_obj, sim_sweep_df, sim_sweep_csv, batch_size=batch_size)
     baseline_results = df.groupby(group_columns, as_index=False).sum()
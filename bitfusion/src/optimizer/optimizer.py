@@ -4,11 +4,16 @@ import time
 import logging
 
 from itertools import permutations
-from multiprocessing import Pool, cpu_count
 
 from bitfusion.src.utils.utils import ceil_a_by_b, log2
 from bitfusion.src.simulator.loop_stack import LoopStack
+from bitfusion.src.simulator.loop_nest import LoopNest, buffer_namespaces
 from bitfusion.src.simulator.stats import Stats
+from bitfusion.src.simulator.accelerator import Accelerator
+from bitfusion.src.simulator.energy import EnergyTuple
+from bitfusion.src.optimizer.vectorized import optimize_tiling_batch, optimize_tiling_batch_sweep, get_pareto_batch, get_tile_candidates, get_tiling
+from bitfusion.src.optimizer.pareto import ParetoPoint
+from dnnweaver2.optimizer.worker_pool import get_pool, close_pool, get_chunksize
 
 import numpy as np
 
@@ -255,48 +260,210 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
 
     return stats
 
-def optimize_for_order(conv_params):
+def pack_conv_params(conv_params):
+    """
+    Flattens conv_params into a tuple of numbers, so that tasks sent to the
+    worker pool do not pickle the Accelerator and EnergyTuple objects
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    return (acc_obj.N, acc_obj.M, acc_obj.pmax, acc_obj.pmin,
+            acc_obj.sram['wgt'], acc_obj.sram['act'], acc_obj.sram['out'],
+            acc_obj.mem_if_width, acc_obj.frequency,
+            K, O, S, IC, OC, B, iprec, wprec, im2col) + tuple(energy_cost)
+
+# Last tuple unpacked by this process; a worker usually sees the same
+# layer for every chunk it is handed
+_unpacked_conv_params = (None, None)
+
+def unpack_conv_params(packed_params):
+    """
+    Inverse of pack_conv_params
+    """
+    global _unpacked_conv_params
+    if _unpacked_conv_params[0] == packed_params:
+        return _unpacked_conv_params[1]
+    N, M, pmax, pmin, wgt_sram, act_sram, out_sram, mem_if_width, frequency = packed_params[:9]
+    sram = {'wgt': wgt_sram, 'act': act_sram, 'out': out_sram}
+    acc_obj = Accelerator(N, M, pmax, pmin, sram, mem_if_width, frequency)
+    energy_cost = EnergyTuple(*packed_params[18:])
+    conv_params = (acc_obj,) + tuple(packed_params[9:18]) + (energy_cost,)
+    _unpacked_conv_params = (packed_params, conv_params)
+    return conv_params
+
+def _pick_best(best, result):
+    """
+    Keeps the first result with the fewest cycles, and then the least energy
+    """
+    tiling, order_type, cycles, energy = result
+    if cycles is None:
+        return best
+    best_tiling, best_order, best_cycles, best_energy = best
+    if best_cycles is None or best_cycles > cycles or (best_cycles == cycles and best_energy > energy):
+        return result
+    return best
+
+def get_canonical_order(order_type, tiling):
+    """
+    Returns the loops of order_type that have more than one tile. A loop with
+    a single tile does not change the reads, writes, or promotion in
+    get_stats_fast, so orders with the same canonical order have the same
+    cost for this tiling.
+    """
+    return tuple(loop for loop in order_type if tiling[loop][0] > 1)
+
+def get_cycles_lower_bound(conv_params, tiling):
+    """
+    Returns the compute cycles of a tiling. Memory stalls are never
+    negative, so get_stats_fast never returns fewer total cycles for any
+    order.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    num_tiles = 1
+    for loop in tiling:
+        num_tiles *= tiling[loop][0]
+    return num_tiles * acc_obj.get_compute_cycles(tiling['IC/ic'][1], tiling['OC/oc'][1],
+            tiling['OW/ow'][1], tiling['OH/oh'][1], tiling['B/b'][1], K, K, iprec, wprec, im2col)
+
+def _branch_and_bound(conv_params, order_types, tile_candidates='pow2', candidates=None):
+    """
+    Returns the same result as evaluating get_stats_fast for every tiling of
+    get_tile_candidates and every order in order_types, and keeping the
+    first result with the fewest cycles (and then the least energy), with
+    fewer calls to get_stats_fast:
+        - tilings are visited by increasing compute cycles, stopping once the
+          compute cycles exceed the best total cycles found so far
+        - for each tiling, only the first order of each canonical order is
+          evaluated
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    if candidates is None:
+        candidates = get_tile_candidates(conv_params, tile_candidates)
+    tilings = [get_tiling(candidates, i) for i in range(len(candidates['b']))]
+    bounds = [get_cycles_lower_bound(conv_params, tiling) for tiling in tilings]
+
+    # (cycles, energy, order index, tiling index); comparing tuples gives the
+    # tie-break of the exhaustive search
+    best = None
+    num_evaluated = 0
+    for tiling_id in sorted(range(len(tilings)), key=lambda i: bounds[i]):
+        if best is not None and bounds[tiling_id] > best[0]:
+            break
+        tiling = tilings[tiling_id]
+        evaluated = set()
+        for order_id, order_type in enumerate(order_types):
+            canonical_order = get_canonical_order(order_type, tiling)
+            if canonical_order in evaluated:
+                continue
+            evaluated.add(canonical_order)
+            stats = get_stats_fast(conv_params, tiling, order_type)
+            num_evaluated += 1
+            if stats is None:
+                # SRAM overflow does not depend on the order
+                break
+            result = (stats.total_cycles, stats.get_energy(energy_cost), order_id, tiling_id)
+            if best is None or result < best:
+                best = result
+
+    logger.debug('Branch and bound: {} of {} tilings x orders evaluated'.format(
+        num_evaluated, len(tilings) * len(order_types)))
+
+    if best is None:
+        return (None, None, None, None)
+    cycles, energy, order_id, tiling_id = best
+    return (tilings[tiling_id], order_types[order_id], cycles, energy)
+
+def _search_orders(conv_params, order_types, vectorized=True, tile_candidates='pow2', candidates=None):
+    """
+    Returns (best_tiling, best_order, best_cycles, best_energy) over all the
+    orders in order_types
+    """
+    if vectorized:
+        # Evaluate the tilings for all orders as numpy arrays
+        return optimize_tiling_batch(conv_params, order_types, tile_candidates, candidates)
+    return _branch_and_bound(conv_params, list(order_types), tile_candidates, candidates)
+
+def _search_orders_packed(packed_params, vectorized, tile_candidates, candidates, order_types):
+    return _search_orders(unpack_conv_params(packed_params), order_types, vectorized, tile_candidates, candidates)
+
+def optimize_for_order(conv_params, vectorized=True, parallel=False, processes=None, chunksize=None, tile_candidates='pow2',
+                       candidates=None):
+    """
+    Searches the tiling and loop order for a convolution layer
+    Args:
+        conv_params: A tuple with convolution params
+        vectorized: evaluate tilings as numpy arrays instead of one at a time
+        parallel: split the orders across the shared worker pool
+        processes: number of workers in the shared pool
+        chunksize: number of orders per task (defaults to an even split)
+        tile_candidates: 'pow2' or 'extended', see get_tile_candidates
+        candidates: precomputed tile candidates for conv_params, see
+                    get_batch_candidates
+    Returns:
+        (best_tiling, best_order). get_loop_nest or get_loop_instructions
+        build the loop nest of the result for callers that need it.
+    """
     # Generate permutations for the order
     loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
-    order = set(permutations(loops))
+    order = list(set(permutations(loops)))
 
-    return_dict = {}
-    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    if not parallel:
+        best_tiling, best_order, _, _ = _search_orders(conv_params, order, vectorized, tile_candidates, candidates)
+        return best_tiling, best_order
 
-    _bound_optimizer_method = functools.partial(_optimize_for_order, conv_params)
+    # Contiguous chunks, so that reducing the results in chunk order keeps
+    # the same tie-break as a sequential search
+    chunksize = get_chunksize(len(order), processes, chunksize)
+    chunks = [order[i:i + chunksize] for i in range(0, len(order), chunksize)]
 
-    try:
-        pool = Pool(cpu_count())
-        results = pool.map_async(_bound_optimizer_method, order).get(10000)
-        pool.close()
-        pool.join()
-
-        # for o in order:
-        #     _bound_optimizer_method(o)
-        # exit()
-
-        best_cycles = None
-        best_energy = None
-        min_cycles = min([x[-4] for x in results])
-        min_energy = min([x[-3] for x in results])
-        cycles_list = [x[-2] for x in results]
-        energy_list = [x[-1] for x in results]
-        for r in results:
-            tiling, order_type, cycles, energy = r
-            if best_cycles is None or best_cycles > cycles or (best_cycles == cycles and best_energy > energy):
-                best_cycles = cycles
-                best_energy = energy
-                best_tiling = tiling
-                best_order = order_type
-        return get_loop_instructions(conv_params, best_tiling, best_order), best_tiling, best_order
+    _bound_optimizer_method = functools.partial(_search_orders_packed, pack_conv_params(conv_params), vectorized, tile_candidates, candidates)
 
+    try:
+        results = get_pool(processes).map_async(_bound_optimizer_method, chunks).get(10000)
     except KeyboardInterrupt:
-        pool.terminate()
-        pool.join()
+        close_pool(terminate=True)
         return
 
+    best = (None, None, None, None)
+    for r in results:
+        best = _pick_best(best, r)
+    best_tiling, best_order, _, _ = best
+    return best_tiling, best_order
 
-def get_loop_instructions(conv_params, tiling, order_type):
+def optimize_for_batch_sizes(conv_params, batch_sizes, tile_candidates='pow2', sweep_candidates=None):
+    """
+    Searches the tiling and loop order of a convolution layer for each of
+    batch_sizes (the B of conv_params is ignored) in a single vectorized
+    search, see optimize_tiling_batch_sweep
+    Returns:
+        list of (best_tiling, best_order), the same as optimize_for_order
+        for each batch size
+    """
+    loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
+    order = list(set(permutations(loops)))
+    results = optimize_tiling_batch_sweep(conv_params, order, batch_sizes, tile_candidates, sweep_candidates)
+    return [(best_tiling, best_order) for best_tiling, best_order, _, _ in results]
+
+def get_pareto_frontier(conv_params, tile_candidates='pow2'):
+    """
+    Returns every tiling and loop order on the Pareto frontier of (total
+    cycles, energy, DRAM bits) for a convolution layer, instead of the single
+    result of optimize_for_order.
+    Returns:
+        list of ParetoPoint, sorted by cycles
+    """
+    loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
+    order = list(set(permutations(loops)))
+    front = get_pareto_batch(conv_params, order, tile_candidates)
+    return [ParetoPoint(cycles, energy, dram_bits, tiling, order_type)
+            for tiling, order_type, cycles, energy, dram_bits in front]
+
+def _get_loop_nest_params(conv_params, tiling, order_type):
+    """
+    Returns the loops (name, loop count, stride), the memory ops
+    (name, namespace, size, is write) and the compute op arguments of a
+    tiling and loop order, or None if the tiles do not fit in the SRAMs
+    """
     acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
     I = (O - 1) * S + K
 
@@ -313,28 +480,16 @@ def get_loop_instructions(conv_params, tiling, order_type):
     instructions['IC/ic'] = [num_ic, I * I * ic, K * K * ic, 0]
     instructions['OC/oc'] = [num_oc, 0, K * K * IC * oc, O * O * oc]
 
-    instruction_ordered = LoopStack()
-    wgt_stride = []
-    act_stride = []
-    out_stride = []
-    count = 0
+    loops = []
     for o in order_type:
         ins = instructions[o]
         if ins[0] > 1:
             stride = {'wgt': ins[2], 'act': ins[1], 'out': ins[3]}
-            instruction_ordered.insert_loop(ins[0], stride=stride, level=count, name=o)
-            wgt_stride.append(stride['wgt'])
-            act_stride.append(stride['act'])
-            out_stride.append(stride['out'])
-            count += 1
-    if count == 0:
+            loops.append((o, ins[0], stride))
+    if len(loops) == 0:
         ins = instructions[o]
         stride = {'wgt': ins[2], 'act': ins[1], 'out': ins[3]}
-        instruction_ordered.insert_loop(ins[0], stride=stride, level=count, name=o)
-        wgt_stride.append(stride['wgt'])
-        act_stride.append(stride['act'])
-        out_stride.append(stride['out'])
-        count += 1
+        loops.append((o, ins[0], stride))
 
     iw = K + (ow - 1) * S
     ih = K + (oh - 1) * S
@@ -394,108 +549,66 @@ def get_loop_instructions(conv_params, tiling, order_type):
     # if underutilization_count > 1:
     #     return
 
+    mem_ops = [('Wgt RD', 'wgt', wgt_read_size, False),
+               ('Act RD', 'act', act_read_size, False),
+               ('Out RD', 'out', out_read_size, False),
+               ('Out WR', 'out', out_read_size, True)]
+    compute_args = (ic, oc, ow, oh, b, K, K, iprec, wprec, im2col)
+    return loops, mem_ops, compute_args
+
+def get_loop_instructions(conv_params, tiling, order_type):
+    acc_obj = conv_params[0]
+    params = _get_loop_nest_params(conv_params, tiling, order_type)
+    if params is None:
+        return
+    loops, mem_ops, compute_args = params
+
+    instruction_ordered = LoopStack()
+    wgt_stride = []
+    act_stride = []
+    out_stride = []
+    count = 0
+    for name, loop_count, stride in loops:
+        instruction_ordered.insert_loop(loop_count, stride=stride, level=count, name=name)
+        wgt_stride.append(stride['wgt'])
+        act_stride.append(stride['act'])
+        out_stride.append(stride['out'])
+        count += 1
+    strides = {'wgt': wgt_stride, 'act': act_stride, 'out': out_stride}
+
     # Memory Instructions
-    instruction_ordered.insert_mem_read(name='Wgt RD', namespace='wgt', addr=0,
-                                        size=wgt_read_size, stride=wgt_stride, level=count - 0)
-    instruction_ordered.insert_mem_read(name='Act RD', namespace='act', addr=0,
-                                        size=act_read_size, stride=act_stride, level=count - 0)
-    instruction_ordered.insert_mem_read(name='Out RD', namespace='out', addr=0,
-                                        size=out_read_size, stride=out_stride, level=count - 0)
-    instruction_ordered.insert_mem_write(name='Out WR', namespace='out', addr=0,
-                                         size=out_read_size, stride=out_stride, level=count - 0)
-    ni = K * K * ic
-    no = oh * ow * oc
-    b = b
-
-    instruction_ordered.insert_compute(acc_obj.get_compute_stats, ic, oc, ow, oh, b, K, K, iprec, wprec, im2col)
+    for name, namespace, size, is_write in mem_ops:
+        if is_write:
+            instruction_ordered.insert_mem_write(name=name, namespace=namespace, addr=0,
+                                                 size=size, stride=strides[namespace], level=count - 0)
+        else:
+            instruction_ordered.insert_mem_read(name=name, namespace=namespace, addr=0,
+                                                size=size, stride=strides[namespace], level=count - 0)
+
+    instruction_ordered.insert_compute(acc_obj.get_compute_stats, *compute_args)
 
     # stats = acc_obj.loop_estimate_stats(instruction_ordered)
     instruction_ordered.promote_mem_ops(acc_obj.sram)
 
     return instruction_ordered
 
-
-def _optimize_for_order(conv_params, order_type, verbose=False):
+def get_loop_nest(conv_params, tiling, order_type):
     """
-    For a given ordering, optimizes tiling
-    Args:
-        conv_params: A tuple with convolution params
-        order_type: ordering loop
+    Returns the flat LoopNest for a tiling and loop order; same model as
+    get_loop_instructions, without the Instruction objects. Returns None if
+    the tiles do not fit in the SRAMs.
     """
-    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
-    I = (O - 1) * S + K
-
-    # We do not tile the "K" dimension and compute an entire 2-D conv at a
-    # time
-    num_O_tiles = int(math.ceil(log2(O))) + 1
-    num_IC_tiles = int(math.ceil(log2(IC))) + 1
-
-    # TODO: Fix?
-    if im2col:
-        num_OC_tiles = int(math.ceil(log2(OC))) + 1
-    else:
-        num_OC_tiles = int(math.ceil(log2(math.ceil(float(OC)/acc_obj.M)))) + 1
-
-    num_B_tiles = int(math.ceil(log2(B))) + 1
-
-    best_cycles = None
-    best_energy = None
-    best_tiling = None
-
-    for _b in range(num_B_tiles):
-        b = min(1 << _b, B)
-        num_b = ceil_a_by_b(B, b)
-
-        for _o in range(num_O_tiles):
-            ow = min(1 << _o, O)
-            oh = ow
-            num_ow = ceil_a_by_b(O, ow)
-            num_oh = ceil_a_by_b(O, oh)
-
-            for _ic in range(num_IC_tiles):
-                ic = min(1 << _ic, IC)
-                num_ic = ceil_a_by_b(IC, ic)
-
-                for _oc in range(num_OC_tiles):
-
-                    if im2col:
-                        oc = min((1 << _oc), OC)
-                    else:
-                        oc = min((1 << _oc) * acc_obj.M, OC)
-
-                    num_oc = ceil_a_by_b(OC, oc)
-
-                    iw = K + (ow - 1) * S
-                    ih = K + (oh - 1) * S
-
-                    tiling = {}
-                    tiling['B/b'] = (num_b, b)
-                    tiling['OW/ow'] = (num_ow, ow)
-                    tiling['OH/oh'] = (num_oh, oh)
-                    tiling['IC/ic'] = (num_ic, ic)
-                    tiling['OC/oc'] = (num_oc, oc)
-
-                    stats = get_stats_fast(conv_params, tiling, order_type, verbose=False)
-
-                    if stats is None:
-                        continue
-
-                    cycles = stats.total_cycles
-                    energy = stats.get_energy(energy_cost)
-                    mem_cycles = stats.mem_stall_cycles
-
-                    if best_cycles is None or best_cycles > cycles or (best_cycles == cycles and best_energy > energy):
-                    # if best_energy is None or best_energy > energy or (best_energy == energy and best_cycles > cycles):
-                        best_energy = energy
-                        best_cycles = cycles
-                        best_mem_cycles = mem_cycles
-                        best_order = order_type
-                        best_tiling = tiling
-
-
-    # if best_cycles is None:
-        # print('Not found')
-        # print(conv_params)
-        # stats = get_stats_fast(conv_params, tiling, order_type, verbose=True)
-
-    return (best_tiling, order_type, best_cycles, best_energy)
+    acc_obj = conv_params[0]
+    params = _get_loop_nest_params(conv_params, tiling, order_type)
+    if params is None:
+        return
+    loops, mem_ops, compute_args = params
+    return LoopNest([name for name, _, _ in loops],
+                    [loop_count for _, loop_count, _ in loops],
+                    [[stride[n] for n in buffer_namespaces] for _, _, stride in loops],
+                    [name for name, _, _, _ in mem_ops],
+                    [buffer_namespaces.index(namespace) for _, namespace, _, _ in mem_ops],
+                    [size for _, _, size, _ in mem_ops],
+                    [is_write for _, _, _, is_write in mem_ops],
+                    acc_obj.get_compute_cycles(*compute_args),
+                    acc_obj.sram)
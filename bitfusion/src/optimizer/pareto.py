@@ -0,0 +1,97 @@
+import logging
+
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Pareto'))
+logger.setLevel(logging.DEBUG)
+
+# One tiling and loop order of a layer, and its cost
+ParetoPoint = namedtuple('ParetoPoint', ['cycles', 'energy', 'dram_bits', 'tiling', 'order'])
+
+# One choice of ParetoPoint per layer, and the network totals
+NetworkPoint = namedtuple('NetworkPoint', ['cycles', 'energy', 'dram_bits', 'layers'])
+
+def get_pareto_indices(costs):
+    """
+    Returns the indices of the rows of costs (one row per point, one column
+    per objective, lower is better) that no other row dominates. Of identical
+    rows, only the first is kept. Indices are in lexicographic order of the
+    costs.
+    """
+    costs = np.asarray(costs)
+    if len(costs) == 0:
+        return np.zeros(0, dtype=np.intp)
+    # np.lexsort sorts by the last key first; the row index breaks ties
+    keys = [np.arange(len(costs))] + [costs[:, i] for i in reversed(range(costs.shape[1]))]
+    order = np.lexsort(keys)
+    sorted_costs = costs[order]
+
+    # The lexicographically smallest remaining row is never dominated by the
+    # others, so keep it and drop every row it dominates (or equals)
+    remaining = np.ones(len(order), dtype=np.bool_)
+    keep = []
+    i = 0
+    while True:
+        left = np.flatnonzero(remaining[i:])
+        if len(left) == 0:
+            break
+        i += left[0]
+        keep.append(order[i])
+        remaining[i:] &= ~np.all(sorted_costs[i:] >= sorted_costs[i], axis=1)
+    return np.array(keep, dtype=np.intp)
+
+def combine_pareto_fronts(layer_fronts, max_cycles=None, max_energy=None):
+    """
+    Returns the network-level Pareto frontier of (cycles, energy) when one
+    point is picked for each layer. Partial sums that exceed a budget are
+    dropped as the layers are combined.
+    Args:
+        layer_fronts: list of (layer name, list of ParetoPoint)
+        max_cycles: latency budget for the network (cycles)
+        max_energy: energy budget for the network
+    Returns:
+        list of NetworkPoint sorted by cycles; layers maps each layer name
+        to its ParetoPoint. Empty if the budgets cannot be met.
+    """
+    # (cycles, energy, dram_bits, index of the point picked for each layer)
+    partial = [(0, 0., 0, ())]
+    for name, points in layer_fronts:
+        combined = []
+        for cycles, energy, dram_bits, choice in partial:
+            for j, p in enumerate(points):
+                c = cycles + p.cycles
+                e = energy + p.energy
+                if max_cycles is not None and c > max_cycles:
+                    continue
+                if max_energy is not None and e > max_energy:
+                    continue
+                combined.append((c, e, dram_bits + p.dram_bits, choice + (j,)))
+        if len(combined) == 0:
+            logger.debug('No points within budget after layer {}'.format(name))
+            return []
+        keep = get_pareto_indices(np.array([(c, e) for c, e, _, _ in combined], dtype=np.float64))
+        partial = [combined[i] for i in keep]
+
+    front = []
+    for cycles, energy, dram_bits, choice in partial:
+        layers = {}
+        for (name, points), j in zip(layer_fronts, choice):
+            layers[name] = points[j]
+        front.append(NetworkPoint(cycles, energy, dram_bits, layers))
+    return front
+
+def select_network_point(layer_fronts, max_cycles=None, max_energy=None):
+    """
+    Picks one point per layer. With a latency budget (max_cycles) the total
+    energy is minimized, otherwise the total cycles are minimized.
+    Returns:
+        NetworkPoint, or None if the budgets cannot be met
+    """
+    front = combine_pareto_fronts(layer_fronts, max_cycles, max_energy)
+    if len(front) == 0:
+        return None
+    if max_cycles is not None:
+        return min(front, key=lambda p: (p.energy, p.cycles))
+    return min(front, key=lambda p: (p.cycles, p.energy))
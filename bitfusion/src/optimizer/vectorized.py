@@ -0,0 +1,587 @@
+import math
+import logging
+
+import numpy as np
+
+from bitfusion.src.utils.utils import log2, ceil_a_by_b, ceil_a_by_b_array
+import bitfusion.src.optimizer.pareto as pareto
+from bitfusion.src.simulator import energy
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Optimizer'))
+logger.setLevel(logging.DEBUG)
+
+# Loop names, in the index order used by all the arrays in this module
+loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
+namespaces = ['wgt', 'act', 'out']
+
+# Same table as optimizer.tile_deps, laid out as loop x namespace
+tile_deps = np.array([
+    # wgt,  act,   out
+    [False, True,  True ], # B/b
+    [False, True,  True ], # OW/ow
+    [False, True,  True ], # OH/oh
+    [True,  True,  False], # IC/ic
+    [True,  False, True ], # OC/oc
+    ], dtype=np.bool_)
+
+# Tile candidate generators accepted by get_tile_candidates
+tile_candidate_types = ['pow2', 'extended']
+
+# Stats of one tile that do not depend on the number of tiles, see
+# get_tile_stats_batch
+#   tile_writes_*: size of one tile for each namespace
+#   valid: whether the tiles fit in half the SRAM
+#   tile_compute_cycles: compute cycles of one tile
+#   tile_latency: DRAM cycles to load the first tiles and store the last
+#       one, a lower bound on the memory stalls of any loop order
+#   tile_reads_act, tile_reads_wgt, tile_out_accesses: SRAM accesses of the
+#       inner loops for one tile
+tile_stats_fields = ['tile_writes_wgt', 'tile_writes_act', 'tile_writes_out', 'valid',
+                     'tile_compute_cycles', 'tile_latency',
+                     'tile_reads_act', 'tile_reads_wgt', 'tile_out_accesses']
+
+def get_pareto_tile_sizes(dim, align=1, max_sizes=8):
+    """
+    Returns tile sizes for a loop of dim iterations that are not dominated in
+    (number of tiles, tile size): for each number of tiles, the smallest tile
+    that is a multiple of align (or dim itself). These include the divisors
+    of dim, which have no padding. At most max_sizes sizes are returned,
+    preferring the least padding and then the fewest tiles.
+    """
+    num_tiles = np.arange(1, dim + 1, dtype=np.int64)
+    tiles = ceil_a_by_b_array(ceil_a_by_b_array(dim, num_tiles), align) * align
+    sizes = np.unique(np.minimum(tiles, dim)).tolist()
+    padding = lambda t: (ceil_a_by_b(dim, t) * t - dim, -t)
+    return sorted(sorted(sizes, key=padding)[:max_sizes])
+
+def _get_extended_sizes(pow2_sizes, dim, align, max_sizes):
+    pow2_sizes = set(pow2_sizes.tolist())
+    extra = [x for x in get_pareto_tile_sizes(dim, align, max_sizes + len(pow2_sizes))
+             if x not in pow2_sizes][:max_sizes]
+    return np.array(sorted(pow2_sizes | set(extra)), dtype=np.int64)
+
+def get_batch_tile_sizes(B, tile_candidates='pow2', max_extra_sizes=8):
+    """
+    Returns the tile sizes searched for the B/b loop, the only tile sizes
+    that depend on the batch size
+    """
+    assert tile_candidates in tile_candidate_types, tile_candidates
+    num_B_tiles = int(math.ceil(log2(B))) + 1
+    b = np.minimum(1 << np.arange(num_B_tiles, dtype=np.int64), B)
+    if tile_candidates == 'extended':
+        b = _get_extended_sizes(b, B, 1, max_extra_sizes)
+    return b
+
+def get_tile_candidates(conv_params, tile_candidates='pow2', max_extra_sizes=8):
+    """
+    Returns the tilings to search as a dict of flat int64 arrays. Candidates
+    are in the same order as the nested (b, ow, ic, oc) loops of the scalar
+    search.
+    Args:
+        tile_candidates: 'pow2' for power-of-two tiles, the tiles of the
+                         original search. 'extended' adds, for each
+                         dimension, up to max_extra_sizes sizes from
+                         get_pareto_tile_sizes, aligned to the systolic
+                         array for IC and OC.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    b = get_batch_tile_sizes(B, tile_candidates, max_extra_sizes)
+    return _get_tile_candidates(conv_params, b, tile_candidates, max_extra_sizes)
+
+def _get_tile_candidates(conv_params, b, tile_candidates, max_extra_sizes):
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    assert tile_candidates in tile_candidate_types, tile_candidates
+
+    num_O_tiles = int(math.ceil(log2(O))) + 1
+    num_IC_tiles = int(math.ceil(log2(IC))) + 1
+    if im2col:
+        num_OC_tiles = int(math.ceil(log2(OC))) + 1
+    else:
+        num_OC_tiles = int(math.ceil(log2(math.ceil(float(OC)/acc_obj.M)))) + 1
+
+    o = np.minimum(1 << np.arange(num_O_tiles, dtype=np.int64), O)
+    ic = np.minimum(1 << np.arange(num_IC_tiles, dtype=np.int64), IC)
+    if im2col:
+        oc = np.minimum(1 << np.arange(num_OC_tiles, dtype=np.int64), OC)
+    else:
+        oc = np.minimum((1 << np.arange(num_OC_tiles, dtype=np.int64)) * acc_obj.M, OC)
+
+    if tile_candidates == 'extended':
+        # Input channels are consumed N * perf_factor at a time (K * K * ic
+        # with im2col), and output channels M at a time
+        ic_align = acc_obj.N * acc_obj.get_perf_factor(iprec, wprec)
+        if im2col:
+            ic_align = next(x for x in range(1, ic_align + 1) if (K * K * x) % ic_align == 0)
+        o = _get_extended_sizes(o, O, 1, max_extra_sizes)
+        ic = _get_extended_sizes(ic, IC, ic_align, max_extra_sizes)
+        oc = _get_extended_sizes(oc, OC, acc_obj.M, max_extra_sizes)
+
+    b, o, ic, oc = [x.ravel() for x in np.meshgrid(b, o, ic, oc, indexing='ij')]
+
+    candidates = {}
+    candidates['b'] = b
+    candidates['ow'] = o
+    candidates['oh'] = o
+    candidates['ic'] = ic
+    candidates['oc'] = oc
+    candidates['num_b'] = ceil_a_by_b_array(B, b)
+    candidates['num_ow'] = ceil_a_by_b_array(O, o)
+    candidates['num_oh'] = ceil_a_by_b_array(O, o)
+    candidates['num_ic'] = ceil_a_by_b_array(IC, ic)
+    candidates['num_oc'] = ceil_a_by_b_array(OC, oc)
+    return candidates
+
+def get_batch_sweep_candidates(conv_params, batch_sizes, tile_candidates='pow2', max_extra_sizes=8):
+    """
+    Returns the candidates of a layer for all of batch_sizes at once: the
+    tilings for the union of their B/b tile sizes, with the stats of
+    get_tile_stats_batch. These do not depend on the number of B/b tiles;
+    see get_batch_candidates.
+    """
+    b = np.unique(np.concatenate([get_batch_tile_sizes(B, tile_candidates, max_extra_sizes)
+                                  for B in batch_sizes]))
+    candidates = _get_tile_candidates(conv_params, b, tile_candidates, max_extra_sizes)
+    candidates.update(get_tile_stats_batch(conv_params, candidates))
+    return candidates
+
+def get_batch_candidates(sweep_candidates, B, tile_candidates='pow2', max_extra_sizes=8):
+    """
+    Returns the candidates of get_tile_candidates for batch size B, in the
+    same order, from the candidates of get_batch_sweep_candidates. Only the
+    number of B/b tiles is recomputed; the tile stats are kept.
+    """
+    mask = np.in1d(sweep_candidates['b'], get_batch_tile_sizes(B, tile_candidates, max_extra_sizes))
+    candidates = get_candidate_subset(sweep_candidates, mask)
+    candidates['num_b'] = ceil_a_by_b_array(B, candidates['b'])
+    return candidates
+
+def get_tiling(candidates, idx):
+    """
+    Returns the tiling dict (as used by get_stats_fast) for candidate idx
+    """
+    tiling = {}
+    tiling['B/b'] = (int(candidates['num_b'][idx]), int(candidates['b'][idx]))
+    tiling['OW/ow'] = (int(candidates['num_ow'][idx]), int(candidates['ow'][idx]))
+    tiling['OH/oh'] = (int(candidates['num_oh'][idx]), int(candidates['oh'][idx]))
+    tiling['IC/ic'] = (int(candidates['num_ic'][idx]), int(candidates['ic'][idx]))
+    tiling['OC/oc'] = (int(candidates['num_oc'][idx]), int(candidates['oc'][idx]))
+    return tiling
+
+def get_tile_writes_batch(conv_params, candidates):
+    """
+    Returns the size of one tile for each namespace, and whether the tiles
+    fit in half the SRAM (double buffering). Does not depend on the loop
+    order.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    b = candidates['b']
+    ow = candidates['ow']
+    oh = candidates['oh']
+    ic = candidates['ic']
+    oc = candidates['oc']
+
+    perf_factor = acc_obj.get_perf_factor(iprec, wprec)
+    oprec = 32
+
+    tile_writes = {}
+    tile_writes['wgt'] = \
+            ceil_a_by_b_array(K * K * ic, acc_obj.N * perf_factor) * acc_obj.N * perf_factor * \
+            oc * wprec
+    if im2col:
+        tile_writes['act'] = ow * oh * K * K * ic * b * iprec
+    else:
+        iw = K + (ow - 1) * S
+        ih = K + (oh - 1) * S
+        tile_writes['act'] = iw * ih * ic * b * iprec
+    tile_writes['out'] = ow * oh * ceil_a_by_b_array(oc, acc_obj.M) * acc_obj.M * b * oprec
+
+    # Skip if overutilizing resources
+    valid = np.ones(b.shape, dtype=np.bool_)
+    for namespace in namespaces:
+        valid &= tile_writes[namespace] <= acc_obj.sram[namespace]*8/2
+    return tile_writes, valid
+
+def get_tile_stats_batch(conv_params, candidates):
+    """
+    Returns a dict with the tile_stats_fields of the candidates. They only
+    depend on the tile sizes, so they are reused from candidates when
+    present (see get_batch_sweep_candidates), and the stats of a tiling are
+    these times its number of tiles.
+    """
+    if all(k in candidates for k in tile_stats_fields):
+        return dict((k, candidates[k]) for k in tile_stats_fields)
+
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    b = candidates['b']
+    ow = candidates['ow']
+    oh = candidates['oh']
+    ic = candidates['ic']
+    oc = candidates['oc']
+    kw = kh = K
+
+    perf_factor = acc_obj.get_perf_factor(iprec, wprec)
+    oprec = 32
+
+    tile_stats = {}
+    tile_writes, tile_stats['valid'] = get_tile_writes_batch(conv_params, candidates)
+    for namespace in namespaces:
+        tile_stats['tile_writes_' + namespace] = tile_writes[namespace]
+    # The loop blocks of get_stats_batch only grow the first reads and the
+    # last writes
+    tile_stats['tile_latency'] = \
+            ceil_a_by_b_array(tile_writes['wgt'] + tile_writes['act'] + tile_writes['out'], acc_obj.mem_if_width) + \
+            ceil_a_by_b_array(tile_writes['out'], acc_obj.mem_if_width)
+
+    if im2col:
+        tile_stats['tile_compute_cycles'] = b * oh * ow * ceil_a_by_b_array(oc, acc_obj.M) * \
+                ceil_a_by_b_array(kw * kh * ic, acc_obj.N * perf_factor)
+    else:
+        tile_stats['tile_compute_cycles'] = b * ceil_a_by_b_array(oc, acc_obj.M) * ow * oh * kw * kh * \
+                ceil_a_by_b_array(ic, acc_obj.N * perf_factor)
+
+    # Inner loop optimizations; these do not depend on the loop order
+    is_loop = ceil_a_by_b_array(oc, acc_obj.M) * acc_obj.M
+    if im2col:
+        os_loop = ceil_a_by_b_array(ic * kh * kw, acc_obj.N * perf_factor) * acc_obj.N * perf_factor
+    else:
+        os_loop = ceil_a_by_b_array(ic, acc_obj.N * perf_factor) * acc_obj.N * perf_factor * kh * kw
+    ws_loop = b * oh * ow
+    is_energy = (os_loop * ws_loop) * (iprec + is_loop * (wprec + oprec))
+    os_energy = (is_loop * ws_loop) * (oprec + os_loop * (iprec + wprec))
+    ws_energy = (os_loop * is_loop) * (wprec + ws_loop * (iprec + oprec))
+
+    min_energy = np.minimum(np.minimum(is_energy, ws_energy), os_energy)
+
+    input_stationary = is_energy == min_energy
+    output_stationary = ~input_stationary & (os_energy == min_energy)
+    conv_size = kw * kh * ic
+    out_size = oc * oh * ow * b
+    tile_stats['tile_reads_act'] = np.where(input_stationary,
+                                            conv_size * ws_loop * iprec,
+                                            conv_size * out_size * iprec)
+    tile_stats['tile_reads_wgt'] = np.where(input_stationary | output_stationary,
+                                            conv_size * ws_loop * oc * wprec,
+                                            conv_size * oc * wprec)
+    tile_stats['tile_out_accesses'] = np.where(output_stationary,
+                                               out_size * oprec,
+                                               conv_size * out_size * oprec)
+    return tile_stats
+
+def get_num_tiles_batch(candidates):
+    """
+    Returns the total number of tiles of each candidate
+    """
+    return candidates['num_b'] * candidates['num_ow'] * candidates['num_oh'] * \
+            candidates['num_ic'] * candidates['num_oc']
+
+def get_compute_cycles_batch(conv_params, candidates):
+    """
+    Batched version of Accelerator.get_compute_cycles, times the number of
+    tiles. Does not depend on the loop order, and is a lower bound on the
+    total cycles of a tiling.
+    """
+    if 'tile_compute_cycles' in candidates:
+        return get_num_tiles_batch(candidates) * candidates['tile_compute_cycles']
+
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    b = candidates['b']
+    ow = candidates['ow']
+    oh = candidates['oh']
+    ic = candidates['ic']
+    oc = candidates['oc']
+    kw = kh = K
+
+    perf_factor = acc_obj.get_perf_factor(iprec, wprec)
+    total_tiles = get_num_tiles_batch(candidates)
+    if im2col:
+        tile_compute_cycles = b * oh * ow * ceil_a_by_b_array(oc, acc_obj.M) * \
+                ceil_a_by_b_array(kw * kh * ic, acc_obj.N * perf_factor)
+    else:
+        tile_compute_cycles = b * ceil_a_by_b_array(oc, acc_obj.M) * ow * oh * kw * kh * \
+                ceil_a_by_b_array(ic, acc_obj.N * perf_factor)
+    return total_tiles * tile_compute_cycles
+
+def get_cycles_lower_bound_batch(conv_params, candidates):
+    """
+    Returns a lower bound on the total cycles of each candidate for any loop
+    order: the compute cycles plus the DRAM latency of one tile
+    """
+    tile_stats = get_tile_stats_batch(conv_params, candidates)
+    return get_num_tiles_batch(candidates) * tile_stats['tile_compute_cycles'] + tile_stats['tile_latency']
+
+def get_candidate_subset(candidates, mask):
+    """
+    Returns the candidates selected by mask, keeping their order
+    """
+    return dict((k, v[mask]) for k, v in candidates.items())
+
+def get_stats_batch(conv_params, candidates, order_types):
+    """
+    Batched version of get_stats_fast.
+    Args:
+        conv_params: A tuple with convolution params
+        candidates: dict of tile arrays from get_tile_candidates
+        order_types: list of loop orders, each a permutation of loops
+    Returns:
+        dict of int64 arrays with shape (len(order_types), num_candidates)
+        holding total_cycles, mem_stall_cycles, and the reads/writes for each
+        namespace. 'valid' is False for tilings that overflow the SRAM.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    tile_stats = get_tile_stats_batch(conv_params, candidates)
+    tile_writes = dict((namespace, tile_stats['tile_writes_' + namespace]) for namespace in namespaces)
+    valid = tile_stats['valid']
+    tile_read_out = tile_writes['out']
+
+    # Loop block optimizations, evaluated for all orders at once. Row p of
+    # each array below belongs to order_types[p]
+    loop_index = dict((l, i) for i, l in enumerate(loops))
+    order_idx = np.array([[loop_index[l] for l in o] for o in order_types], dtype=np.intp)
+    num_orders = len(order_types)
+    shape = (num_orders, valid.size)
+
+    num_tiles = np.stack([candidates['num_b'], candidates['num_ow'], candidates['num_oh'],
+                          candidates['num_ic'], candidates['num_oc']])
+
+    writes = {}
+    max_write_size = {}
+    write_promote = {}
+    for namespace in namespaces:
+        writes[namespace] = np.broadcast_to(tile_writes[namespace], shape).copy()
+        max_write_size[namespace] = writes[namespace].copy()
+        write_promote[namespace] = np.ones(shape, dtype=np.bool_)
+    read_out = np.broadcast_to(tile_read_out, shape).copy()
+    max_read_out = read_out.copy()
+    read_promote = np.ones(shape, dtype=np.bool_)
+
+    for pos in reversed(range(len(loops))):
+        loop_idx = order_idx[:, pos]
+        loop_tiles = num_tiles[loop_idx]
+        for n, namespace in enumerate(namespaces):
+            dep = tile_deps[loop_idx, n][:, np.newaxis]
+            promote = write_promote[namespace]
+            grow = dep | ~promote
+            writes[namespace] = np.where(grow, writes[namespace] * loop_tiles, writes[namespace])
+            check = dep & promote
+            fits = writes[namespace] <= acc_obj.sram[namespace]*8./2
+            write_promote[namespace] = promote & (fits | ~dep)
+            max_write_size[namespace] = np.where(check & fits, writes[namespace], max_write_size[namespace])
+
+        dep = tile_deps[loop_idx, namespaces.index('out')][:, np.newaxis]
+        grow = dep | ~read_promote
+        read_out = np.where(grow, read_out * loop_tiles, read_out)
+        check = dep & read_promote
+        fits = read_out <= acc_obj.sram['out']*8./2
+        read_promote = read_promote & (fits | ~dep)
+        # get_stats_fast records the promoted *write* size here
+        max_read_out = np.where(check & fits, writes['out'], max_read_out)
+
+    stats = {}
+    for namespace in namespaces:
+        stats['writes_' + namespace] = writes[namespace]
+    stats['reads_dram'] = writes['wgt'] + writes['act'] + writes['out']
+    stats['writes_dram'] = read_out
+
+    # Inner loop optimizations, from the tile stats
+    total_tiles = get_num_tiles_batch(candidates)
+    act_reads = total_tiles * tile_stats['tile_reads_act']
+    wgt_reads = total_tiles * tile_stats['tile_reads_wgt']
+    out_accesses = total_tiles * tile_stats['tile_out_accesses']
+
+    stats['reads_act'] = np.broadcast_to(act_reads, shape)
+    stats['reads_wgt'] = np.broadcast_to(wgt_reads, shape)
+    stats['reads_out'] = read_out + out_accesses
+    stats['writes_out'] = stats['writes_out'] + out_accesses
+
+    initial_dram_reads = max_write_size['wgt'] + max_write_size['act'] + max_write_size['out']
+    final_dram_writes = max_read_out
+    latency = ceil_a_by_b_array(initial_dram_reads, acc_obj.mem_if_width) + \
+            ceil_a_by_b_array(final_dram_writes, acc_obj.mem_if_width)
+
+    total_dram_accesses = stats['reads_dram'] + stats['writes_dram']
+    middle_dram_accesses = total_dram_accesses - initial_dram_reads - final_dram_writes
+
+    compute_cycles = total_tiles * tile_stats['tile_compute_cycles']
+    memory_cycles_required = ceil_a_by_b_array(middle_dram_accesses, acc_obj.mem_if_width)
+
+    memory_stalls = np.maximum(0, memory_cycles_required - compute_cycles) + latency
+    stats['total_cycles'] = compute_cycles + memory_stalls
+    stats['mem_stall_cycles'] = memory_stalls
+    stats['valid'] = np.broadcast_to(valid, shape)
+
+    return stats
+
+def get_energy_batch(stats, energy_cost, dram_cost=None):
+    """
+    Batched version of Stats.get_energy for the arrays from get_stats_batch
+    """
+    counts = [stats['total_cycles'] - stats['mem_stall_cycles']]
+    counts += [stats[x] for x in energy.access_fields[1:]]
+    counts = np.stack(np.broadcast_arrays(*counts), axis=-1)
+    return energy.get_energy(counts, energy.get_access_costs(energy_cost, dram_cost))
+
+def optimize_tiling_batch(conv_params, order_types, tile_candidates='pow2', candidates=None):
+    """
+    Searches all tilings for all the loop orders in order_types at once.
+    Picks the same tiling and order as the scalar search of
+    optimizer._branch_and_bound (optimize_for_order with vectorized=False).
+    Args:
+        tile_candidates: tile candidate generator, see get_tile_candidates
+        candidates: precomputed candidates for conv_params, e.g. from
+                    get_batch_candidates. Their tile stats are reused if
+                    present.
+    Returns:
+        (best_tiling, best_order, best_cycles, best_energy)
+    """
+    order_types = list(order_types)
+    if candidates is None:
+        candidates = get_tile_candidates(conv_params, tile_candidates)
+    segments = np.zeros(len(candidates['b']), dtype=np.intp)
+    return _search_segments(conv_params, order_types, candidates, segments, 1)[0]
+
+def optimize_tiling_batch_sweep(conv_params, order_types, batch_sizes, tile_candidates='pow2',
+                                sweep_candidates=None):
+    """
+    Returns the result of optimize_tiling_batch for each of batch_sizes (the
+    B of conv_params is ignored), from a single search. The tile stats are
+    computed once for the layer (see get_batch_sweep_candidates), and the
+    tilings of all the batch sizes, which only differ in their number of B/b
+    tiles, are evaluated together.
+    Args:
+        sweep_candidates: precomputed candidates from
+                          get_batch_sweep_candidates for batch_sizes
+    Returns:
+        list of (best_tiling, best_order, best_cycles, best_energy)
+    """
+    order_types = list(order_types)
+    if sweep_candidates is None:
+        sweep_candidates = get_batch_sweep_candidates(conv_params, batch_sizes, tile_candidates)
+    # The candidates of get_batch_candidates for each batch size, one after
+    # the other, gathered at once. Tilings that overflow the SRAM are
+    # dropped first, since that does not depend on the batch size.
+    valid = sweep_candidates['valid']
+    idx = []
+    batch = []
+    for B in batch_sizes:
+        mask = valid & np.in1d(sweep_candidates['b'], get_batch_tile_sizes(B, tile_candidates))
+        idx.append(np.flatnonzero(mask))
+        batch.append(np.full(idx[-1].size, B, dtype=np.int64))
+    candidates = get_candidate_subset(sweep_candidates, np.concatenate(idx))
+    candidates['num_b'] = ceil_a_by_b_array(np.concatenate(batch), candidates['b'])
+    segments = np.repeat(np.arange(len(batch_sizes), dtype=np.intp), [x.size for x in idx])
+    return _search_segments(conv_params, order_types, candidates, segments, len(batch_sizes))
+
+def _search_segments(conv_params, order_types, candidates, segments, num_segments, num_seeds=16):
+    """
+    Searches the best tiling and order of each segment of the candidates,
+    where segments holds the segment of each candidate. Returns a list of
+    (best_tiling, best_order, best_cycles, best_energy) per segment.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    # Branch and bound on the tilings: total cycles are never below
+    # get_cycles_lower_bound_batch, which does not depend on the order.
+    # Evaluate the num_seeds tilings with the lowest bound of each segment
+    # first, then only the tilings whose bound does not exceed the cycles
+    # found for them.
+    candidates = dict(candidates)
+    candidates.update(get_tile_stats_batch(conv_params, candidates))
+    valid = candidates['valid']
+    bound = get_cycles_lower_bound_batch(conv_params, candidates)
+    seeds = []
+    for segment in range(num_segments):
+        mask = valid & (segments == segment)
+        idx = np.flatnonzero(mask)
+        seeds.extend(idx[np.argsort(bound[idx], kind='mergesort')[:num_seeds]])
+
+    results = [(None, None, None, None)] * num_segments
+    if len(seeds) == 0:
+        return results
+
+    seed_stats = get_stats_batch(conv_params, get_candidate_subset(candidates, seeds), order_types)
+    # Segments without a valid tiling keep a negative incumbent, below any
+    # bound
+    incumbent = np.full(num_segments, -1, dtype=np.int64)
+    seed_segments = segments[seeds]
+    seed_cycles = seed_stats['total_cycles'].min(axis=0)
+    for segment in np.unique(seed_segments):
+        incumbent[segment] = seed_cycles[seed_segments == segment].min()
+    keep = valid & (bound <= incumbent[segments])
+    candidates = get_candidate_subset(candidates, keep)
+    segments = segments[keep]
+
+    stats = get_stats_batch(conv_params, candidates, order_types)
+    valid = stats['valid']
+
+    cycles = stats['total_cycles']
+    energy = get_energy_batch(stats, energy_cost)
+
+    for segment in np.unique(segments):
+        idx = np.flatnonzero(segments == segment)
+        segment_valid = valid[:, idx]
+        segment_cycles = cycles[:, idx]
+        segment_energy = energy[:, idx]
+        best = segment_valid & (segment_cycles == segment_cycles[segment_valid].min())
+        best &= segment_energy == segment_energy[best].min()
+        order_id, i = np.unravel_index(np.argmax(best), best.shape)
+        candidate_id = idx[i]
+
+        best_tiling = get_tiling(candidates, candidate_id)
+        best_order = order_types[order_id]
+        best_cycles = int(cycles[order_id, candidate_id])
+        best_energy = float(energy[order_id, candidate_id])
+        results[segment] = (best_tiling, best_order, best_cycles, best_energy)
+
+    return results
+
+def get_pareto_batch(conv_params, order_types, tile_candidates='pow2', block_size=1024):
+    """
+    Returns the tilings and orders on the Pareto frontier of (total cycles,
+    energy, DRAM bits), evaluated block_size tilings at a time.
+    Returns:
+        list of (tiling, order_type, cycles, energy, dram_bits), sorted by
+        cycles. Of points with the same cost, the one found first by the
+        search in optimize_tiling_batch is kept.
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+
+    order_types = list(order_types)
+    candidates = get_tile_candidates(conv_params, tile_candidates)
+    tile_writes, valid = get_tile_writes_batch(conv_params, candidates)
+    candidates = get_candidate_subset(candidates, valid)
+    num_candidates = len(candidates['b'])
+
+    # Frontier of each block, then the frontier of their union
+    points = []
+    costs = []
+    for start in range(0, num_candidates, block_size):
+        block = get_candidate_subset(candidates, slice(start, start + block_size))
+        stats = get_stats_batch(conv_params, block, order_types)
+        cycles = stats['total_cycles']
+        energy = get_energy_batch(stats, energy_cost)
+        dram_bits = stats['reads_dram'] + stats['writes_dram']
+        # Order-major flattening, as in the search
+        block_costs = np.stack([cycles.ravel(), energy.ravel(), dram_bits.ravel()], axis=1)
+        for i in pareto.get_pareto_indices(block_costs):
+            order_id, candidate_id = np.unravel_index(i, cycles.shape)
+            points.append((order_id, start + candidate_id))
+            costs.append((int(cycles.flat[i]), float(energy.flat[i]), int(dram_bits.flat[i])))
+
+    if len(points) == 0:
+        return []
+
+    # Restore the search order before merging, so that ties keep the same
+    # point as optimize_tiling_batch
+    ranked = sorted(range(len(points)), key=lambda i: points[i])
+    points = [points[i] for i in ranked]
+    costs = [costs[i] for i in ranked]
+    front = []
+    for i in pareto.get_pareto_indices(np.array(costs, dtype=np.float64)):
+        order_id, candidate_id = points[i]
+        cycles, energy, dram_bits = costs[i]
+        front.append((get_tiling(candidates, candidate_id), order_types[order_id], cycles, energy, dram_bits))
+    return front
@@ -1,5 +1,7 @@
 from collections import namedtuple
 
+import numpy as np
+
 BaseEnergyTuple = namedtuple('BaseEnergyTuple',
         ['core_dynamic_energy',
          'wbuf_read_energy',
@@ -8,8 +10,11 @@ BaseEnergyTuple = namedtuple('BaseEnergyTuple',
          'ibuf_write_energy',
          'obuf_read_energy',
          'obuf_write_energy',
+         'dram_energy',
         ],
         verbose=False)
+# DRAM energy defaults to 15 pJ/bit
+BaseEnergyTuple.__new__.__defaults__ = (15.e-3,)
 
 class EnergyTuple(BaseEnergyTuple):
     def __str__(self):
@@ -22,4 +27,104 @@ class EnergyTuple(BaseEnergyTuple):
         ret+='IBUF Write energy   : {:.3f} pJ/bit\n'.format(self.ibuf_write_energy*1.e3)
         ret+='OBUF Read energy    : {:.3f} pJ/bit\n'.format(self.obuf_read_energy*1.e3)
         ret+='OBUF Write energy   : {:.3f} pJ/bit\n'.format(self.obuf_write_energy*1.e3)
+        ret+='DRAM energy         : {:.3f} pJ/bit\n'.format(self.dram_energy*1.e3)
         return ret
+
+# Columns of an access-count matrix, in the order the energy is summed.
+# core_cycles are the cycles the core is not stalled on memory.
+access_fields = ['core_cycles',
+                 'reads_wgt', 'writes_wgt',
+                 'reads_act', 'writes_act',
+                 'reads_out', 'writes_out',
+                 'reads_dram', 'writes_dram']
+
+# Energy breakdown categories: access_fields summed into each category
+breakdown_fields = ['core', 'sram', 'leak', 'dram']
+_breakdown_access = [access_fields[0:1], access_fields[1:7], [], access_fields[7:9]]
+
+def get_dram_cost(energy_cost, dram_cost=None):
+    """
+    Returns dram_cost if given, else the DRAM energy of energy_cost
+    (15 pJ/bit for cost tuples without one)
+    """
+    if dram_cost is not None:
+        return dram_cost
+    return getattr(energy_cost, 'dram_energy', 15.e-3)
+
+def get_access_costs(energy_costs, dram_cost=None):
+    """
+    Returns the energy per access for each of access_fields
+    Args:
+        energy_costs: an EnergyTuple, or a list of them
+        dram_cost: overrides the DRAM energy (per bit) of energy_costs
+    Returns:
+        array of shape (len(access_fields),), or
+        (len(energy_costs), len(access_fields)) for a list
+    """
+    if hasattr(energy_costs, 'core_dynamic_energy'):
+        energy_costs = [energy_costs]
+        squeeze = True
+    else:
+        squeeze = False
+    costs = np.empty((len(energy_costs), len(access_fields)), dtype=np.float64)
+    for i, e in enumerate(energy_costs):
+        dram = get_dram_cost(e, dram_cost)
+        costs[i] = (e.core_dynamic_energy,
+                    e.wbuf_read_energy, e.wbuf_write_energy,
+                    e.ibuf_read_energy, e.ibuf_write_energy,
+                    e.obuf_read_energy, e.obuf_write_energy,
+                    dram, dram)
+    if squeeze:
+        return costs[0]
+    return costs
+
+def _prepare(counts, costs):
+    counts = np.asarray(counts)
+    costs = np.asarray(costs, dtype=np.float64)
+    assert counts.shape[-1] == len(access_fields)
+    assert costs.shape[-1] == len(access_fields)
+    if costs.ndim > 1:
+        # One result per (count row, cost row)
+        counts = np.expand_dims(counts, -2)
+    return counts, costs
+
+def _get_partial_energy(counts, costs, names):
+    energy = None
+    for name in names:
+        j = access_fields.index(name)
+        term = counts[..., j] * costs[..., j]
+        energy = term if energy is None else energy + term
+    return energy
+
+def get_energy(counts, costs):
+    """
+    Returns the dynamic energy for every row of an access-count matrix.
+    The terms are summed in the same order as Stats.get_energy, so the
+    results match the scalar version exactly.
+    Args:
+        counts: access counts of shape (..., len(access_fields)), see
+                stats.get_access_counts
+        costs: energy per access, as returned by get_access_costs, either
+               one vector or a matrix with one row per configuration
+    Returns:
+        array of shape counts.shape[:-1] for a cost vector, or
+        counts.shape[:-1] + (len(costs),) for a cost matrix
+    """
+    counts, costs = _prepare(counts, costs)
+    return _get_partial_energy(counts, costs, access_fields)
+
+def get_energy_breakdown(counts, costs):
+    """
+    Returns the energy breakdown (as in Stats.get_energy_breakdown) for every
+    row of an access-count matrix
+    Returns:
+        array of the shape returned by get_energy, with an extra last axis
+        laid out as in breakdown_fields
+    """
+    counts, costs = _prepare(counts, costs)
+    shape = np.broadcast(counts[..., 0], costs[..., 0]).shape
+    breakdown = np.zeros(shape + (len(breakdown_fields),), dtype=np.float64)
+    for i, names in enumerate(_breakdown_access):
+        if len(names) > 0:
+            breakdown[..., i] = _get_partial_energy(counts, costs, names)
+    return breakdown
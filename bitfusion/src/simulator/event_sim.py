@@ -0,0 +1,354 @@
+import heapq
+import logging
+
+from collections import deque, namedtuple
+
+from bitfusion.src.simulator.stats import Stats
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'EventSim'))
+logger.setLevel(logging.DEBUG)
+
+# One compute tile: when it ran, how long the systolic array waited for it,
+# and the memory op it waited on (None if it did not wait)
+TileTrace = namedtuple('TileTrace', ['tile', 'start', 'end', 'stall', 'cause'])
+
+# Result of simulate_loop_nest
+#   stats: Stats, with the access counts of LoopNest.get_stats
+#   stall_cycles: dict of stall cycles, by the name of the memory op waited on
+#   dram_busy_cycles: cycles the DRAM channel was transferring data
+#   tiles: list of TileTrace for the simulated tiles (trace=True), else None
+#   skipped_tiles: number of tiles extrapolated from periodic behavior
+EventSimResult = namedtuple('EventSimResult', ['stats', 'stall_cycles', 'dram_busy_cycles', 'tiles', 'skipped_tiles'])
+
+class EventQueue(object):
+    """
+    Min-heap of events; events at the same time pop in insertion order
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+
+    def push(self, time, event):
+        heapq.heappush(self._heap, (time, self._seq, event))
+        self._seq += 1
+
+    def pop(self):
+        time, _, event = heapq.heappop(self._heap)
+        return time, event
+
+    def shift(self, delta):
+        self._heap = [(t + delta, seq, event) for t, seq, event in self._heap]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+def _prod(values):
+    ret = 1
+    for v in values:
+        ret *= v
+    return ret
+
+class EventSimulator(object):
+    """
+    Discrete-event simulation of a LoopNest, tile by tile.
+
+    Resources:
+        DRAM channel: one transfer at a time, ceil(size / if_width) cycles
+                      each. Writes back to DRAM go first, then reads in
+                      program order.
+        SRAMs: each memory op has two halves (ping-pong). Instance j of a
+               read can only start once instance j-2 is no longer used: its
+               last compute is done, or, for an output tile, it has been
+               written back.
+        Systolic array: one compute tile at a time, once all of its inputs
+                        are in the SRAMs.
+    The time the systolic array waits before each tile is attributed to the
+    memory op that completed last.
+
+    With skip_steady_state, the state is compared at the start of each
+    iteration of every loop. Once two consecutive iterations of a loop start
+    in the same state (relative to the current tile and time), the following
+    iterations repeat with the same period, so all but the last few before
+    the end of the enclosing loop are extrapolated instead of simulated.
+    """
+
+    # Iterations kept before the end of the enclosing loop when skipping
+    skip_margin = 3
+
+    def __init__(self, loop_nest, acc_obj, skip_steady_state=True, trace=False):
+        self.loop_nest = loop_nest
+        self.acc_obj = acc_obj
+        self.skip_steady_state = skip_steady_state
+        self.trace = trace
+
+        counts = loop_nest.loop_counts.tolist()
+        levels = loop_nest.mem_levels.tolist()
+        is_write = loop_nest.mem_is_write.tolist()
+        namespaces = [loop_nest.get_mem_namespace(i) for i in range(len(levels))]
+
+        # Compute tiles per iteration of each loop, and in total
+        self.loop_span = [_prod(counts[k + 1:]) for k in range(len(counts))]
+        self.num_tiles = _prod(counts)
+        self.compute_cycles = loop_nest.compute_cycles
+
+        self.op_names = list(loop_nest.mem_names)
+        # Compute tiles per instance of each memory op
+        self.op_span = [_prod(counts[l:]) for l in levels]
+        self.op_cycles = []
+        for i, size in enumerate(loop_nest.mem_sizes.tolist()):
+            if is_write[i]:
+                self.op_cycles.append(acc_obj.get_mem_write_cycles(namespaces[i], size))
+            else:
+                self.op_cycles.append(acc_obj.get_mem_read_cycles(namespaces[i], size))
+        self.reads = [i for i in range(len(levels)) if not is_write[i]]
+        self.writes = [i for i in range(len(levels)) if is_write[i]]
+
+        # A read and a write of the same buffer and level share the SRAM
+        # halves, e.g. partial sums read into the OBUF and written back
+        self.op_pair = [None] * len(levels)
+        for r in self.reads:
+            for w in self.writes:
+                if namespaces[r] == namespaces[w] and levels[r] == levels[w] and self.op_pair[w] is None:
+                    self.op_pair[r] = w
+                    self.op_pair[w] = r
+                    break
+
+    def _reset(self):
+        n = len(self.op_names)
+        self.now = 0
+        self.events = EventQueue()
+        # Number of issued and completed instances of each op
+        self.issued = [0] * n
+        self.completed = [0] * n
+        # Completion time of the most recent instances of each op
+        self.done_time = [{} for _ in range(n)]
+        self.next_tile = 0
+        self.tiles_done = 0
+        self.compute_busy = False
+        self.last_compute_end = 0
+        # (op, instance, end time) of the transfer on the DRAM channel
+        self.channel = None
+        self.last_transfer = None
+        self.write_queue = deque()
+        self.stall_cycles = dict((name, 0) for name in self.op_names)
+        self.dram_busy_cycles = 0
+        self.skipped_tiles = 0
+        self.tiles = [] if self.trace else None
+        self.checkpoints = [None] * len(self.loop_span)
+
+    def _get_next_read(self):
+        """
+        Returns the next read in program order, or None
+        """
+        best = None
+        for m in self.reads:
+            j = self.issued[m]
+            if j * self.op_span[m] >= self.num_tiles:
+                continue
+            tile = j * self.op_span[m]
+            if best is None or tile < best[0]:
+                best = (tile, m, j)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def _is_buffer_free(self, m, j):
+        if j < 2:
+            return True
+        w = self.op_pair[m]
+        if w is not None:
+            return self.completed[w] >= j - 1
+        return self.tiles_done >= (j - 1) * self.op_span[m]
+
+    def _get_compute_deps(self, tile):
+        """
+        Returns the (op, instance) the compute tile waits for, or None if one
+        of them is not complete yet
+        """
+        deps = []
+        for m in self.reads:
+            j = tile // self.op_span[m]
+            if self.completed[m] <= j:
+                return None
+            deps.append((m, j))
+        for w in self.writes:
+            if self.op_pair[w] is not None or tile % self.op_span[w] != 0:
+                continue
+            j = tile // self.op_span[w]
+            if j >= 2:
+                if self.completed[w] < j - 1:
+                    return None
+                deps.append((w, j - 2))
+        return deps
+
+    def _complete(self, m, j):
+        self.completed[m] = j + 1
+        self.done_time[m][j] = self.now
+        for old in [x for x in self.done_time[m] if x < j - 2]:
+            del self.done_time[m][old]
+
+    def _start_compute(self, deps):
+        tile = self.next_tile
+        stall = self.now - self.last_compute_end
+        cause = None
+        if stall > 0:
+            latest = None
+            for m, j in deps:
+                t = self.done_time[m].get(j, 0)
+                if latest is None or t > latest:
+                    latest = t
+                    cause = self.op_names[m]
+            if cause is not None:
+                self.stall_cycles[cause] += stall
+        end = self.now + self.compute_cycles
+        if self.tiles is not None:
+            self.tiles.append(TileTrace(tile, self.now, end, stall, cause))
+        self.next_tile += 1
+        self.compute_busy = True
+        self.events.push(end, 'compute')
+
+    def _start_transfer(self, m, j):
+        end = self.now + self.op_cycles[m]
+        self.channel = (m, j, end)
+        self.issued[m] = j + 1
+        self.dram_busy_cycles += self.op_cycles[m]
+        self.events.push(end, 'dram')
+
+    def _dispatch(self):
+        if not self.compute_busy and self.next_tile < self.num_tiles:
+            deps = self._get_compute_deps(self.next_tile)
+            if deps is not None:
+                if self.skip_steady_state and self._checkpoint():
+                    deps = self._get_compute_deps(self.next_tile)
+                self._start_compute(deps)
+        if self.channel is None:
+            if len(self.write_queue) > 0:
+                w, j = self.write_queue.popleft()
+                self._start_transfer(w, j)
+            else:
+                read = self._get_next_read()
+                if read is not None and self._is_buffer_free(*read):
+                    self._start_transfer(*read)
+
+    def _get_signature(self, tile):
+        """
+        State relative to tile and the current time; times before the end of
+        the last compute tile no longer matter
+        """
+        rel = lambda t: max(t, self.last_compute_end) - self.now
+        sig = [self.now - self.last_compute_end, self.tiles_done - tile]
+        for m in range(len(self.op_names)):
+            base = tile // self.op_span[m]
+            c = self.completed[m]
+            sig.append((self.issued[m] - base, c - base,
+                        tuple(rel(self.done_time[m][j]) for j in range(c - 3, c) if j in self.done_time[m])))
+        if self.channel is not None:
+            m, j, end = self.channel
+            sig.append((m, j - tile // self.op_span[m], end - self.now))
+        sig.append(tuple((w, j - tile // self.op_span[w]) for w, j in self.write_queue))
+        return tuple(sig)
+
+    def _checkpoint(self):
+        """
+        Records the state at the start of a loop iteration, and skips ahead
+        if the loop has reached a periodic steady state. Returns True if it
+        skipped.
+        """
+        tile = self.next_tile
+        sig = None
+        for k, span in enumerate(self.loop_span):
+            if tile % span != 0:
+                continue
+            if sig is None:
+                sig = self._get_signature(tile)
+            prev = self.checkpoints[k]
+            self.checkpoints[k] = (tile, self.now, sig, self.dram_busy_cycles, dict(self.stall_cycles))
+            outer = self.loop_span[k - 1] if k > 0 else self.num_tiles
+            # Both iterations must be in the same iteration of the enclosing
+            # loop, where every iteration has the same memory ops
+            if prev is None or prev[0] != tile - span or prev[0] // outer != tile // outer or prev[2] != sig:
+                continue
+            boundary = (tile // outer + 1) * outer
+            n = (boundary - tile) // span - self.skip_margin
+            if n <= 0:
+                continue
+            self._skip(n, span, prev)
+            # Checkpoints of the enclosing loops stay valid; those of the
+            # inner loops are from skipped iterations
+            self.checkpoints[k] = (self.next_tile, self.now, sig, self.dram_busy_cycles, dict(self.stall_cycles))
+            for inner in range(k + 1, len(self.loop_span)):
+                self.checkpoints[inner] = None
+            return True
+        return False
+
+    def _skip(self, n, span, prev):
+        """
+        Advances the state by n periods of span tiles each
+        """
+        _, prev_now, _, prev_busy, prev_stall = prev
+        dt = n * (self.now - prev_now)
+        shift = [n * span // s if s <= span else 0 for s in self.op_span]
+
+        self.now += dt
+        self.last_compute_end += dt
+        self.events.shift(dt)
+        for m in range(len(self.op_names)):
+            self.issued[m] += shift[m]
+            self.completed[m] += shift[m]
+            self.done_time[m] = dict((j + shift[m], t + dt) for j, t in self.done_time[m].items())
+        if self.channel is not None:
+            m, j, end = self.channel
+            self.channel = (m, j + shift[m], end + dt)
+        self.write_queue = deque((w, j + shift[w]) for w, j in self.write_queue)
+        self.next_tile += n * span
+        self.tiles_done += n * span
+        self.skipped_tiles += n * span
+        for name in self.stall_cycles:
+            self.stall_cycles[name] += n * (self.stall_cycles[name] - prev_stall[name])
+        self.dram_busy_cycles += n * (self.dram_busy_cycles - prev_busy)
+
+    def run(self):
+        """
+        Simulates the loop nest and returns an EventSimResult
+        """
+        self._reset()
+        self._dispatch()
+        while len(self.events) > 0:
+            self.now, event = self.events.pop()
+            if event == 'compute':
+                self.compute_busy = False
+                self.last_compute_end = self.now
+                tile = self.tiles_done
+                self.tiles_done += 1
+                for w in self.writes:
+                    if (tile + 1) % self.op_span[w] == 0:
+                        self.write_queue.append((w, tile // self.op_span[w]))
+            else:
+                m, j, _ = self.channel
+                self.channel = None
+                self.last_transfer = m
+                self._complete(m, j)
+            self._dispatch()
+        assert self.tiles_done == self.num_tiles
+
+        # Writes after the last compute tile
+        tail = self.now - self.last_compute_end
+        if tail > 0:
+            self.stall_cycles[self.op_names[self.last_transfer]] += tail
+
+        stats = self.loop_nest.get_stats(self.acc_obj)['total']
+        stats.total_cycles = self.now
+        stats.mem_stall_cycles = self.now - self.compute_cycles * self.num_tiles
+        if self.skipped_tiles > 0:
+            logger.debug('Extrapolated {} of {} tiles'.format(self.skipped_tiles, self.num_tiles))
+        return EventSimResult(stats, self.stall_cycles, self.dram_busy_cycles, self.tiles, self.skipped_tiles)
+
+def simulate_loop_nest(loop_nest, acc_obj, skip_steady_state=True, trace=False):
+    """
+    Runs the event-driven simulation of a LoopNest; see EventSimulator
+    Returns:
+        EventSimResult
+    """
+    return EventSimulator(loop_nest, acc_obj, skip_steady_state, trace).run()
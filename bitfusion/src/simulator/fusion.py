@@ -0,0 +1,238 @@
+import logging
+
+from collections import namedtuple, OrderedDict
+
+from dnnweaver2.tensorOps.cnn import Convolution, MatMul, TypeCastOp, MaxPooling, Flatten, AddBias, LeakyReLU, BatchNorm
+
+from bitfusion.src.utils.utils import ceil_a_by_b
+from bitfusion.src.simulator.stats import Stats
+from bitfusion.src.optimizer.optimizer import get_canonical_order
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Fusion'))
+logger.setLevel(logging.DEBUG)
+
+# Ops the simulator runs on the accelerator
+compute_ops = (Convolution, MatMul)
+
+# Ops applied to the outputs on-chip, on their way from the OBUF to the next
+# layer, without a round trip through DRAM
+on_chip_ops = (TypeCastOp, MaxPooling, Flatten, AddBias, LeakyReLU, BatchNorm)
+
+# A producer and the ops consuming its outputs
+#   producer: name of the compute op
+#   consumer: name of the compute op reading its outputs, or None if the
+#             outputs go to anything else (or to several ops)
+#   on_chip_ops: names of the on_chip_ops in between
+#   tensor_bits: size of the tensor the consumer reads, in bits
+#   on_chip: True if that tensor stays in the IBUF instead of DRAM
+#   producer_dram_bits_saved: DRAM writes saved by the producer
+#   consumer_dram_bits_saved: DRAM reads saved by the consumer
+FusionPair = namedtuple('FusionPair', ['producer', 'consumer', 'on_chip_ops', 'tensor_bits', 'on_chip',
+                                       'producer_dram_bits_saved', 'consumer_dram_bits_saved'])
+
+# Loops of a producer's outputs and the loop of the consumer's inputs each
+# maps to; a flattened MatMul input interleaves the channels and the rows and
+# columns of the producer
+_conv_input_loops = {'B/b': 'B/b', 'OC/oc': 'IC/ic', 'OH/oh': 'OH/oh', 'OW/ow': 'OW/ow'}
+_fc_input_loops = {'B/b': 'B/b', 'OC/oc': 'IC/ic', 'OH/oh': 'IC/ic', 'OW/ow': 'IC/ic'}
+
+def _get_bits(tensor):
+    return int(tensor.size) * tensor.dtype.bits
+
+def get_layer_tilings(graph, sim_obj):
+    """
+    Returns the (tiling, order) the simulator picked for every compute op of
+    graph, by op name; the layers hit the layer cache after
+    get_bench_numbers
+    """
+    tilings = {}
+    for opname, op in graph.op_registry.iteritems():
+        params = sim_obj.get_layer_params(op)
+        if params is None:
+            continue
+        K, O, S, IC, OC, iprec, wprec, B, im2col = params
+        conv_params = (sim_obj.accelerator, K, O, S, IC, OC, B, iprec, wprec, im2col,
+                       sim_obj.get_energy_cost())
+        _, tiling, order = sim_obj.get_layer_stats(conv_params)
+        tilings[opname] = (tiling, order)
+    return tilings
+
+def is_tiling_compatible(producer, consumer, tilings):
+    """
+    Returns True if the consumer reads the producer's outputs in whole
+    tiles, in the order they are produced: the number of tiles of each loop
+    over the consumer's inputs (batch, input channels, rows, columns)
+    divides the number of tiles of the producer's loops it maps to, and the
+    loops tiled in the consumer nest in the same order in both. The
+    consumer's output channel loop, and the producer's input channel loop,
+    do not matter.
+    Args:
+        producer, consumer: compute ops
+        tilings: dict of (tiling, order) per op name, as from
+                 get_layer_tilings
+    """
+    if producer.name not in tilings or consumer.name not in tilings:
+        return False
+    producer_tiling, producer_order = tilings[producer.name]
+    consumer_tiling, consumer_order = tilings[consumer.name]
+    loops = _fc_input_loops if isinstance(consumer, MatMul) else _conv_input_loops
+
+    num_tiles = dict((loop, 1) for loop in loops.values())
+    for loop, consumer_loop in loops.items():
+        num_tiles[consumer_loop] *= producer_tiling[loop][0]
+    for consumer_loop, n in num_tiles.items():
+        if n % consumer_tiling[consumer_loop][0] != 0:
+            return False
+
+    consumer_loops = [loop for loop in get_canonical_order(consumer_order, consumer_tiling)
+                      if loop in num_tiles]
+    order = []
+    for loop in get_canonical_order(producer_order, producer_tiling):
+        if loops.get(loop) not in consumer_loops:
+            continue
+        if len(order) == 0 or order[-1] != loops[loop]:
+            order.append(loops[loop])
+    return order == consumer_loops
+
+def get_fusion_chains(graph):
+    """
+    Returns (producer, on-chip ops, consumer) for every compute op in graph.
+    Starting from the producer, ops are followed while each tensor has
+    exactly one consumer and that consumer is one of on_chip_ops. consumer
+    is the compute op reading the last tensor as its data input, or None.
+    """
+    chains = []
+    for opname, op in graph.op_registry.iteritems():
+        if not isinstance(op, compute_ops):
+            continue
+        ops = []
+        consumer = None
+        tensor = op.output_tensors
+        while len(tensor.output_nodes) == 1:
+            next_op = tensor.output_nodes[0]
+            if isinstance(next_op, on_chip_ops):
+                ops.append(next_op)
+                tensor = next_op.output_tensors
+                continue
+            if isinstance(next_op, compute_ops) and next_op.data is tensor:
+                consumer = next_op
+            break
+        chains.append((op, ops, consumer))
+    return chains
+
+def get_fusion_pairs(graph, stats, tilings, acc_obj):
+    """
+    Finds the producer/consumer pairs of graph and the DRAM traffic that
+    fusing them saves.
+
+    The outputs of a producer go through the on-chip ops (type casts,
+    pooling, ...) to its consumer. If the tensor the consumer reads fits in
+    half of the IBUF (the other half holds the next layer's input), and the
+    consumer reads it in the tiles and order the producer writes it (see
+    is_tiling_compatible), it stays on-chip: the producer does not write its
+    outputs back to DRAM, and the consumer reads no activations from DRAM.
+    Otherwise, pooling is still applied before the write back, so the
+    producer only writes the pooled outputs.
+    Args:
+        stats: dict of Stats per op name, as from get_bench_numbers
+        tilings: dict of (tiling, order) per op name, as from
+                 get_layer_tilings
+        acc_obj: Accelerator
+    Returns:
+        list of FusionPair
+    """
+    ibuf_bits = acc_obj.sram['act'] * 8 / 2.0
+    oprec = 32
+
+    pairs = []
+    for producer, ops, consumer in get_fusion_chains(graph):
+        if producer.name not in stats:
+            continue
+        # The simulator writes the outputs back with oprec bits per element
+        out_bits = int(producer.output_tensors.size) * oprec
+        out_bits = min(out_bits, stats[producer.name].writes['dram'])
+
+        if consumer is not None and consumer.name in stats:
+            tensor_bits = _get_bits(consumer.data)
+            on_chip = tensor_bits <= ibuf_bits and is_tiling_compatible(producer, consumer, tilings)
+        else:
+            tensor_bits = _get_bits(ops[-1].output_tensors if len(ops) > 0 else producer.output_tensors)
+            on_chip = False
+
+        consumer_saved = 0
+        if on_chip:
+            producer_saved = out_bits
+            consumer_saved = stats[consumer.name].writes['act']
+        else:
+            # Pooling on-chip shrinks the outputs written back
+            size = int(producer.output_tensors.size)
+            for op in ops:
+                size = min(size, int(op.output_tensors.size))
+            producer_saved = out_bits - out_bits * size // int(producer.output_tensors.size)
+        if producer_saved == 0 and consumer_saved == 0 and consumer is None:
+            continue
+
+        pairs.append(FusionPair(producer.name,
+                                consumer.name if consumer is not None else None,
+                                [op.name for op in ops],
+                                tensor_bits, on_chip,
+                                producer_saved, consumer_saved))
+        logger.debug('{} -> {}: {} bits, on-chip: {}, DRAM bits saved: {}'.format(
+            producer.name, consumer.name if consumer is not None else None,
+            tensor_bits, on_chip, producer_saved + consumer_saved))
+    return pairs
+
+def get_fused_stats(graph, stats, tilings, acc_obj):
+    """
+    Returns the Stats of each op with the fused producer/consumer pairs.
+    Only the DRAM traffic and the memory stalls change: removing a transfer
+    removes at most its own cycles from the stalls, and never any compute
+    cycles.
+    Args:
+        stats: dict of Stats per op name, as from get_bench_numbers
+        tilings: dict of (tiling, order) per op name, as from
+                 get_layer_tilings
+    Returns:
+        (dict of fused Stats per op name, list of FusionPair)
+    """
+    pairs = get_fusion_pairs(graph, stats, tilings, acc_obj)
+    saved_reads = dict((name, 0) for name in stats)
+    saved_writes = dict((name, 0) for name in stats)
+    for p in pairs:
+        saved_writes[p.producer] += p.producer_dram_bits_saved
+        if p.consumer is not None:
+            saved_reads[p.consumer] += p.consumer_dram_bits_saved
+
+    fused = OrderedDict()
+    for name in stats:
+        s = Stats(stats[name].data.copy())
+        saved = saved_reads[name] + saved_writes[name]
+        if saved > 0:
+            s.reads['dram'] -= saved_reads[name]
+            s.writes['dram'] -= saved_writes[name]
+            cycles_saved = min(s.mem_stall_cycles, ceil_a_by_b(saved, acc_obj.mem_if_width))
+            s.total_cycles -= cycles_saved
+            s.mem_stall_cycles -= cycles_saved
+        fused[name] = s
+    return fused, pairs
+
+def get_fusion_summary(stats, fused):
+    """
+    Returns the network totals with and without fusion: a dict with the
+    total cycles and DRAM bits of each, and the savings
+    """
+    total = Stats()
+    total_fused = Stats()
+    for name in stats:
+        total += stats[name]
+        total_fused += fused[name]
+    dram_bits = total.reads['dram'] + total.writes['dram']
+    fused_dram_bits = total_fused.reads['dram'] + total_fused.writes['dram']
+    summary = OrderedDict()
+    summary['cycles'] = total.total_cycles
+    summary['fused cycles'] = total_fused.total_cycles
+    summary['cycles saved'] = total.total_cycles - total_fused.total_cycles
+    summary['DRAM bits'] = dram_bits
+    summary['fused DRAM bits'] = fused_dram_bits
+    summary['DRAM bits saved'] = dram_bits - fused_dram_bits
+    return summary
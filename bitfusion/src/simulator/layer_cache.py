@@ -0,0 +1,123 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+
+from collections import OrderedDict
+
+# Bump when the optimizer/cost model changes, so that stale on-disk entries
+# are not returned
+CACHE_VERSION = 3
+
+def get_layer_key(conv_params, tile_candidates='pow2'):
+    """
+    Returns a canonical key for a layer on an accelerator configuration
+    Args:
+        conv_params: A tuple with convolution params, as passed to
+                     optimize_for_order
+        tile_candidates: tile candidate generator used by the optimizer
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost = conv_params
+    return (CACHE_VERSION,
+            acc_obj.N, acc_obj.M, acc_obj.pmax, acc_obj.pmin,
+            acc_obj.sram['wgt'], acc_obj.sram['act'], acc_obj.sram['out'],
+            acc_obj.mem_if_width,
+            int(K), int(O), int(S), int(IC), int(OC), int(B),
+            int(iprec), int(wprec), bool(im2col),
+            tuple(float(x) for x in energy_cost),
+            tile_candidates)
+
+class LayerCache(object):
+    """
+    Two-level cache for per-layer optimizer results: an in-memory LRU and an
+    optional SQLite file shared across runs. Values are
+    (stats, best_tiling, best_order) tuples.
+    """
+
+    def __init__(self, max_entries=4096, filename=None):
+        self.max_entries = max_entries
+        self.filename = filename
+        self._lru = OrderedDict()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.logger = logging.getLogger('{}.{}'.format(__name__, 'LayerCache'))
+
+    def _get_db(self):
+        if self._db is None and self.filename is not None:
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._db = sqlite3.connect(self.filename)
+            self._db.execute('CREATE TABLE IF NOT EXISTS layer_cache (key TEXT PRIMARY KEY, value BLOB)')
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _insert_lru(self, key, value):
+        self._lru.pop(key, None)
+        self._lru[key] = value
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns a copy of the cached value for key, or None on a miss
+        """
+        if key in self._lru:
+            value = self._lru.pop(key)
+            self._lru[key] = value
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        db = self._get_db()
+        if db is not None:
+            row = db.execute('SELECT value FROM layer_cache WHERE key = ?', (self._digest(key),)).fetchone()
+            if row is not None:
+                value = pickle.loads(bytes(row[0]))
+                self._insert_lru(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return copy.deepcopy(value)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        value = copy.deepcopy(value)
+        self._insert_lru(key, value)
+        db = self._get_db()
+        if db is not None:
+            blob = sqlite3.Binary(pickle.dumps(value, protocol=2))
+            db.execute('INSERT OR REPLACE INTO layer_cache (key, value) VALUES (?, ?)', (self._digest(key), blob))
+            db.commit()
+
+    def clear(self):
+        self._lru.clear()
+        db = self._get_db()
+        if db is not None:
+            db.execute('DELETE FROM layer_cache')
+            db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self):
+        return len(self._lru)
+
+    def __str__(self):
+        ret = 'Layer cache: {} hits ({} from disk), {} misses, {} entries in memory'.format(
+                self.hits, self.disk_hits, self.misses, len(self._lru))
+        if self.filename is not None:
+            ret += ', file: {}'.format(self.filename)
+        return ret
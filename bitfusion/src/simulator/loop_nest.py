@@ -0,0 +1,151 @@
+import numpy as np
+
+from bitfusion.src.simulator.stats import Stats
+
+# Namespaces of the on-chip buffers, in the column order of LoopNest.strides
+buffer_namespaces = ['act', 'wgt', 'out']
+
+class LoopNest(object):
+    """
+    Flat representation of a tiled loop nest, equivalent to a LoopStack
+    built by get_loop_instructions and its promote_mem_ops.
+
+    The loops form a single chain, so the nest is stored as small arrays:
+        loop_counts: trip count of each loop, outermost first
+        strides: stride of each loop (rows) for each of buffer_namespaces
+        mem_namespaces: index into buffer_namespaces of each memory op
+        mem_sizes: size in bits of each memory op, after promotion
+        mem_levels: level of each memory op. Level 0 is outside all loops,
+                    level k is inside loop k-1.
+        mem_is_write: True for writes back to DRAM
+    The stats of the LoopStack pipeline model are computed in closed form
+    from these arrays, without building Instruction or Pipeline objects.
+    """
+
+    def __init__(self, loop_names, loop_counts, strides,
+                 mem_names, mem_namespaces, mem_sizes, mem_is_write,
+                 compute_cycles, sram):
+        """
+        Args:
+            mem_sizes: sizes in bits before promotion
+            compute_cycles: cycles of the compute op in the innermost loop
+            sram: SRAM sizes used to promote the memory ops, as in
+                  LoopStack.promote_mem_ops
+        """
+        self.loop_names = list(loop_names)
+        self.loop_counts = np.array(loop_counts, dtype=np.int64)
+        self.strides = np.array(strides, dtype=np.int64).reshape(len(self.loop_names), len(buffer_namespaces))
+        self.mem_names = list(mem_names)
+        self.mem_namespaces = np.array(mem_namespaces, dtype=np.int8)
+        self.mem_sizes = np.array(mem_sizes, dtype=np.int64)
+        self.mem_is_write = np.array(mem_is_write, dtype=np.bool_)
+        self.mem_levels = np.zeros(len(self.mem_names), dtype=np.int8)
+        self.compute_cycles = compute_cycles
+        self._promote_mem_ops(sram)
+
+    def _promote_mem_ops(self, sram):
+        """
+        Moves each memory op out of the loops that do not change its address,
+        or whose data fits in the SRAM, like LoopStack.promote_mem_ops.
+        All ops start inside the innermost loop.
+        """
+        counts = self.loop_counts.tolist()
+        for i in range(len(self.mem_names)):
+            ns = self.mem_namespaces[i]
+            size = int(self.mem_sizes[i])
+            k = len(counts) - 1
+            while k >= 0 and (self.strides[k, ns] == 0 or sram[buffer_namespaces[ns]] > size * counts[k]):
+                if self.strides[k, ns] != 0:
+                    size *= counts[k]
+                k -= 1
+            self.mem_sizes[i] = size
+            self.mem_levels[i] = k + 1
+
+    def get_mem_namespace(self, i):
+        return buffer_namespaces[self.mem_namespaces[i]]
+
+    def get_pipeline_cycles(self, acc_obj):
+        """
+        Returns the cycles of the outermost loop, as Pipeline.get_cycles
+        """
+        counts = self.loop_counts.tolist()
+        levels = self.mem_levels.tolist()
+        is_write = self.mem_is_write.tolist()
+        rd = [0] * len(counts)
+        wr = [0] * len(counts)
+        for i, size in enumerate(self.mem_sizes.tolist()):
+            if levels[i] == 0:
+                continue
+            namespace = buffer_namespaces[self.mem_namespaces[i]]
+            if is_write[i]:
+                wr[levels[i] - 1] += acc_obj.get_mem_write_cycles(namespace, size)
+            else:
+                rd[levels[i] - 1] += acc_obj.get_mem_read_cycles(namespace, size)
+
+        # Innermost loop: Pipeline(compute cycles, rd, wr, count)
+        k = len(counts) - 1
+        n = counts[k]
+        i0_rd = rd[k]
+        i1 = (rd[k], self.compute_cycles, 0)
+        mid = max(self.compute_cycles, rd[k] + wr[k]) * (n - 2)
+        f0 = (0, self.compute_cycles, wr[k])
+        f1_wr = wr[k]
+
+        # Outer loops: Pipeline(inner pipeline, rd, wr, count)
+        for k in range(len(counts) - 2, -1, -1):
+            n = counts[k]
+            mid += (n - 1) * (max(i0_rd + rd[k] + f0[2], f0[1]) +
+                              max(i1[0] + f1_wr + wr[k], i1[1]) +
+                              mid)
+            i0_rd += rd[k]
+            f1_wr += wr[k]
+
+        return i0_rd + max(i1[0] + i1[2], i1[1]) + mid + max(f0[0] + f0[2], f0[1]) + f1_wr
+
+    def get_stats(self, acc_obj, verbose=False):
+        """
+        Returns the same dict of Stats as LoopStack.get_stats
+        """
+        counts = self.loop_counts.tolist()
+        # Number of times a memory op at each level runs
+        repeat = [1]
+        for n in counts:
+            repeat.append(repeat[-1] * n)
+
+        stats = Stats()
+        mem_cycles = 0
+        levels = self.mem_levels.tolist()
+        is_write = self.mem_is_write.tolist()
+        for i, size in enumerate(self.mem_sizes.tolist()):
+            namespace = buffer_namespaces[self.mem_namespaces[i]]
+            bits = size * repeat[levels[i]]
+            if is_write[i]:
+                stats.reads[namespace] += bits
+                stats.writes['dram'] += bits
+                if levels[i] == 0:
+                    mem_cycles += acc_obj.get_mem_write_cycles(namespace, size)
+            else:
+                stats.writes[namespace] += bits
+                stats.reads['dram'] += bits
+                if levels[i] == 0:
+                    mem_cycles += acc_obj.get_mem_read_cycles(namespace, size)
+
+        stats.total_cycles = self.get_pipeline_cycles(acc_obj) + mem_cycles
+        stats.mem_stall_cycles = stats.total_cycles - self.compute_cycles * repeat[-1]
+
+        ret = {}
+        ret['total'] = stats
+        ret[self.loop_names[0]] = Stats(stats.data.copy())
+        return ret
+
+    def __str__(self):
+        ret = '*' * 50 + '\n'
+        for k, name in enumerate(self.loop_names):
+            stride = dict(zip(buffer_namespaces, self.strides[k].tolist()))
+            ret += ' | ' * k + '{0}: Range {1}, stride {2}\n'.format(name, self.loop_counts[k], stride)
+            for i in np.flatnonzero(self.mem_levels == k + 1):
+                ret += ' | ' * (k + 1) + '{0}: size {1}, level: {2}\n'.format(self.mem_names[i], self.mem_sizes[i], k + 1)
+        for i in np.flatnonzero(self.mem_levels == 0):
+            ret += '{0}: size {1}, level: 0\n'.format(self.mem_names[i], self.mem_sizes[i])
+        ret += '*' * 50 + '\n'
+        return ret
@@ -0,0 +1,239 @@
+import logging
+import math
+
+from collections import namedtuple
+
+from bitfusion.src.simulator.accelerator import Accelerator
+from bitfusion.src.simulator.stats import Stats
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Partition'))
+logger.setLevel(logging.DEBUG)
+
+# Ways to split one layer across the accelerator instances
+#   B: each instance runs a slice of the batch, and reads all the weights
+#   OC: each instance computes a slice of the output channels, and reads
+#       all the inputs
+#   spatial: each instance computes a block of a g x g grid of the outputs,
+#            and reads its input block with the halo
+layer_splits = ['B', 'OC', 'spatial']
+
+# Modes of partition_network: a layer split for all layers, 'auto' for the
+# fastest layer split of each layer, or 'pipeline' to run consecutive layers
+# on each instance, with one batch per instance in flight
+split_modes = layer_splits + ['auto', 'pipeline']
+
+# DRAM bandwidth model: the memory interface of the configuration is shared
+# by the busy instances, or each instance has its own
+dram_modes = ['shared', 'private']
+
+# A layer on the instances
+#   split: the layer split used
+#   instance_stats: Stats of each instance, empty for idle instances
+#   cycles: cycles of the slowest instance
+LayerPartition = namedtuple('LayerPartition', ['name', 'split', 'instance_stats', 'cycles'])
+
+# A network on the instances
+#   latency_cycles: cycles for one batch to go through the network
+#   interval_cycles: cycles between two batches; the same as latency_cycles
+#                    except for 'pipeline'
+#   latency: seconds for one batch
+#   throughput: inputs per second
+#   energy: energy for one batch, as Stats.get_energy
+#   instance_cycles: busy cycles of each instance for one batch
+#   utilization: busy fraction of each instance
+#   load_imbalance: interval_cycles over the mean busy cycles, minus one;
+#                   zero when the work is perfectly balanced
+#   layers: list of LayerPartition
+PartitionResult = namedtuple('PartitionResult', ['num_instances', 'split', 'dram', 'batch_size',
+                                                 'latency_cycles', 'interval_cycles', 'latency', 'throughput',
+                                                 'energy', 'instance_cycles', 'utilization', 'load_imbalance',
+                                                 'layers'])
+
+def get_even_split(dim, parts):
+    """
+    Returns the sizes of dim split in at most parts parts, as evenly as
+    possible
+    """
+    parts = min(parts, dim)
+    return [dim // parts + (1 if i < dim % parts else 0) for i in range(parts)]
+
+def get_instance_accelerator(acc_obj, num_busy, dram='shared'):
+    """
+    Returns the Accelerator seen by each of num_busy instances of acc_obj.
+    With a shared DRAM, each instance gets an equal share of the memory
+    interface.
+    """
+    assert dram in dram_modes, dram
+    if dram == 'private' or num_busy <= 1:
+        return acc_obj
+    mem_if_width = max(1, acc_obj.mem_if_width // num_busy)
+    return Accelerator(acc_obj.N, acc_obj.M, acc_obj.pmax, acc_obj.pmin,
+                       acc_obj.sram, mem_if_width, acc_obj.frequency)
+
+def get_layer_parts(params, split, num_instances):
+    """
+    Returns the layer params of the part of a layer on each busy instance
+    Args:
+        params: (K, O, S, IC, OC, iprec, wprec, B, im2col), as from
+                Simulator.get_layer_params
+    """
+    assert split in layer_splits, split
+    K, O, S, IC, OC, iprec, wprec, B, im2col = params
+    if split == 'B':
+        return [(K, O, S, IC, OC, iprec, wprec, b, im2col) for b in get_even_split(B, num_instances)]
+    if split == 'OC':
+        return [(K, O, S, IC, oc, iprec, wprec, B, im2col) for oc in get_even_split(OC, num_instances)]
+    # The loop model has square outputs, so blocks of an uneven split are
+    # rounded up to squares
+    grid = get_even_split(O, int(math.sqrt(num_instances)))
+    return [(K, max(h, w), S, IC, OC, iprec, wprec, B, im2col) for h in grid for w in grid]
+
+def partition_layer(sim_obj, op, num_instances, split, dram='shared'):
+    """
+    Returns the LayerPartition of op split across num_instances instances of
+    the accelerator of sim_obj, or None for ops that do not run on it.
+    Instances start a layer together, so the layer takes the cycles of the
+    slowest one. 'auto' picks the split with the fewest cycles.
+    """
+    params = sim_obj.get_layer_params(op)
+    if params is None:
+        return
+    if split == 'auto':
+        best = None
+        for s in layer_splits:
+            layer = partition_layer(sim_obj, op, num_instances, s, dram)
+            if best is None or layer.cycles < best.cycles:
+                best = layer
+        return best
+
+    parts = get_layer_parts(params, split, num_instances)
+    acc_obj = get_instance_accelerator(sim_obj.accelerator, len(parts), dram)
+    instance_stats = []
+    for K, O, S, IC, OC, iprec, wprec, B, im2col in parts:
+        conv_params = acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, sim_obj.get_energy_cost()
+        stats, _, _ = sim_obj.get_layer_stats(conv_params)
+        instance_stats.append(stats)
+    instance_stats += [Stats() for _ in range(num_instances - len(parts))]
+    return LayerPartition(op.name, split, instance_stats, max(s.total_cycles for s in instance_stats))
+
+def get_pipeline_stages(cycles, num_stages):
+    """
+    Splits layers with the given cycles into at most num_stages consecutive
+    stages, minimizing the cycles of the largest stage. Returns the stage of
+    each layer.
+    """
+    n = len(cycles)
+    prefix = [0]
+    for c in cycles:
+        prefix.append(prefix[-1] + c)
+
+    # best[k][i]: largest stage of the first i layers in k stages, and
+    # first[k][i]: the first layer of the last of those stages
+    best = [[None] * (n + 1) for _ in range(num_stages + 1)]
+    first = [[0] * (n + 1) for _ in range(num_stages + 1)]
+    best[0][0] = 0
+    for k in range(1, num_stages + 1):
+        for i in range(n + 1):
+            for j in range(i + 1):
+                if best[k - 1][j] is None:
+                    continue
+                largest = max(best[k - 1][j], prefix[i] - prefix[j])
+                if best[k][i] is None or largest < best[k][i]:
+                    best[k][i] = largest
+                    first[k][i] = j
+
+    bounds = []
+    i = n
+    for k in range(num_stages, 0, -1):
+        j = first[k][i]
+        if j < i:
+            bounds.append((j, i))
+        i = j
+    stages = [0] * n
+    for stage, (j, i) in enumerate(reversed(bounds)):
+        for layer in range(j, i):
+            stages[layer] = stage
+    return stages
+
+def _partition_pipeline(sim_obj, ops, num_instances, dram):
+    """
+    With a shared DRAM, each busy stage gets less bandwidth, so every number
+    of stages up to num_instances is tried, keeping the fewest stages with
+    the lowest interval
+    """
+    best = None
+    for num_stages in range(1, min(num_instances, len(ops)) + 1):
+        acc_obj = get_instance_accelerator(sim_obj.accelerator, num_stages, dram)
+        stats = []
+        for op in ops:
+            K, O, S, IC, OC, iprec, wprec, B, im2col = sim_obj.get_layer_params(op)
+            conv_params = acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, sim_obj.get_energy_cost()
+            stats.append(sim_obj.get_layer_stats(conv_params)[0])
+        stages = get_pipeline_stages([s.total_cycles for s in stats], num_stages)
+        stage_cycles = [0] * num_stages
+        for s, stage in zip(stats, stages):
+            stage_cycles[stage] += s.total_cycles
+        if best is None or max(stage_cycles) < best[0]:
+            best = (max(stage_cycles), stats, stages)
+
+    _, stats, stages = best
+    layers = []
+    for op, s, stage in zip(ops, stats, stages):
+        instance_stats = [Stats() for _ in range(num_instances)]
+        instance_stats[stage] = s
+        layers.append(LayerPartition(op.name, 'pipeline', instance_stats, s.total_cycles))
+    return layers
+
+def partition_network(graph, sim_obj, num_instances, split='auto', dram='shared'):
+    """
+    Returns the PartitionResult of graph on num_instances instances of the
+    accelerator of sim_obj.
+
+    With a layer split (or 'auto'), every layer is split across the
+    instances, and the layers run one after the other. With 'pipeline', each
+    instance runs whole consecutive layers on a different batch, so the
+    throughput is set by the slowest stage and the latency by all of them.
+    Args:
+        split: one of split_modes
+        dram: one of dram_modes
+    """
+    assert split in split_modes, split
+    ops = [op for opname, op in graph.op_registry.iteritems()
+           if sim_obj.get_layer_params(op) is not None]
+    if split == 'pipeline':
+        layers = _partition_pipeline(sim_obj, ops, num_instances, dram)
+    else:
+        layers = [partition_layer(sim_obj, op, num_instances, split, dram) for op in ops]
+
+    instance_cycles = [0] * num_instances
+    total = Stats()
+    for layer in layers:
+        for i, s in enumerate(layer.instance_stats):
+            instance_cycles[i] += s.total_cycles
+            total += s
+
+    latency_cycles = sum(layer.cycles for layer in layers)
+    if split == 'pipeline':
+        interval_cycles = max(instance_cycles)
+    else:
+        interval_cycles = latency_cycles
+    batch_size = sim_obj.get_layer_params(ops[0])[7]
+    frequency = float(sim_obj.accelerator.frequency)
+    utilization = [float(c) / interval_cycles for c in instance_cycles]
+    load_imbalance = interval_cycles * num_instances / float(sum(instance_cycles)) - 1
+
+    logger.debug('{} instances, {} split: {:,} cycles latency, {:,} cycles interval, load imbalance {:.3f}'.format(
+        num_instances, split, latency_cycles, interval_cycles, load_imbalance))
+
+    return PartitionResult(num_instances, split, dram, batch_size,
+                           latency_cycles, interval_cycles,
+                           latency_cycles / frequency, batch_size * frequency / interval_cycles,
+                           total.get_energy(sim_obj.get_energy_cost()),
+                           instance_cycles, utilization, load_imbalance, layers)
+
+def get_scaling_curve(graph, sim_obj, instance_counts=(1, 2, 4, 8, 16), split='auto', dram='shared'):
+    """
+    Returns the PartitionResult of graph for each number of instances in
+    instance_counts
+    """
+    return [partition_network(graph, sim_obj, k, split, dram) for k in instance_counts]
@@ -0,0 +1,127 @@
+import json
+import logging
+
+from collections import namedtuple, OrderedDict
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Roofline'))
+logger.setLevel(logging.DEBUG)
+
+# Bottleneck of a layer on the roofline
+#   compute: the DRAM traffic of the chosen tiling is below the ridge point
+#   capacity: the layer would be compute-bound if every tensor went through
+#             DRAM once, but the tiles that fit in the SRAMs re-read data
+#             and push it below the ridge point
+#   bandwidth: even reading every tensor once is below the ridge point
+bounds = ['compute', 'capacity', 'bandwidth']
+
+# Roofline of a layer
+#   macs: multiply-accumulates of the layer
+#   dram_bits: DRAM reads + writes
+#   min_dram_bits: DRAM reads + writes if each tensor goes through DRAM once
+#   intensity: MACs per DRAM bit
+#   min_intensity: MACs per DRAM bit for min_dram_bits
+#   ridge_intensity: MACs per DRAM bit above which the peak is reachable
+#   ops_per_cycle: attained MACs per cycle
+#   peak_ops_per_cycle: MACs per cycle of the array at the layer precision
+#   efficiency: ops_per_cycle over peak_ops_per_cycle
+#   stall_fraction: memory stall cycles over total cycles
+LayerRoofline = namedtuple('LayerRoofline', ['name', 'iprec', 'wprec', 'macs', 'cycles',
+                                             'dram_bits', 'min_dram_bits',
+                                             'intensity', 'min_intensity', 'ridge_intensity',
+                                             'ops_per_cycle', 'peak_ops_per_cycle', 'efficiency',
+                                             'stall_fraction', 'bound'])
+
+def get_min_dram_bits(params):
+    """
+    Returns the DRAM bits of a layer if its inputs and weights are read,
+    and its outputs written, exactly once, with the tensor sizes used by
+    get_stats_fast
+    Args:
+        params: (K, O, S, IC, OC, iprec, wprec, B, im2col), as from
+                Simulator.get_layer_params
+    """
+    K, O, S, IC, OC, iprec, wprec, B, im2col = params
+    oprec = 32
+    if im2col:
+        act_bits = O * O * K * K * IC * B * iprec
+    else:
+        I = (O - 1) * S + K
+        act_bits = I * I * IC * B * iprec
+    wgt_bits = K * K * IC * OC * wprec
+    out_bits = O * O * OC * B * oprec
+    return act_bits + wgt_bits + out_bits
+
+def get_layer_roofline(sim_obj, op, stats):
+    """
+    Returns the LayerRoofline of a Convolution or MatMul op with the given
+    Stats, or None for other ops
+    """
+    params = sim_obj.get_layer_params(op)
+    if params is None:
+        return
+    K, O, S, IC, OC, iprec, wprec, B, im2col = params
+    acc_obj = sim_obj.accelerator
+
+    macs = sum(op.get_ops().values())
+    if macs == 0:
+        # MatMul does not count its ops
+        macs = O * O * K * K * IC * OC * B
+
+    peak_ops_per_cycle = acc_obj.N * acc_obj.M * acc_obj.get_perf_factor(iprec, wprec)
+    ridge_intensity = float(peak_ops_per_cycle) / acc_obj.mem_if_width
+    dram_bits = stats.reads['dram'] + stats.writes['dram']
+    min_dram_bits = get_min_dram_bits(params)
+    intensity = float(macs) / dram_bits if dram_bits > 0 else float('inf')
+    min_intensity = float(macs) / min_dram_bits
+
+    if intensity >= ridge_intensity:
+        bound = 'compute'
+    elif min_intensity >= ridge_intensity:
+        bound = 'capacity'
+    else:
+        bound = 'bandwidth'
+
+    ops_per_cycle = float(macs) / stats.total_cycles
+    return LayerRoofline(op.name, iprec, wprec, macs, stats.total_cycles,
+                         dram_bits, min_dram_bits,
+                         intensity, min_intensity, ridge_intensity,
+                         ops_per_cycle, peak_ops_per_cycle, ops_per_cycle / peak_ops_per_cycle,
+                         float(stats.mem_stall_cycles) / stats.total_cycles, bound)
+
+def get_roofline_report(graph, sim_obj, stats):
+    """
+    Returns the LayerRoofline of each layer of graph, in graph order
+    Args:
+        stats: dict of Stats per op name, as from get_bench_numbers
+    """
+    report = []
+    for opname, op in graph.op_registry.iteritems():
+        if opname not in stats:
+            continue
+        layer = get_layer_roofline(sim_obj, op, stats[opname])
+        if layer is not None:
+            report.append(layer)
+            logger.debug('{}: {:.3f} MACs/bit, {:.1%} of peak, {}-bound'.format(
+                layer.name, layer.intensity, layer.efficiency, layer.bound))
+    return report
+
+def get_roofline_table(report):
+    """
+    Returns the report as a text table
+    """
+    header = '{0:<30} {1:>7} {2:>16} {3:>16} {4:>10} {5:>10} {6:>10} {7:>10} {8:>10} {9:>8} {10:>10}'.format(
+        'Layer', 'Prec', 'MACs', 'DRAM bits', 'MACs/bit', 'Min', 'Ridge', 'MACs/cyc', 'Peak', 'Stalls', 'Bound')
+    lines = [header, '-' * len(header)]
+    for l in report:
+        lines.append('{0:<30} {1:>7} {2:>16,} {3:>16,} {4:>10.3f} {5:>10.3f} {6:>10.3f} {7:>10.1f} {8:>10,} {9:>8.1%} {10:>10}'.format(
+            l.name, '{}x{}'.format(l.iprec, l.wprec), l.macs, l.dram_bits,
+            l.intensity, l.min_intensity, l.ridge_intensity,
+            l.ops_per_cycle, l.peak_ops_per_cycle, l.stall_fraction, l.bound))
+    return '\n'.join(lines)
+
+def get_roofline_json(report, **kwargs):
+    """
+    Returns the report as a JSON list with one object per layer. kwargs are
+    passed to json.dumps.
+    """
+    return json.dumps([OrderedDict(zip(LayerRoofline._fields, l)) for l in report], **kwargs)
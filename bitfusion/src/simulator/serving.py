@@ -0,0 +1,204 @@
+import logging
+
+from collections import namedtuple, deque
+
+import numpy as np
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'Serving'))
+logger.setLevel(logging.DEBUG)
+
+# How the requests in flight share the accelerator
+#   batch: a batch of requests runs through all its layers before the next
+#   layer: the batches in flight take turns, one layer at a time, so a short
+#          network is not stuck behind a long one
+interleavings = ['batch', 'layer']
+
+# Arrival patterns of get_arrivals
+#   fixed: one request every 1/rate seconds
+#   poisson: exponential inter-arrival times with mean 1/rate
+arrival_distributions = ['fixed', 'poisson']
+
+# Requests for one network. A request runs the layers as simulated, e.g.
+# one batch of a benchmark graph.
+#   layer_cycles: cycles of each layer for one request, in graph order
+#   arrivals: arrival time of each request in seconds, sorted
+#   batch_layer_cycles: dict of the layer cycles for n requests batched
+#                       together, for n > 1. Batches of sizes not in the dict
+#                       take n times the cycles of one request.
+ServingStream = namedtuple('ServingStream', ['name', 'layer_cycles', 'arrivals', 'batch_layer_cycles'])
+
+# Latencies are in seconds, from arrival to completion. throughput is in
+# requests per second, from the first arrival to the last completion.
+StreamResult = namedtuple('StreamResult', ['name', 'num_requests', 'latencies',
+                                           'mean_latency', 'p50_latency', 'p99_latency', 'throughput'])
+
+# utilization: busy fraction of the accelerator from the first arrival to
+# the last completion
+# max_outstanding: most requests arrived and not completed at once
+ServingResult = namedtuple('ServingResult', ['interleaving', 'streams',
+                                             'mean_latency', 'p50_latency', 'p99_latency', 'throughput',
+                                             'utilization', 'max_outstanding'])
+
+def get_layer_cycles(graph, stats):
+    """
+    Returns the cycles of each layer of graph, in graph order
+    Args:
+        stats: dict of Stats per op name, as from get_bench_numbers
+    """
+    return [stats[opname].total_cycles for opname in graph.op_registry if opname in stats]
+
+def get_batch_layer_cycles(graph, sim_obj, max_batch):
+    """
+    Returns the batch_layer_cycles of a ServingStream for graph, for up to
+    max_batch requests batched together, from Simulator.get_batch_stats
+    """
+    ops = [op for opname, op in graph.op_registry.iteritems()
+           if sim_obj.get_layer_params(op) is not None]
+    if max_batch < 2 or len(ops) == 0:
+        return {}
+    request_batch = sim_obj.get_layer_params(ops[0])[7]
+    counts = range(2, max_batch + 1)
+    batch_sizes = [n * request_batch for n in counts]
+    cycles = dict((n, []) for n in counts)
+    for op in ops:
+        for n, stats in zip(counts, sim_obj.get_batch_stats(op, batch_sizes)):
+            cycles[n].append(stats.total_cycles)
+    return cycles
+
+def get_arrivals(num_requests, rate, distribution='fixed', seed=None):
+    """
+    Returns the arrival times in seconds of num_requests requests at rate
+    requests per second, starting at 0
+    """
+    assert distribution in arrival_distributions, distribution
+    if distribution == 'fixed':
+        return np.arange(num_requests, dtype=np.float64) / rate
+    gaps = np.random.RandomState(seed).exponential(1. / rate, num_requests)
+    gaps[0] = 0
+    return np.cumsum(gaps)
+
+def read_arrival_trace(trace_file):
+    """
+    Returns the arrival times from a trace file with one timestamp in
+    seconds per line (the first comma-separated field). Empty lines and
+    lines starting with '#' are skipped.
+    """
+    arrivals = []
+    with open(trace_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            arrivals.append(float(line.split(',')[0]))
+    return np.sort(np.array(arrivals, dtype=np.float64))
+
+def _get_job_cycles(stream, num_requests):
+    if num_requests > 1 and stream.batch_layer_cycles is not None and num_requests in stream.batch_layer_cycles:
+        return list(stream.batch_layer_cycles[num_requests])
+    return [c * num_requests for c in stream.layer_cycles]
+
+def _get_latency_stats(latencies):
+    if len(latencies) == 0:
+        return 0., 0., 0.
+    return float(np.mean(latencies)), float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+def simulate_serving(streams, frequency, interleaving='batch', max_batch=1, max_inflight=None):
+    """
+    Simulates requests from streams on one accelerator, and returns a
+    ServingResult.
+
+    Waiting requests are served oldest first. The accelerator takes up to
+    max_batch waiting requests of the same stream as one batch. With
+    'batch' interleaving, it runs one batch at a time. With 'layer'
+    interleaving, up to max_inflight batches (no limit for None) are in
+    flight, and each runs one layer in turn. A layer is never preempted.
+    Args:
+        streams: list of ServingStream
+        frequency: accelerator frequency in Hz
+        interleaving: one of interleavings
+    """
+    assert interleaving in interleavings, interleaving
+    if interleaving == 'batch':
+        max_inflight = 1
+
+    # Work in cycles
+    arrival_cycles = [np.round(np.asarray(s.arrivals, dtype=np.float64) * frequency).astype(np.int64).tolist()
+                      for s in streams]
+    arrivals = sorted((t, sid, rid) for sid, cycles in enumerate(arrival_cycles) for rid, t in enumerate(cycles))
+    finish_cycles = [[None] * len(cycles) for cycles in arrival_cycles]
+    num_requests = len(arrivals)
+
+    queues = [deque() for s in streams]
+    # Batches in flight: [stream id, request ids, layer cycles, next layer]
+    inflight = deque()
+    t = arrivals[0][0] if num_requests > 0 else 0
+    next_arrival = 0
+    num_done = 0
+    busy = 0
+    max_outstanding = 0
+    while num_done < num_requests:
+        while next_arrival < num_requests and arrivals[next_arrival][0] <= t:
+            _, sid, rid = arrivals[next_arrival]
+            queues[sid].append(rid)
+            next_arrival += 1
+        max_outstanding = max(max_outstanding, next_arrival - num_done)
+
+        while max_inflight is None or len(inflight) < max_inflight:
+            waiting = [(arrival_cycles[sid][q[0]], sid) for sid, q in enumerate(queues) if len(q) > 0]
+            if len(waiting) == 0:
+                break
+            _, sid = min(waiting)
+            rids = [queues[sid].popleft() for _ in range(min(max_batch, len(queues[sid])))]
+            inflight.append([sid, rids, _get_job_cycles(streams[sid], len(rids)), 0])
+
+        if len(inflight) == 0:
+            t = arrivals[next_arrival][0]
+            continue
+
+        job = inflight.popleft()
+        sid, rids, cycles, layer = job
+        if interleaving == 'batch':
+            run = sum(cycles)
+            layer = len(cycles)
+        else:
+            run = cycles[layer]
+            layer += 1
+        t += run
+        busy += run
+        if layer < len(cycles):
+            job[3] = layer
+            inflight.append(job)
+            continue
+        for rid in rids:
+            finish_cycles[sid][rid] = t
+        num_done += len(rids)
+
+    results = []
+    all_latencies = []
+    for sid, s in enumerate(streams):
+        latencies = (np.array(finish_cycles[sid], dtype=np.float64) -
+                     np.array(arrival_cycles[sid], dtype=np.float64)) / frequency
+        all_latencies.append(latencies)
+        if len(latencies) > 0:
+            span = (max(finish_cycles[sid]) - arrival_cycles[sid][0]) / float(frequency)
+            throughput = len(latencies) / span if span > 0 else float('inf')
+        else:
+            throughput = 0.
+        mean, p50, p99 = _get_latency_stats(latencies)
+        results.append(StreamResult(s.name, len(latencies), latencies, mean, p50, p99, throughput))
+
+    if num_requests > 0:
+        span_cycles = t - arrivals[0][0]
+        throughput = num_requests * float(frequency) / span_cycles if span_cycles > 0 else float('inf')
+        utilization = float(busy) / span_cycles if span_cycles > 0 else 0.
+        all_latencies = np.concatenate(all_latencies)
+    else:
+        throughput = 0.
+        utilization = 0.
+        all_latencies = np.zeros(0)
+    mean, p50, p99 = _get_latency_stats(all_latencies)
+
+    logger.debug('{} requests, {} interleaving: p50 {:.6f} s, p99 {:.6f} s, {:.1f} requests/s, utilization {:.3f}'.format(
+        num_requests, interleaving, p50, p99, throughput, utilization))
+
+    return ServingResult(interleaving, results, mean, p50, p99, throughput, utilization, max_outstanding)
@@ -3,12 +3,14 @@ import math
 import ConfigParser
 import numpy as np
 
-from bitfusion.src.utils.utils import ceil_a_by_b, log2, lookup_pandas_dataframe
+from bitfusion.src.utils.utils import ceil_a_by_b, log2
 from bitfusion.src.simulator.stats import Stats
 from bitfusion.src.simulator.loop_stack import LoopStack
-from bitfusion.src.optimizer.optimizer import optimize_for_order, get_stats_fast
+from bitfusion.src.optimizer.optimizer import optimize_for_order, get_stats_fast, get_loop_instructions, get_loop_nest, get_pareto_frontier, optimize_for_batch_sizes
 from bitfusion.src.simulator.accelerator import Accelerator
 from bitfusion.src.simulator.energy import EnergyTuple
+from bitfusion.src.simulator.layer_cache import LayerCache, get_layer_key
+from bitfusion.src.simulator.event_sim import simulate_loop_nest
 
 from bitfusion.sram.cacti_sweep import CactiSweep
 import os
@@ -21,11 +23,16 @@ class Simulator(object):
     Simulator class
     """
 
-    def __init__(self, config_file='conf.ini', verbose=False, energy_costs=None):
+    def __init__(self, config_file='conf.ini', verbose=False, energy_costs=None, layer_cache=None):
 
         # custom energy cost
         self.energy_costs = energy_costs
 
+        # per-layer optimizer results, keyed by layer shape and accelerator config
+        if layer_cache is None:
+            layer_cache = LayerCache()
+        self.layer_cache = layer_cache
+
         self.config_file = config_file
 
         self.config = ConfigParser.ConfigParser()
@@ -69,6 +76,29 @@ class Simulator(object):
         frequency = self.config.getint('accelerator', 'frequency')
         self.logger.debug('Frequency: {:,} Hz'.format(frequency))
 
+        # Optional: DRAM energy in pJ/bit
+        if self.config.has_option('system', 'dram_energy'):
+            self.dram_energy = self.config.getfloat('system', 'dram_energy') / 1.e3
+        else:
+            self.dram_energy = 15.e-3
+        self.logger.debug('DRAM energy: {} pJ/bit'.format(self.dram_energy * 1.e3))
+
+        # Optional: tile sizes searched by the optimizer ('pow2' or 'extended')
+        if self.config.has_option('optimizer', 'tile_candidates'):
+            self.tile_candidates = self.config.get('optimizer', 'tile_candidates')
+        else:
+            self.tile_candidates = 'pow2'
+        self.logger.debug('Tile candidates: {}'.format(self.tile_candidates))
+
+        # Optional: timing model for the chosen tiling. 'analytic' (default)
+        # or 'event' for the event-driven simulation of the loop nest
+        if self.config.has_option('simulator', 'timing_model'):
+            self.timing_model = self.config.get('simulator', 'timing_model')
+        else:
+            self.timing_model = 'analytic'
+        assert self.timing_model in ('analytic', 'event'), 'Unknown timing model: {}'.format(self.timing_model)
+        self.logger.debug('Timing model: {}'.format(self.timing_model))
+
         hp_peak_throughput = systolic_dim[0] * \
                              systolic_dim[1] * \
                              systolic_dim[2]
@@ -100,13 +130,42 @@ class Simulator(object):
                 default_json=os.path.join(dir_path, 'default.json'),
                 default_dict=sram_opt_dict)
 
-    def get_area(self):
+        # Energy/area numbers per accelerator config, see get_hw_costs
+        self._hw_costs = {}
+        self._core_synth_data = None
+
+    def _get_core_synth_data(self):
+        """
+        Loads the systolic array synthesis results once, indexed by
+        (Max Precision, Min Precision, N, M)
+        """
+        if self._core_synth_data is None:
+            core_csv = os.path.join('./results', 'systolic_array_synth.csv')
+            core_synth_data = pandas.read_csv(core_csv).drop_duplicates()
+            keys = ['Max Precision (bits)', 'Min Precision (bits)', 'N', 'M']
+            self._core_synth_data = dict(list(core_synth_data.groupby(keys)))
+        return self._core_synth_data
+
+    def get_hw_costs(self):
+        """
+        Returns a dict with the energy and area numbers of the SRAMs and the
+        systolic array for the current accelerator configuration. The result
+        is memoized on the Accelerator fields, so it is only recomputed when
+        the accelerator changes (e.g. during a sweep).
+        """
         frequency = self.accelerator.frequency
         ##################################################
         N = self.accelerator.N
         M = self.accelerator.M
         pmax = self.accelerator.pmax
         pmin = self.accelerator.pmin
+
+        key = (N, M, pmax, pmin,
+               self.accelerator.sram['wgt'], self.accelerator.sram['act'], self.accelerator.sram['out'],
+               frequency)
+        if key in self._hw_costs:
+            return self._hw_costs[key]
+
         wbuf_size = self.accelerator.sram['wgt'] * 8
         ibuf_size = self.accelerator.sram['act'] * 8
         obuf_size = self.accelerator.sram['out'] * 8
@@ -130,7 +189,7 @@ class Simulator(object):
 
         ##################################################
         cfg_dict = {'size (bytes)': wbuf_bank_size /8., 'block size (bytes)': max(wbuf_bits/8,1), 'read-write port': 0}
-        print("cfg_dict for wbuf = {}".format(cfg_dict))
+        self.logger.debug("cfg_dict for wbuf = {}".format(cfg_dict))
         wbuf_data = self.sram_obj.get_data_clean(cfg_dict)
         wbuf_read_energy = float(wbuf_data['read_energy_nJ']) / wbuf_bits
         wbuf_write_energy = float(wbuf_data['write_energy_nJ']) / wbuf_bits
@@ -148,7 +207,7 @@ class Simulator(object):
         self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(wbuf_write_energy * 1.e3))
         ##################################################
         cfg_dict = {'size (bytes)': ibuf_bank_size /8., 'block size (bytes)': max(ibuf_bits/8,1), 'read-write port': 0}
-        print("cfg_dict for ibuf = {}".format(cfg_dict))
+        self.logger.debug("cfg_dict for ibuf = {}".format(cfg_dict))
         ibuf_data = self.sram_obj.get_data_clean(cfg_dict)
         ibuf_read_energy = float(ibuf_data['read_energy_nJ']) / ibuf_bits
         ibuf_write_energy = float(ibuf_data['write_energy_nJ']) / ibuf_bits
@@ -166,7 +225,7 @@ class Simulator(object):
         self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(ibuf_write_energy * 1.e3))
         ##################################################
         cfg_dict = {'size (bytes)': obuf_bank_size /8., 'block size (bytes)': max(obuf_bits/8,1), 'read-write port': 1}
-        print("cfg_dict for obuf = {}".format(cfg_dict))
+        self.logger.debug("cfg_dict for obuf = {}".format(cfg_dict))
         obuf_data = self.sram_obj.get_data_clean(cfg_dict)
         obuf_read_energy = float(obuf_data['read_energy_nJ']) / obuf_bits
         obuf_write_energy = float(obuf_data['write_energy_nJ']) / obuf_bits
@@ -184,19 +243,12 @@ class Simulator(object):
         self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(obuf_write_energy * 1.e3))
         ##################################################
         # Get stats for systolic array
-        core_csv = os.path.join('./results', 'systolic_array_synth.csv')
-        core_synth_data = pandas.read_csv(core_csv)
-
-        lookup_dict = {}
-        lookup_dict['Max Precision (bits)'] = pmax
-        lookup_dict['Min Precision (bits)'] = pmin
-        lookup_dict['N'] = N
-        lookup_dict['M'] = M
-        core_data = lookup_pandas_dataframe(core_synth_data, lookup_dict)
-        if len(core_data) == 0:
-            lookup_dict['N'] = 4
-            lookup_dict['M'] = 4
-            core_data = lookup_pandas_dataframe(core_synth_data, lookup_dict)
+        core_synth_data = self._get_core_synth_data()
+
+        core_data = core_synth_data.get((pmax, pmin, N, M))
+        if core_data is None:
+            print("Couldn't find core data. Assuming default. Bad bad")
+            core_data = core_synth_data[(pmax, pmin, 4, 4)]
             assert len(core_data) == 1
             core_area = float(core_data['Area (um^2)']) * 1.e-6 * (N * M) / 16.
             core_dyn_power = float(core_data['Dynamic Power (nW)']) * (N * M) / 16.
@@ -204,6 +256,7 @@ class Simulator(object):
             core_leak_power = float(core_data['Leakage Power (nW)']) * (N * M) / 16.
             core_leak_energy = core_leak_power / float(core_data['Frequency'])
         else:
+            print("core_data was not assumed to be default, that is we got the correct values for the core from the csv. This is good")
             core_area = float(core_data['Area (um^2)']) * 1.e-6
             core_dyn_power = float(core_data['Dynamic Power (nW)'])
             core_dyn_energy = core_dyn_power / float(core_data['Frequency'])
@@ -218,132 +271,22 @@ class Simulator(object):
         self.logger.debug('\tArea (mm^2)             : {}'.format(core_area))
         ##################################################
 
-        return core_area, wbuf_area, ibuf_area, obuf_area
+        hw_costs = {}
+        hw_costs['area'] = (core_area, wbuf_area, ibuf_area, obuf_area)
+        hw_costs['energy'] = EnergyTuple(core_dyn_energy, wbuf_read_energy, wbuf_write_energy, ibuf_read_energy, ibuf_write_energy, obuf_read_energy, obuf_write_energy, self.dram_energy)
+        hw_costs['leak_power'] = (core_leak_power, wbuf_leak_power, ibuf_leak_power, obuf_leak_power)
+        self._hw_costs[key] = hw_costs
+        return hw_costs
+
+    def get_area(self):
+        return self.get_hw_costs()['area']
 
     def get_energy_cost(self):
 
         if self.energy_costs is not None:
             return self.energy_costs
 
-        frequency = self.accelerator.frequency
-        ##################################################
-        N = self.accelerator.N
-        M = self.accelerator.M
-        pmax = self.accelerator.pmax
-        pmin = self.accelerator.pmin
-        wbuf_size = self.accelerator.sram['wgt'] * 8
-        ibuf_size = self.accelerator.sram['act'] * 8
-        obuf_size = self.accelerator.sram['out'] * 8
-        wbuf_bank = N * M
-        ibuf_bank = N
-        obuf_bank = M
-        wbuf_bits = (pmax * pmax / pmin)
-        ibuf_bits = (pmax * pmax / pmin)
-        obuf_bits = 32
-        wbuf_word = ceil_a_by_b(wbuf_size, wbuf_bank * wbuf_bits)
-        ibuf_word = ceil_a_by_b(ibuf_size, ibuf_bank * ibuf_bits)
-        obuf_word = ceil_a_by_b(obuf_size, obuf_bank * obuf_bits)
-        wbuf_bank_size = wbuf_word * wbuf_bits
-        ibuf_bank_size = ibuf_word * ibuf_bits
-        obuf_bank_size = obuf_word * obuf_bits
-
-        assert wbuf_bank_size * wbuf_bank == wbuf_size
-        assert ibuf_bank_size * ibuf_bank == ibuf_size
-        assert obuf_bank_size * obuf_bank == obuf_size
-
-
-        ##################################################
-        cfg_dict = {'size (bytes)': wbuf_bank_size /8., 'block size (bytes)': max(wbuf_bits/8,1), 'read-write port': 0}
-        wbuf_data = self.sram_obj.get_data_clean(cfg_dict)
-        wbuf_read_energy = float(wbuf_data['read_energy_nJ']) / wbuf_bits
-        wbuf_write_energy = float(wbuf_data['write_energy_nJ']) / wbuf_bits
-        wbuf_leak_power = float(wbuf_data['leak_power_mW']) * wbuf_bank
-        wbuf_area = float(wbuf_data['area_mm^2']) * wbuf_bank
-
-        self.logger.debug('WBUF :')
-        self.logger.debug('\tBanks                       : {0:>8}'.format(wbuf_bank))
-        self.logger.debug('\tBitWidth                    : {0:>8} bits'.format(wbuf_bits))
-        self.logger.debug('\tWords                       : {0:>8}'.format(wbuf_word))
-        self.logger.debug('\tTotal Size                  : {0:>8} kBytes'.format(wbuf_size/8./1024.))
-        self.logger.debug('\tTotal Area                  : {0:>8.2f} mm^2'.format(wbuf_area))
-        self.logger.debug('\tLeak Energy (per clock)     : {0:>8.4f} mWatt'.format(wbuf_leak_power))
-        self.logger.debug('\tRead Energy                 : {0:>8.4f} pJ/bit'.format(wbuf_read_energy * 1.e3))
-        self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(wbuf_write_energy * 1.e3))
-        ##################################################
-        cfg_dict = {'size (bytes)': ibuf_bank_size /8., 'block size (bytes)': max(ibuf_bits/8,1), 'read-write port': 0}
-        ibuf_data = self.sram_obj.get_data_clean(cfg_dict)
-        ibuf_read_energy = float(ibuf_data['read_energy_nJ']) / ibuf_bits
-        ibuf_write_energy = float(ibuf_data['write_energy_nJ']) / ibuf_bits
-        ibuf_leak_power = float(ibuf_data['leak_power_mW']) * ibuf_bank
-        ibuf_area = float(ibuf_data['area_mm^2']) * ibuf_bank
-
-        self.logger.debug('IBUF :')
-        self.logger.debug('\tBanks                       : {0:>8}'.format(ibuf_bank))
-        self.logger.debug('\tBitWidth                    : {0:>8} bits'.format(ibuf_bits))
-        self.logger.debug('\tWords                       : {0:>8}'.format(ibuf_word))
-        self.logger.debug('\tTotal Size                  : {0:>8} kBytes'.format(ibuf_size/8./1024.))
-        self.logger.debug('\tTotal Area                  : {0:>8.2f} mm^2'.format(ibuf_area))
-        self.logger.debug('\tLeak Energy (per clock)     : {0:>8.4f} mWatt'.format(ibuf_leak_power))
-        self.logger.debug('\tRead Energy                 : {0:>8.4f} pJ/bit'.format(ibuf_read_energy * 1.e3))
-        self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(ibuf_write_energy * 1.e3))
-        ##################################################
-        cfg_dict = {'size (bytes)': obuf_bank_size /8., 'block size (bytes)': max(obuf_bits/8,1), 'read-write port': 1}
-        obuf_data = self.sram_obj.get_data_clean(cfg_dict)
-        obuf_read_energy = float(obuf_data['read_energy_nJ']) / obuf_bits
-        obuf_write_energy = float(obuf_data['write_energy_nJ']) / obuf_bits
-        obuf_leak_power = float(obuf_data['leak_power_mW']) * obuf_bank
-        obuf_area = float(obuf_data['area_mm^2']) * obuf_bank
-
-        self.logger.debug('OBUF :')
-        self.logger.debug('\tBanks                       : {0:>8}'.format(obuf_bank))
-        self.logger.debug('\tBitWidth                    : {0:>8} bits'.format(obuf_bits))
-        self.logger.debug('\tWords                       : {0:>8}'.format(obuf_word))
-        self.logger.debug('\tTotal Size                  : {0:>8} kBytes'.format(obuf_size/8./1024.))
-        self.logger.debug('\tTotal Area                  : {0:>8.2f} mm^2'.format(obuf_area))
-        self.logger.debug('\tLeak Energy (per clock)     : {0:>8.4f} mWatt'.format(obuf_leak_power))
-        self.logger.debug('\tRead Energy                 : {0:>8.4f} pJ/bit'.format(obuf_read_energy * 1.e3))
-        self.logger.debug('\tWrite Energy                : {0:>8.4f} pJ/bit'.format(obuf_write_energy * 1.e3))
-        ##################################################
-        # Get stats for systolic array
-        core_csv = os.path.join('./results', 'systolic_array_synth.csv')
-        core_synth_data = pandas.read_csv(core_csv)
-
-        lookup_dict = {}
-        lookup_dict['Max Precision (bits)'] = pmax
-        lookup_dict['Min Precision (bits)'] = pmin
-        lookup_dict['N'] = N
-        lookup_dict['M'] = M
-        core_data = lookup_pandas_dataframe(core_synth_data, lookup_dict)
-        if len(core_data) == 0:
-            print("Couldn't find core data. Assuming default. Bad bad")
-            lookup_dict['N'] = 4
-            lookup_dict['M'] = 4
-            core_data = lookup_pandas_dataframe(core_synth_data, lookup_dict)
-            assert len(core_data) == 1
-            core_area = float(core_data['Area (um^2)']) * 1.e-6 * (N * M) / 16.
-            core_dyn_power = float(core_data['Dynamic Power (nW)']) * (N * M) / 16.
-            core_dyn_energy = core_dyn_power / float(core_data['Frequency'])
-            core_leak_power = float(core_data['Leakage Power (nW)']) * (N * M) / 16.
-            core_leak_energy = core_leak_power / float(core_data['Frequency'])
-        else:
-            print("core_data was not assumed to be default, that is we got the correct values for the core from the csv. This is good")
-            core_area = float(core_data['Area (um^2)']) * 1.e-6
-            core_dyn_power = float(core_data['Dynamic Power (nW)'])
-            core_dyn_energy = core_dyn_power / float(core_data['Frequency'])
-            core_leak_power = float(core_data['Leakage Power (nW)'])
-            core_leak_energy = core_leak_power / float(core_data['Frequency'])
-        self.logger.debug('Core :')
-        self.logger.debug('\tDimensions              : {0}x{1}-systolic array'.format(N, M))
-        self.logger.debug('\tMax-Precision           : {}'.format(pmax))
-        self.logger.debug('\tMin-Precision           : {}'.format(pmin))
-        self.logger.debug('\tLeak power              : {} (nW)'.format(core_leak_energy))
-        self.logger.debug('\tDynamic Energy (nJ)     : {}'.format(core_dyn_energy))
-        self.logger.debug('\tArea (mm^2)             : {}'.format(core_area))
-        ##################################################
-
-        energy_tuple = EnergyTuple(core_dyn_energy, wbuf_read_energy, wbuf_write_energy, ibuf_read_energy, ibuf_write_energy, obuf_read_energy, obuf_write_energy)
-
-        return energy_tuple
+        return self.get_hw_costs()['energy']
 
 
     def __str__(self):
@@ -377,7 +320,9 @@ class Simulator(object):
         """
 
         # The following loop promotes Memory accesses to improve reuse
-        loop_instruction.promote_mem_ops(self.accelerator.sram)
+        # (a LoopNest is promoted when it is built)
+        if isinstance(loop_instruction, LoopStack):
+            loop_instruction.promote_mem_ops(self.accelerator.sram)
         # get stats
         stats = loop_instruction.get_stats(self.accelerator, verbose)
 
@@ -436,8 +381,8 @@ class Simulator(object):
         best_instructions_dict = {}
         conv_params = self.accelerator, K, O, S, IC, OC, B, iprec, wprec, im2col, self.get_energy_cost()
 
-        best_instructions, best_tiling, best_order = optimize_for_order(conv_params)
-        stats = get_stats_fast(conv_params, best_tiling, best_order, verbose=False)
+        stats, best_tiling, best_order = self.get_layer_stats(conv_params)
+        best_instructions = get_loop_nest(conv_params, best_tiling, best_order)
 
         act_reads = stats.reads['act']
         wgt_reads = stats.reads['wgt']
@@ -475,7 +420,89 @@ class Simulator(object):
 
         return stats, best_instructions
 
-    def get_cycles(self, op, im2col=False):
+    def get_layer_stats(self, conv_params, candidates=None):
+        """
+        Returns (stats, best_tiling, best_order) for a layer, from the layer
+        cache or from the optimizer
+        Args:
+            conv_params: A tuple with convolution params. Its accelerator
+                         may differ from self.accelerator, e.g. for one
+                         instance of a partitioned layer.
+            candidates: precomputed tile candidates, see optimize_for_order
+        """
+        layer_key = self._get_layer_key(conv_params)
+        cached = self.layer_cache.get(layer_key)
+        if cached is not None:
+            self.logger.debug('Layer cache hit')
+            return cached
+
+        best_tiling, best_order = optimize_for_order(conv_params, tile_candidates=self.tile_candidates,
+                                                     candidates=candidates)
+        stats = self._get_tiling_stats(conv_params, best_tiling, best_order)
+        self.layer_cache.put(layer_key, (stats, best_tiling, best_order))
+        return stats, best_tiling, best_order
+
+    def _get_layer_key(self, conv_params):
+        layer_key = get_layer_key(conv_params, self.tile_candidates)
+        if self.timing_model != 'analytic':
+            layer_key = (self.timing_model,) + layer_key
+        return layer_key
+
+    def _get_tiling_stats(self, conv_params, best_tiling, best_order):
+        if self.timing_model == 'event':
+            best_instructions = get_loop_nest(conv_params, best_tiling, best_order)
+            return simulate_loop_nest(best_instructions, conv_params[0]).stats
+        return get_stats_fast(conv_params, best_tiling, best_order, verbose=False)
+
+    def get_batch_stats(self, op, batch_sizes):
+        """
+        Returns the Stats of a Convolution or MatMul op for each batch size
+        in batch_sizes, the same as get_cycles with the batch dimension of
+        op replaced, or None for other ops.
+
+        The batch sizes missing from the layer cache are searched together
+        (see optimize_for_batch_sizes): the tile sizes, their SRAM and DRAM
+        traffic and their feasibility are computed once for the layer, and
+        only the number of B/b tiles and the argmin differ between batch
+        sizes.
+        """
+        params = self.get_layer_params(op)
+        if params is None:
+            return
+        K, O, S, IC, OC, iprec, wprec, _, im2col = params
+        if isinstance(op, MatMul):
+            # As get_FC_cycles
+            im2col = False
+
+        get_conv_params = lambda B: (self.accelerator, K, O, S, IC, OC, B, iprec, wprec, im2col,
+                                     self.get_energy_cost())
+
+        ret = [None] * len(batch_sizes)
+        missing = []
+        for i, B in enumerate(batch_sizes):
+            cached = self.layer_cache.get(self._get_layer_key(get_conv_params(B)))
+            if cached is None:
+                missing.append(i)
+            else:
+                ret[i] = cached[0]
+        if len(missing) == 0:
+            return ret
+
+        missing_batch_sizes = [batch_sizes[i] for i in missing]
+        results = optimize_for_batch_sizes(get_conv_params(missing_batch_sizes[0]), missing_batch_sizes,
+                                           self.tile_candidates)
+        for i, (best_tiling, best_order) in zip(missing, results):
+            conv_params = get_conv_params(batch_sizes[i])
+            stats = self._get_tiling_stats(conv_params, best_tiling, best_order)
+            self.layer_cache.put(self._get_layer_key(conv_params), (stats, best_tiling, best_order))
+            ret[i] = stats
+        return ret
+
+    def get_layer_params(self, op):
+        """
+        Returns (K, O, S, IC, OC, iprec, wprec, B, im2col) for Convolution
+        and MatMul ops (as a 1x1 convolution), and None for other ops
+        """
         if isinstance(op, Convolution):
             B, I, _, IC = op.data.shape
             _, O, _, OC = op.output_tensors.shape
@@ -489,6 +516,20 @@ class Simulator(object):
                 im2col = True # im2col for first layer
             else:
                 im2col = False
+            return K, O, S, IC, OC, iprec, wprec, B, im2col
+        elif isinstance(op, MatMul):
+            B = op.data.shape[0]
+            OC, IC  = op.weights.shape
+            iprec = op.data.dtype.bits
+            wprec = op.weights.dtype.bits
+            return 1, 1, 1, IC, OC, iprec, wprec, B, False
+
+    def get_cycles(self, op, im2col=False):
+        params = self.get_layer_params(op)
+        if params is None:
+            return
+        K, O, S, IC, OC, iprec, wprec, B, im2col = params
+        if isinstance(op, Convolution):
             return self.get_conv_cycles(K,
                                         O,
                                         S,
@@ -498,9 +539,24 @@ class Simulator(object):
                                         wprec,
                                         B,
                                         im2col)
-        elif isinstance(op, MatMul):
-            B = op.data.shape[0]
-            OC, IC  = op.weights.shape
-            iprec = op.data.dtype.bits
-            wprec = op.weights.dtype.bits
+        else:
             return self.get_FC_cycles(IC, OC, iprec, wprec, batch_size=B)
+
+    def get_pareto_points(self, op):
+        """
+        Returns the Pareto frontier of (cycles, energy, DRAM bits) for a
+        Convolution or MatMul op as a list of ParetoPoint, or None for other
+        ops. See get_pareto_frontier.
+        """
+        params = self.get_layer_params(op)
+        if params is None:
+            return
+        K, O, S, IC, OC, iprec, wprec, B, im2col = params
+        conv_params = self.accelerator, K, O, S, IC, OC, B, iprec, wprec, im2col, self.get_energy_cost()
+
+        layer_key = ('pareto',) + get_layer_key(conv_params, self.tile_candidates)
+        points = self.layer_cache.get(layer_key)
+        if points is None:
+            points = get_pareto_frontier(conv_params, self.tile_candidates)
+            self.layer_cache.put(layer_key, points)
+        return points
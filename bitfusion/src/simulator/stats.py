@@ -1,17 +1,153 @@
+import numbers
+
+import numpy as np
+
+from bitfusion.src.simulator import energy
+
+# Memory namespaces with read/write counters
+namespaces = ['act', 'wgt', 'out', 'dram']
+
+# Layout of the vector behind Stats (and of the rows of StatsBatch)
+fields = ['total_cycles', 'mem_stall_cycles'] + \
+        ['reads_' + n for n in namespaces] + \
+        ['writes_' + n for n in namespaces]
+_reads_offset = fields.index('reads_' + namespaces[0])
+_writes_offset = fields.index('writes_' + namespaces[0])
+_namespace_index = dict((n, i) for i, n in enumerate(namespaces))
+_field_index = dict((n, i) for i, n in enumerate(fields))
+
+def _get_scalar(data, idx):
+    value = data[idx]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _get_dtype(dtype, value):
+    """
+    Returns the dtype needed to store value in an array of dtype. Counters
+    stay integers until a float is stored, and fall back to Python objects
+    beyond 64 bits.
+    """
+    if dtype == np.object_:
+        return dtype
+    if isinstance(value, numbers.Integral):
+        if dtype.kind == 'i' and not -2**63 <= value < 2**63:
+            return np.dtype(np.object_)
+        return dtype
+    if dtype.kind == 'i':
+        return np.dtype(np.float64)
+    return dtype
+
+_int64_max = 2**63 - 1
+
+def _add_data(a, b):
+    """
+    Returns a + b for two counter arrays. int64 sums that would wrap around
+    are redone with Python objects, as in _get_dtype.
+    """
+    result = a + b
+    if result.dtype.kind == 'i':
+        # Two's complement wrap-around flips the sign of a same-signed sum
+        if np.any(((a ^ result) & (b ^ result)) < 0):
+            return a.astype(np.object_) + b.astype(np.object_)
+    return result
+
+def _mul_data(a, value):
+    """
+    Returns a * value for a counter array and a scalar. int64 products that
+    would wrap around are redone with Python objects, as in _get_dtype.
+    """
+    dtype = _get_dtype(a.dtype, value)
+    a = a.astype(dtype, copy=False)
+    if dtype.kind == 'i' and value != 0:
+        limit = _int64_max // abs(value)
+        if a.max() > limit or a.min() < -limit:
+            a = a.astype(np.object_)
+    return a * value
+
+class NamespaceCounters(object):
+    """
+    dict-like view of the reads (or writes) of a Stats object, indexed by
+    namespace
+    """
+    __slots__ = ('_stats', '_offset')
+
+    def __init__(self, stats, offset):
+        self._stats = stats
+        self._offset = offset
+
+    def __getitem__(self, namespace):
+        return _get_scalar(self._stats.data, self._offset + _namespace_index[namespace])
+
+    def __setitem__(self, namespace, value):
+        self._stats._set(self._offset + _namespace_index[namespace], value)
+
+    def __contains__(self, namespace):
+        return namespace in _namespace_index
+
+    def __iter__(self):
+        return iter(namespaces)
+
+    def __len__(self):
+        return len(namespaces)
+
+    def keys(self):
+        return list(namespaces)
+
+    def items(self):
+        return [(n, self[n]) for n in namespaces]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
 class Stats(object):
     """
-    Stores the stats from the simulator
+    Stores the stats from the simulator, as a vector laid out as in fields
     """
+    __slots__ = ('data',)
 
-    def __init__(self):
-        self.total_cycles = 0
-        self.mem_stall_cycles = 0
-        self.namespaces = ['act', 'wgt', 'out', 'dram']
-        self.reads = {}
-        self.writes = {}
-        for n in self.namespaces:
-            self.reads[n] = 0
-            self.writes[n] = 0
+    namespaces = namespaces
+
+    def __init__(self, data=None):
+        if data is None:
+            data = np.zeros(len(fields), dtype=np.int64)
+        self.data = data
+
+    @property
+    def reads(self):
+        return NamespaceCounters(self, _reads_offset)
+
+    @property
+    def writes(self):
+        return NamespaceCounters(self, _writes_offset)
+
+    def _set(self, idx, value):
+        dtype = _get_dtype(self.data.dtype, value)
+        if dtype != self.data.dtype:
+            self.data = self.data.astype(dtype)
+        self.data[idx] = value
+
+    @property
+    def total_cycles(self):
+        return _get_scalar(self.data, 0)
+
+    @total_cycles.setter
+    def total_cycles(self, value):
+        self._set(0, value)
+
+    @property
+    def mem_stall_cycles(self):
+        return _get_scalar(self.data, 1)
+
+    @mem_stall_cycles.setter
+    def mem_stall_cycles(self, value):
+        self._set(1, value)
+
+    def __getstate__(self):
+        return (self.data,)
+
+    def __setstate__(self, state):
+        self.data = state[0]
 
     def __iter__(self):
         return iter([\
@@ -26,22 +162,14 @@ class Stats(object):
                     ])
 
     def __add__(self, other):
-        ret = Stats()
-        ret.total_cycles = self.total_cycles + other.total_cycles
-        ret.mem_stall_cycles = self.mem_stall_cycles + other.mem_stall_cycles
-        for n in self.namespaces:
-            ret.reads[n] = self.reads[n] + other.reads[n]
-            ret.writes[n] = self.writes[n] + other.writes[n]
-        return ret
+        return Stats(_add_data(self.data, other.data))
+
+    def __iadd__(self, other):
+        self.data = _add_data(self.data, other.data)
+        return self
 
     def __mul__(self, other):
-        ret = Stats()
-        ret.total_cycles = self.total_cycles * other
-        ret.mem_stall_cycles = self.mem_stall_cycles * other
-        for n in self.namespaces:
-            ret.reads[n] = self.reads[n] * other
-            ret.writes[n] = self.writes[n] * other
-        return ret
+        return Stats(_mul_data(self.data, other))
 
     def __str__(self):
         ret = '\tStats'
@@ -55,7 +183,8 @@ class Stats(object):
             ret+= '\n\t{0:>20} wr: {1:>20,} bits, '.format(n, self.writes[n])
         return ret
 
-    def get_energy(self, energy_cost, dram_cost=15.e-3):
+    def get_energy(self, energy_cost, dram_cost=None):
+        dram_cost = energy.get_dram_cost(energy_cost, dram_cost)
         #print("aman total_cycles = {}, mem_stall_cycles = {}".format(self.total_cycles, self.mem_stall_cycles))
         dyn_energy = (self.total_cycles - self.mem_stall_cycles) * energy_cost.core_dynamic_energy
 
@@ -68,13 +197,14 @@ class Stats(object):
         dyn_energy += self.reads['out'] * energy_cost.obuf_read_energy
         dyn_energy += self.writes['out'] * energy_cost.obuf_write_energy
 
-        # Assuming that the DRAM requires 6 pJ/bit
+        # DRAM energy per bit, 15 pJ/bit unless configured
         dyn_energy += self.reads['dram'] * dram_cost
         dyn_energy += self.writes['dram'] * dram_cost
 
         return dyn_energy
 
-    def get_energy_breakdown(self, energy_cost, dram_cost=15.e-3):
+    def get_energy_breakdown(self, energy_cost, dram_cost=None):
+        dram_cost = energy.get_dram_cost(energy_cost, dram_cost)
         core_energy = (self.total_cycles - self.mem_stall_cycles) * energy_cost.core_dynamic_energy
         breakdown = [core_energy]
 
@@ -94,6 +224,94 @@ class Stats(object):
         breakdown.append(dram_energy)
         return breakdown
 
+class StatsBatch(object):
+    """
+    Stats for many layers or configurations, one row per Stats, with the
+    columns laid out as in fields
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = np.asarray(data)
+        assert self.data.ndim == 2 and self.data.shape[1] == len(fields)
+
+    @classmethod
+    def from_stats(cls, stats_list):
+        stats_list = list(stats_list)
+        if len(stats_list) == 0:
+            return cls(np.zeros((0, len(fields)), dtype=np.int64))
+        return cls(np.stack([s.data for s in stats_list]))
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Builds a batch from a results dataframe with the columns written by
+        SimulatorSweep
+        """
+        columns = ['Cycles', 'Memory wait cycles',
+                   'IBUF Read', 'WBUF Read', 'OBUF Read', 'DRAM Read',
+                   'IBUF Write', 'WBUF Write', 'OBUF Write', 'DRAM Write']
+        return cls(df[columns].values)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, idx):
+        return Stats(self.data[idx].copy())
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def get(self, field):
+        """
+        Returns one column, e.g. 'total_cycles' or 'reads_dram'
+        """
+        return self.data[:, _field_index[field]]
+
+    def sum(self):
+        """
+        Returns the sum over all rows as a Stats object
+        """
+        data = self.data.sum(axis=0)
+        if data.dtype.kind == 'i' and \
+                np.any(np.abs(self.data.sum(axis=0, dtype=np.float64)) > _int64_max):
+            data = self.data.astype(np.object_).sum(axis=0)
+        return Stats(data)
+
+    def get_access_counts(self):
+        """
+        Returns the access-count matrix of the rows, see
+        energy.access_fields
+        """
+        return get_access_counts(self.data)
+
+    def get_energy(self, energy_costs, dram_cost=None):
+        """
+        Vectorized Stats.get_energy; returns the energy of each row, or a
+        (rows x configurations) matrix for a list of EnergyTuples
+        """
+        return energy.get_energy(self.get_access_counts(),
+                                 energy.get_access_costs(energy_costs, dram_cost))
+
+    def get_energy_breakdown(self, energy_costs, dram_cost=None):
+        """
+        Vectorized Stats.get_energy_breakdown; returns a list of four arrays
+        """
+        breakdown = energy.get_energy_breakdown(self.get_access_counts(),
+                                                energy.get_access_costs(energy_costs, dram_cost))
+        return [breakdown[..., i] for i in range(len(energy.breakdown_fields))]
+
+def get_access_counts(stats_data):
+    """
+    Returns the access-count matrix (..., len(energy.access_fields)) for
+    stats laid out as in fields, e.g. Stats.data or StatsBatch.data
+    """
+    stats_data = np.asarray(stats_data)
+    counts = [stats_data[..., _field_index['total_cycles']] - stats_data[..., _field_index['mem_stall_cycles']]]
+    counts += [stats_data[..., _field_index[x]] for x in energy.access_fields[1:]]
+    return np.stack(counts, axis=-1)
+
 def get_energy_from_results(results, acc_obj):
     stats = Stats()
     stats.total_cycles = int(results['Cycles'])
@@ -108,4 +326,3 @@ def get_energy_from_results(results, acc_obj):
     stats.writes['dram'] = int(results['DRAM Write'])
     energy = stats.get_energy(acc_obj)
     return energy
-
@@ -0,0 +1,215 @@
+import logging
+import os
+import sqlite3
+
+import pandas
+
+from bitfusion.src.utils.utils import lookup_pandas_dataframe
+
+class ResultsStore(object):
+    """
+    Append-only storage for SimulatorSweep results. Rows are only ever added,
+    so an interrupted sweep keeps everything written before the crash and
+    resumes from there on the next run.
+    """
+
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.columns = list(columns)
+        self.logger = logging.getLogger('{}.{}'.format(__name__, self.__class__.__name__))
+
+    def read(self):
+        """
+        Returns all stored rows as a pandas dataframe
+        """
+        raise NotImplementedError
+
+    def append(self, df):
+        """
+        Adds the rows of df to the store, all or none of them: after a
+        crash, a job either has all its rows or none and is rerun
+        """
+        raise NotImplementedError
+
+    def query(self, lookup_dict):
+        """
+        Returns the stored rows that match lookup_dict
+        """
+        return lookup_pandas_dataframe(self.read(), lookup_dict)
+
+    def close(self):
+        pass
+
+    def _empty(self):
+        return pandas.DataFrame(columns=self.columns)
+
+    def __str__(self):
+        return '{}: {}'.format(self.__class__.__name__, self.filename)
+
+class CsvResultsStore(ResultsStore):
+    """
+    Appends rows to a csv file instead of rewriting it. Compatible with the
+    csv files written by earlier sweeps.
+
+    Before each append, the size of the file is saved in a journal next to
+    it, which is removed once the rows are on disk. A journal left by a
+    crash means the append did not finish, so the file is truncated back to
+    the saved size and none of its rows are kept.
+    """
+
+    def _get_journal_filename(self):
+        return self.filename + '.journal'
+
+    def _write_journal(self, size):
+        journal = self._get_journal_filename()
+        with open(journal + '.tmp', 'w') as f:
+            f.write('{}\n'.format(size))
+            f.flush()
+            os.fsync(f.fileno())
+        # The rename makes the journal appear complete or not at all
+        os.rename(journal + '.tmp', journal)
+
+    def _rollback(self):
+        """
+        Undoes an append interrupted by a crash
+        """
+        journal = self._get_journal_filename()
+        if not os.path.exists(journal):
+            return
+        with open(journal, 'r') as f:
+            size = int(f.read())
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > size:
+            self.logger.warning('Dropping {} bytes of an interrupted append from {}'.format(
+                os.path.getsize(self.filename) - size, self.filename))
+            with open(self.filename, 'rb+') as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+        os.remove(journal)
+
+    def _repair(self):
+        """
+        Undoes an interrupted append, and drops a partially written last
+        line left behind by a crash of a sweep without a journal
+        """
+        self._rollback()
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            data = f.read()
+            keep = data.rfind(b'\n') + 1
+            self.logger.warning('Dropping {} bytes of a partial row from {}'.format(size - keep, self.filename))
+            f.truncate(keep)
+
+    def read(self):
+        self._repair()
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+            return self._empty()
+        return pandas.read_csv(self.filename)
+
+    def append(self, df):
+        if len(df) == 0:
+            return
+        self._repair()
+        size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        write_header = size == 0
+        data = df[self.columns].to_csv(index=False, header=write_header)
+        self._write_journal(size)
+        with open(self.filename, 'a') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(self._get_journal_filename())
+
+class SqliteResultsStore(ResultsStore):
+    """
+    Stores rows in an SQLite table in WAL mode. Each append is a single
+    transaction, and lookups are answered by SQL on an indexed table.
+    """
+
+    table = 'results'
+
+    def __init__(self, filename, columns, key_columns=None):
+        super(SqliteResultsStore, self).__init__(filename, columns)
+        if key_columns is None:
+            key_columns = [x for x in self.columns if x not in ('Layer',)]
+        self.key_columns = list(key_columns)
+        self._db = None
+
+    @staticmethod
+    def _quote(name):
+        return '"{}"'.format(name.replace('"', '""'))
+
+    def _get_db(self):
+        if self._db is None:
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._db = sqlite3.connect(self.filename)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                self.table, ', '.join(self._quote(x) for x in self.columns)))
+            self._db.execute('CREATE INDEX IF NOT EXISTS {}_key ON {} ({})'.format(
+                self.table, self.table, ', '.join(self._quote(x) for x in self.key_columns)))
+            self._db.commit()
+        return self._db
+
+    def _select(self, where='', args=()):
+        sql = 'SELECT {} FROM {}{}'.format(
+                ', '.join(self._quote(x) for x in self.columns), self.table, where)
+        rows = self._get_db().execute(sql, args).fetchall()
+        if len(rows) == 0:
+            return self._empty()
+        return pandas.DataFrame(rows, columns=self.columns)
+
+    def read(self):
+        return self._select()
+
+    def append(self, df):
+        if len(df) == 0:
+            return
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                self.table,
+                ', '.join(self._quote(x) for x in self.columns),
+                ', '.join('?' for x in self.columns))
+        rows = []
+        for row in df[self.columns].itertuples(index=False):
+            # sqlite3 does not accept numpy scalars
+            rows.append(tuple(x.item() if hasattr(x, 'item') else x for x in row))
+        db = self._get_db()
+        with db:
+            db.executemany(sql, rows)
+
+    def query(self, lookup_dict):
+        if len(lookup_dict) == 0:
+            return self.read().drop_duplicates()
+        columns = sorted(lookup_dict)
+        where = ' WHERE ' + ' AND '.join('{} = ?'.format(self._quote(x)) for x in columns)
+        args = tuple(lookup_dict[x].item() if hasattr(lookup_dict[x], 'item') else lookup_dict[x] for x in columns)
+        return self._select(where, args).drop_duplicates()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+def get_results_store(filename, columns):
+    """
+    Returns a results store for filename. Files ending in .sqlite or .db use
+    SQLite, everything else is an append-only csv file.
+    """
+    if isinstance(filename, ResultsStore):
+        return filename
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.sqlite', '.db'):
+        return SqliteResultsStore(filename, columns)
+    return CsvResultsStore(filename, columns)
@@ -3,11 +3,27 @@ import os
 import logging
 
 from bitfusion.src.simulator.simulator import Simulator
-from bitfusion.src.utils.utils import lookup_pandas_dataframe
+from bitfusion.src.utils.utils import lookup_pandas_dataframe, PandasLookupIndex
+from bitfusion.src.sweep.results_store import get_results_store
+from bitfusion.src.sweep.sweep_jobs import get_sweep_jobs, get_job_lookup_dict, get_job_shard, run_jobs
 import bitfusion.src.benchmarks.benchmarks as benchmarks
 
 class SimulatorSweep(object):
+    columns = ['N', 'M', 'Max Precision (bits)', 'Min Precision (bits)',
+            'Network', 'Layer',
+            'Cycles', 'Memory wait cycles',
+            'WBUF Read', 'WBUF Write',
+            'OBUF Read', 'OBUF Write',
+            'IBUF Read', 'IBUF Write',
+            'DRAM Read', 'DRAM Write',
+            'Bandwidth (bits/cycle)',
+            'WBUF Size (bits)', 'OBUF Size (bits)', 'IBUF Size (bits)',
+            'Batch size']
+
     def __init__(self, csv_filename, config_file='conf.ini', verbose=False):
+        """
+        csv_filename can also be a .sqlite file or a ResultsStore
+        """
         self.sim_obj = Simulator(config_file, verbose=False)
         self.csv_filename = csv_filename
         if verbose:
@@ -17,25 +33,16 @@ class SimulatorSweep(object):
         self.logger = logging.getLogger('{}.{}'.format(__name__, 'Simulator'))
         self.logger.setLevel(log_level)
 
-        self.columns = ['N', 'M', 'Max Precision (bits)', 'Min Precision (bits)',
-                'Network', 'Layer',
-                'Cycles', 'Memory wait cycles',
-                'WBUF Read', 'WBUF Write',
-                'OBUF Read', 'OBUF Write',
-                'IBUF Read', 'IBUF Write',
-                'DRAM Read', 'DRAM Write',
-                'Bandwidth (bits/cycle)',
-                'WBUF Size (bits)', 'OBUF Size (bits)', 'IBUF Size (bits)',
-                'Batch size']
-
-        if os.path.exists(csv_filename):
-            self.sweep_df = pandas.read_csv(csv_filename)
-        else:
-            self.sweep_df = pandas.DataFrame(columns=self.columns)
+        # Results are appended to the store as they are simulated, so an
+        # interrupted sweep resumes from the last hardware point written
+        self.results_store = get_results_store(csv_filename, self.columns)
+        self.sweep_df = self.results_store.read()
+        self.sweep_index = PandasLookupIndex(self.sweep_df)
 
-    def sweep(self, sim_obj, list_n=None, list_m=None, list_pmax=None, list_pmin=None, list_bw=None, list_bench=None, list_wbuf=None, list_ibuf=None, list_obuf=None, list_batch=None):
+    def get_jobs(self, sim_obj, list_n=None, list_m=None, list_pmax=None, list_pmin=None, list_bw=None, list_bench=None, list_wbuf=None, list_ibuf=None, list_obuf=None, list_batch=None):
         """
-        Sweep the parameters of the accelerator
+        Expands the sweep grid into jobs. Parameters that are not given are
+        taken from the accelerator of sim_obj.
         """
 
         if list_n is None:
@@ -73,76 +80,103 @@ class SimulatorSweep(object):
         print(list_wbuf)
         print(list_ibuf)
         print(list_obuf)
-        data_line = []
-        for batch_size in list_batch:
-            for n in list_n:
-                for m in list_m:
-                    # self.logger.info('N x M = {} x {}'.format(n, m))
-                    for pmax in list_pmax:
-                        for pmin in list_pmin:
-                            if pmin > pmax:
-                                continue
-                            for wbuf in list_wbuf:
-                                for ibuf in list_ibuf:
-                                    for obuf in list_obuf:
-                                        for bw in list_bw:
-                                            sim_obj.accelerator.N = n
-                                            sim_obj.accelerator.M = m
-                                            sim_obj.accelerator.pmax = pmax
-                                            sim_obj.accelerator.pmin = pmin
-                                            sim_obj.accelerator.mem_if_width = bw
-                                            sim_obj.accelerator.sram['wgt'] = wbuf
-                                            sim_obj.accelerator.sram['out'] = obuf
-                                            sim_obj.accelerator.sram['act'] = ibuf
-                                            for b in list_bench:
-                                                #print("Inside loop of simulator sweep")
-                                                lookup_dict = {}
-                                                lookup_dict['N'] = n
-                                                lookup_dict['M'] = m
-                                                lookup_dict['Max Precision (bits)'] = pmax
-                                                lookup_dict['Min Precision (bits)'] = pmin
-                                                lookup_dict['Network'] = b
-                                                lookup_dict['Bandwidth (bits/cycle)'] = sim_obj.accelerator.mem_if_width
-                                                lookup_dict['WBUF Size (bits)'] = wbuf
-                                                lookup_dict['OBUF Size (bits)'] = obuf
-                                                lookup_dict['IBUF Size (bits)'] = ibuf
-                                                lookup_dict['Batch size'] = batch_size
-                                                results = lookup_pandas_dataframe(self.sweep_df, lookup_dict)
-                                                nn = benchmarks.get_bench_nn(b, WRPN=True)
-                                                #print("length of results = {}".format(len(results)))
-                                                if len(results) == 0:
-                                                    self.logger.info('Simulating Benchmark: {}'.format(b))
-                                                    self.logger.info('N x M = {} x {}'.format(n, m))
-                                                    self.logger.info('Max Precision (bits): {}'.format(pmax))
-                                                    self.logger.info('Min Precision (bits): {}'.format(pmin))
-                                                    self.logger.info('Batch size: {}'.format(batch_size))
-                                                    self.logger.info('Bandwidth (bits/cycle): {}'.format(bw))
-                                                    stats = benchmarks.get_bench_numbers(nn, sim_obj, batch_size)
-                                                    for layer in stats:
-                                                        cycles = stats[layer].total_cycles
-                                                        reads = stats[layer].reads
-                                                        writes = stats[layer].writes
-                                                        stalls = stats[layer].mem_stall_cycles
-                                                        print("appending data_line")
-                                                        data_line.append((n,m,pmax,pmin,b,layer,
-                                                            cycles,stalls,
-                                                            reads['wgt'],writes['wgt'],
-                                                            reads['out'],writes['out'],
-                                                            reads['act'],writes['act'],
-                                                            reads['dram'],writes['dram'],
-                                                            sim_obj.accelerator.mem_if_width,
-                                                            wbuf, obuf, ibuf, batch_size))
-                                            if len(data_line) > 0:
-                                                if os.path.exists(self.csv_filename):
-                                                    self.sweep_df = pandas.read_csv(self.csv_filename)
-                                                else:
-                                                    self.sweep_df = pandas.DataFrame(columns=self.columns)
-                                                self.sweep_df = self.sweep_df.append(pandas.DataFrame(data_line, columns=self.columns))
-                                                self.sweep_df.to_csv(self.csv_filename, index=False)
-                                                data_line = []
+        return get_sweep_jobs(list_n, list_m, list_pmax, list_pmin,
+                              list_wbuf, list_ibuf, list_obuf, list_bw,
+                              list_bench, list_batch)
+
+    def get_pending_jobs(self, jobs):
+        """
+        Returns the jobs that have no results yet
+        """
+        return [job for job in jobs
+                if len(lookup_pandas_dataframe(self.sweep_index, get_job_lookup_dict(job))) == 0]
+
+    def _run(self, sim_obj, jobs, results_store, processes):
+        for job, data_line in run_jobs(sim_obj, jobs, processes):
+            if len(data_line) > 0:
+                # Only the new rows are written out
+                new_df = pandas.DataFrame(data_line, columns=self.columns)
+                results_store.append(new_df)
+                if results_store is self.results_store:
+                    self.sweep_df = self.sweep_index.append(new_df)
+
+    def sweep(self, sim_obj, list_n=None, list_m=None, list_pmax=None, list_pmin=None, list_bw=None, list_bench=None, list_wbuf=None, list_ibuf=None, list_obuf=None, list_batch=None, processes=1):
+        """
+        Sweep the parameters of the accelerator
+        Args:
+            processes: number of worker processes (None for cpu_count()).
+                       With processes=1 the sweep runs on sim_obj.
+        """
+        jobs = self.get_jobs(sim_obj, list_n, list_m, list_pmax, list_pmin, list_bw,
+                             list_bench, list_wbuf, list_ibuf, list_obuf, list_batch)
+        self._run(sim_obj, self.get_pending_jobs(jobs), self.results_store, processes)
+        return self.sweep_df
+
+    def _get_shard_filename(self, work_dir, shard, num_shards):
+        return os.path.join(work_dir, 'shard-{}-of-{}.csv'.format(shard, num_shards))
+
+    def sweep_shard(self, sim_obj, work_dir, shard, num_shards, processes=1, **kwargs):
+        """
+        Runs one shard of the sweep and appends its results to a file in
+        work_dir. Each machine sharing work_dir runs a different shard; use
+        merge_shards to collect the results. Jobs that already have results,
+        in this sweep's store or in the shard file, are skipped.
+        Args:
+            kwargs: the list_* arguments of sweep
+        """
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        shard_store = get_results_store(self._get_shard_filename(work_dir, shard, num_shards), self.columns)
+        shard_index = PandasLookupIndex(shard_store.read())
+
+        jobs = [job for job in self.get_jobs(sim_obj, **kwargs)
+                if get_job_shard(job, num_shards) == shard]
+        jobs = [job for job in self.get_pending_jobs(jobs)
+                if len(lookup_pandas_dataframe(shard_index, get_job_lookup_dict(job))) == 0]
+        self.logger.info('Shard {} of {}: {} jobs'.format(shard, num_shards, len(jobs)))
+        self._run(sim_obj, jobs, shard_store, processes)
+        shard_store.close()
+
+    def merge_shards(self, sim_obj, work_dir, num_shards, **kwargs):
+        """
+        Appends the shard results in work_dir to this sweep's store. Rows are
+        merged in job order, so the output does not depend on which machine
+        finished first.
+        """
+        shard_index = PandasLookupIndex(pandas.concat(
+            [get_results_store(self._get_shard_filename(work_dir, shard, num_shards), self.columns).read()
+             for shard in range(num_shards)], ignore_index=True, sort=False))
+        new_df = []
+        for job in self.get_pending_jobs(self.get_jobs(sim_obj, **kwargs)):
+            rows = lookup_pandas_dataframe(shard_index, get_job_lookup_dict(job))
+            if len(rows) == 0:
+                self.logger.warning('No results for {}'.format(job))
+            else:
+                new_df.append(rows)
+        if len(new_df) > 0:
+            new_df = pandas.concat(new_df, ignore_index=True)
+            self.results_store.append(new_df)
+            self.sweep_df = self.sweep_index.append(new_df)
         return self.sweep_df
 
+def load_sweep_results(sim_sweep_csv, columns=None):
+    """
+    Returns all results stored in sim_sweep_csv (a csv or .sqlite file)
+    """
+    if columns is None:
+        columns = SimulatorSweep.columns
+    results_store = get_results_store(sim_sweep_csv, columns)
+    try:
+        return results_store.read()
+    finally:
+        results_store.close()
+
 def check_pandas_or_run(sim, dataframe, sim_sweep_csv, batch_size=1, config_file='./conf.ini'):
+    """
+    Returns the results for the configuration of sim, running the sweep if
+    they are missing. If dataframe is None, the results store is queried
+    directly.
+    """
     ld = {}
     ld['N'] = sim.accelerator.N
     ld['M'] = sim.accelerator.M
@@ -154,13 +188,19 @@ def check_pandas_or_run(sim, dataframe, sim_sweep_csv, batch_size=1, config_file
     ld['IBUF Size (bits)'] = sim.accelerator.sram['act']
     ld['Batch size'] = batch_size
 
-    results = lookup_pandas_dataframe(dataframe, ld)
+    if dataframe is None:
+        results_store = get_results_store(sim_sweep_csv, SimulatorSweep.columns)
+        try:
+            results = results_store.query(ld)
+        finally:
+            results_store.close()
+    else:
+        results = lookup_pandas_dataframe(dataframe, ld)
 
     if len(results) == 0:
         sweep_obj = SimulatorSweep(sim_sweep_csv, config_file, verbose=True)
-        dataframe = sweep_obj.sweep(sim, list_batch=[batch_size])
-        dataframe.to_csv(sim_sweep_csv, index=False)
-        return lookup_pandas_dataframe(dataframe, ld)
+        sweep_obj.sweep(sim, list_batch=[batch_size])
+        return lookup_pandas_dataframe(sweep_obj.sweep_index, ld)
     else:
         return results
 
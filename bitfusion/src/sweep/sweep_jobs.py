@@ -0,0 +1,161 @@
+import copy
+import hashlib
+import logging
+
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+from bitfusion.src.simulator.simulator import Simulator
+from bitfusion.src.simulator.accelerator import Accelerator
+import bitfusion.src.benchmarks.benchmarks as benchmarks
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'SweepJobs'))
+logger.setLevel(logging.INFO)
+
+# One hardware point and benchmark. Jobs are immutable and carry everything a
+# worker needs, so they can run in any process or on any machine.
+SweepJob = namedtuple('SweepJob', ['N', 'M', 'pmax', 'pmin',
+                                   'wbuf', 'ibuf', 'obuf', 'bw',
+                                   'batch_size', 'bench'])
+
+def get_sweep_jobs(list_n, list_m, list_pmax, list_pmin,
+                   list_wbuf, list_ibuf, list_obuf, list_bw,
+                   list_bench, list_batch):
+    """
+    Expands the sweep grid into a list of jobs, in the order SimulatorSweep
+    has always simulated them. Invalid points (pmin > pmax) and duplicates
+    are dropped.
+    """
+    jobs = []
+    seen = set()
+    for batch_size in list_batch:
+        for n in list_n:
+            for m in list_m:
+                for pmax in list_pmax:
+                    for pmin in list_pmin:
+                        if pmin > pmax:
+                            continue
+                        for wbuf in list_wbuf:
+                            for ibuf in list_ibuf:
+                                for obuf in list_obuf:
+                                    for bw in list_bw:
+                                        for b in list_bench:
+                                            job = SweepJob(n, m, pmax, pmin, wbuf, ibuf, obuf, bw, batch_size, b)
+                                            if job not in seen:
+                                                seen.add(job)
+                                                jobs.append(job)
+    return jobs
+
+def get_job_lookup_dict(job):
+    """
+    Returns the results columns that identify a job
+    """
+    lookup_dict = {}
+    lookup_dict['N'] = job.N
+    lookup_dict['M'] = job.M
+    lookup_dict['Max Precision (bits)'] = job.pmax
+    lookup_dict['Min Precision (bits)'] = job.pmin
+    lookup_dict['Network'] = job.bench
+    lookup_dict['Bandwidth (bits/cycle)'] = job.bw
+    lookup_dict['WBUF Size (bits)'] = job.wbuf
+    lookup_dict['OBUF Size (bits)'] = job.obuf
+    lookup_dict['IBUF Size (bits)'] = job.ibuf
+    lookup_dict['Batch size'] = job.batch_size
+    return lookup_dict
+
+def get_job_shard(job, num_shards):
+    """
+    Assigns a job to one of num_shards shards. Depends only on the job, so
+    machines sweeping overlapping grids agree on the assignment.
+    """
+    digest = hashlib.md5(repr(tuple(job)).encode('utf-8')).hexdigest()
+    return int(digest, 16) % num_shards
+
+def get_job_simulator(sim_obj, job):
+    """
+    Returns a copy of sim_obj with the accelerator of job. sim_obj is left
+    unchanged; the copy shares its layer cache and hardware costs, which are
+    keyed by the accelerator configuration.
+    """
+    sram = dict(sim_obj.accelerator.sram)
+    sram['wgt'] = job.wbuf
+    sram['out'] = job.obuf
+    sram['act'] = job.ibuf
+    job_sim = copy.copy(sim_obj)
+    job_sim.accelerator = Accelerator(job.N, job.M, job.pmax, job.pmin, sram, job.bw,
+                                      sim_obj.accelerator.frequency)
+    return job_sim
+
+def run_job(sim_obj, job):
+    """
+    Simulates one job on a copy of sim_obj (see get_job_simulator) and
+    returns the rows for the results store
+    """
+    sim_obj = get_job_simulator(sim_obj, job)
+
+    logger.info('Simulating Benchmark: {}'.format(job.bench))
+    logger.info('N x M = {} x {}'.format(job.N, job.M))
+    logger.info('Max Precision (bits): {}'.format(job.pmax))
+    logger.info('Min Precision (bits): {}'.format(job.pmin))
+    logger.info('Batch size: {}'.format(job.batch_size))
+    logger.info('Bandwidth (bits/cycle): {}'.format(job.bw))
+
+    nn = benchmarks.get_bench_nn(job.bench, WRPN=True)
+    stats = benchmarks.get_bench_numbers(nn, sim_obj, job.batch_size)
+    data_line = []
+    for layer in stats:
+        cycles = stats[layer].total_cycles
+        reads = stats[layer].reads
+        writes = stats[layer].writes
+        stalls = stats[layer].mem_stall_cycles
+        data_line.append((job.N, job.M, job.pmax, job.pmin, job.bench, layer,
+            cycles, stalls,
+            reads['wgt'], writes['wgt'],
+            reads['out'], writes['out'],
+            reads['act'], writes['act'],
+            reads['dram'], writes['dram'],
+            job.bw,
+            job.wbuf, job.obuf, job.ibuf, job.batch_size))
+    return data_line
+
+# Simulator objects of a worker process, one per (config file, energy costs)
+_worker_sims = {}
+
+def _run_job_in_worker(args):
+    config_file, energy_costs, job = args
+    key = (config_file, energy_costs)
+    if key not in _worker_sims:
+        _worker_sims[key] = Simulator(config_file, False, energy_costs=energy_costs)
+    return run_job(_worker_sims[key], job)
+
+def run_jobs(sim_obj, jobs, processes=1):
+    """
+    Runs jobs and yields (job, rows) in the order of jobs
+    Args:
+        sim_obj: Simulator, left unchanged. With processes=1 the jobs run
+                 on copies of sim_obj, otherwise each worker builds its own
+                 Simulator from sim_obj.config_file and sim_obj.energy_costs
+        processes: number of worker processes (None for cpu_count())
+    """
+    if processes is None:
+        processes = cpu_count()
+    processes = min(processes, len(jobs))
+
+    if processes <= 1:
+        for job in jobs:
+            yield job, run_job(sim_obj, job)
+        return
+
+    pool = Pool(processes)
+    try:
+        args = [(sim_obj.config_file, sim_obj.energy_costs, job) for job in jobs]
+        # imap returns results in submission order, which keeps the merged
+        # output independent of scheduling
+        for i, rows in enumerate(pool.imap(_run_job_in_worker, args, chunksize=1)):
+            yield jobs[i], rows
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
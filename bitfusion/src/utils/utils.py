@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 def floor_a_by_b(a, b):
     return int(float(a) / b)
@@ -7,13 +8,69 @@ def ceil_a_by_b(a, b):
     return int(math.ceil(float(a) / b))
 
 
+def ceil_a_by_b_array(a, b):
+    if np.any(np.equal(b, 0)):
+        raise ZeroDivisionError('float division by zero')
+    return np.ceil(np.true_divide(a, b)).astype(np.int64)
+
 def log2(a):
     return math.log(a) / math.log(2)
 
+class PandasLookupIndex(object):
+    '''
+    Index for repeated key-value lookups into a pandas dataframe.
+
+    Maps tuples of column values to row positions, with one map per set of
+    lookup columns, built on first use. Rows added with append() are indexed
+    incrementally instead of rebuilding the maps.
+    '''
+    def __init__(self, data):
+        self.data = data
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def _add_rows(self, columns, index_map, start):
+        values = zip(*[self.data[c].values[start:] for c in columns])
+        for pos, key in enumerate(values, start):
+            # NaN never compares equal in pandas, so it is never a match
+            if any(v != v for v in key):
+                continue
+            index_map.setdefault(key, []).append(pos)
+
+    def _get_map(self, columns):
+        if columns not in self._maps:
+            index_map = {}
+            self._add_rows(columns, index_map, 0)
+            self._maps[columns] = index_map
+        return self._maps[columns]
+
+    def append(self, rows):
+        '''
+        Appends the rows of a dataframe and adds them to the existing maps
+        '''
+        start = len(self.data)
+        self.data = self.data.append(rows, ignore_index=True)
+        for columns, index_map in self._maps.items():
+            self._add_rows(columns, index_map, start)
+        return self.data
+
+    def lookup(self, lookup_dict):
+        columns = tuple(sorted(lookup_dict.keys()))
+        if len(columns) == 0:
+            return self.data.drop_duplicates()
+        key = tuple(lookup_dict[c] for c in columns)
+        positions = self._get_map(columns).get(key, [])
+        return self.data.iloc[positions].drop_duplicates()
+
 def lookup_pandas_dataframe(data, lookup_dict):
     '''
     Lookup a pandas dataframe using a key-value dict
+    data can also be a PandasLookupIndex
     '''
+    if isinstance(data, PandasLookupIndex):
+        return data.lookup(lookup_dict)
     data = data.drop_duplicates()
     for key in lookup_dict:
         data = data.loc[data[key] == lookup_dict[key]]
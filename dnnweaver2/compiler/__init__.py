@@ -15,6 +15,8 @@ import math
 import logging
 
 from dnnweaver2.compiler.pu_compiler import PUCompiler
+from dnnweaver2.compiler.compile_cache import CompileCache, CompiledBlock, get_block_key
+from dnnweaver2.fpga.fpgamanager import DDRSlot
 
 InstructionBlock = namedtuple('InstructionBlock', ['Op_name', 'Instructions'])
 
@@ -39,9 +41,16 @@ class FPGAMemoryManager(object):
     def alloc(self, tensor):
         assert isinstance(tensor, Tensor)
         if tensor.fpga_addr is None:
-            tensor.fpga_addr = self.curr_ddr_ptr
-            self.log.debug('Assigned address {}:{} to tensor {}'.format(self.curr_ddr_ptr, self.curr_ddr_ptr+tensor.fpga_size_in_bytes, tensor))
-            self.curr_ddr_ptr += 4*int(math.ceil(tensor.fpga_size_in_bytes / 1024.) * 1024) + 1024 * np.random.randint(1, 16)
+            tensor.fpga_addr = self.alloc_bytes(tensor.fpga_size_in_bytes)
+            self.log.debug('Assigned address {}:{} to tensor {}'.format(tensor.fpga_addr, tensor.fpga_addr+tensor.fpga_size_in_bytes, tensor))
+
+    def alloc_bytes(self, size_in_bytes):
+        """
+        Returns the address of a new DDR region of size_in_bytes
+        """
+        addr = self.curr_ddr_ptr
+        self.curr_ddr_ptr += 4*int(math.ceil(size_in_bytes / 1024.) * 1024) + 1024 * np.random.randint(1, 16)
+        return addr
 
 class MacroNode(object):
     def __init__(self, op):
@@ -56,7 +65,13 @@ class MacroNode(object):
 
 class GraphCompiler(object):
 
-    def __init__(self, fpga_spec=None, log_level=logging.INFO):
+    def __init__(self, fpga_spec=None, log_level=logging.INFO, compile_cache=None):
+        """
+        Args:
+            compile_cache: CompileCache of the compiled macro nodes, e.g.
+                           shared by compilers or backed by a file; an
+                           in-memory one is created when None
+        """
         self.log = logging.getLogger('Graph Compiler')
         self.log.setLevel(log_level)
         self.fpga_spec = fpga_spec
@@ -68,6 +83,16 @@ class GraphCompiler(object):
             self.fpga_manager = FPGAMemoryManager(self.fpga_spec, log_level=log_level)
         self.pu_compiler = PUCompiler(self.fpga_manager, log_level=self.log.level)
         self.conv_tiling = OrderedDict()
+        self.conv_cycles = OrderedDict()
+        # Compiled program of the last graph, see get_ddr_slots
+        self.instructions = None
+        self.relocations = []
+        self.relocation_addresses = {}
+        self.input_tensor = None
+        self.output_tensor = None
+        if compile_cache is None:
+            compile_cache = CompileCache()
+        self.compile_cache = compile_cache
 
     def optimize_tiling(self, op, graph, acc_obj, pool_kernel=None, pool_stride=None):
         K = op.weights.fpga_shape[-2]
@@ -86,6 +111,8 @@ class GraphCompiler(object):
         tiling, order, _, _ = optimize_for_order(conv_params, sequential=False, pool_kernel=pool_kernel, pool_stride=pool_stride)
 
         conv_params_with_pool = (acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride)
+        # Predicted cycles of the layer, to calibrate waiting for the fpga
+        self.conv_cycles[op] = get_stats_fast(conv_params_with_pool, tiling, order).total_cycles
 
         # Convert tiling and order to an ordered dict
         best_tiling = OrderedDict()
@@ -97,6 +124,14 @@ class GraphCompiler(object):
         best_tiling['KW/kw'] = (1, K)
         return best_tiling
 
+    def get_predicted_cycles(self):
+        """
+        Returns the cycles of the convolutions of the compiled graph, as
+        predicted by the optimizer for their tiling, e.g. for
+        FPGAManager.set_predicted_cycles
+        """
+        return sum(self.conv_cycles.values())
+
     def _alloc_tensor(self, graph):
         for tname, t in graph.tensor_registry.items():
             if isinstance(t, Tensor):
@@ -106,9 +141,11 @@ class GraphCompiler(object):
         """
         Compiler for convolution layers
         TODO: replace hard-coded array sizes
+        Returns:
+            InstructionBuffer with the instructions of the layer
         """
-        inst_array = []
-        inst_array.append(SetupInstruction(16, 16).get_binary())
+        inst = InstructionBuffer()
+        inst.setup(16, 16)
 
         self.log.debug('Convolution op: {}'.format(conv_op.name))
 
@@ -125,15 +162,15 @@ class GraphCompiler(object):
         pool_pad_h = pool_pad_h_t + pool_pad_h_b
         pool_pad_w = pool_pad_w_l + pool_pad_w_r
 
-        inst_array.append(BaseAddressInstruction(ScratchPad.IBUF, 0, conv_op.data.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.WBUF, 0, conv_op.weights.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.BIAS, 0, conv_op.bias.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.OBUF, 0, conv_op.output_tensors.fpga_addr).get_binary())
+        inst.base_address(ScratchPad.IBUF, 0, conv_op.data.fpga_addr, 'data')
+        inst.base_address(ScratchPad.WBUF, 0, conv_op.weights.fpga_addr, 'weights')
+        inst.base_address(ScratchPad.BIAS, 0, conv_op.bias.fpga_addr, 'bias')
+        inst.base_address(ScratchPad.OBUF, 0, conv_op.output_tensors.fpga_addr, 'output')
 
-        inst_array.append(BaseAddressInstruction(ScratchPad.IBUF, 1, conv_op.data.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.WBUF, 1, conv_op.weights.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.BIAS, 1, conv_op.bias.fpga_addr).get_binary())
-        inst_array.append(BaseAddressInstruction(ScratchPad.OBUF, 1, conv_op.output_tensors.fpga_addr).get_binary())
+        inst.base_address(ScratchPad.IBUF, 1, conv_op.data.fpga_addr, 'data')
+        inst.base_address(ScratchPad.WBUF, 1, conv_op.weights.fpga_addr, 'weights')
+        inst.base_address(ScratchPad.BIAS, 1, conv_op.bias.fpga_addr, 'bias')
+        inst.base_address(ScratchPad.OBUF, 1, conv_op.output_tensors.fpga_addr, 'output')
 
         # Parallelize loops IC/ic and OC/oc
         tiling['IC/ic'] = (tiling['IC/ic'][0], int(math.ceil(tiling['IC/ic'][1]/float(array_n))))
@@ -238,29 +275,32 @@ class GraphCompiler(object):
         num_outer_loops = 0
         for l, it in tiling.items():
             if it[0] > 1:
-                inst_array.append(LoopInstruction(16, 16, it[0]-1).get_binary())
+                inst.loop(16, 16, it[0]-1)
+                # Strides of the loop, encoded together
+                bufs, ld_st, strides = [], [], []
                 for buf, s in outer_loop_strides[l].items():
                     dim, dim_stride = s
                     tensor = tensor_mapping[buf]
                     shape = tensor_tile_shape[buf]
                     stride = (np.prod(shape[dim+1:]) * dim_stride * tensor.dtype.bits) / 8
-                    if stride >= (1<<16):
-                        inst_array.append(GenAddrHighInstruction(buf, AccessType.LD, 16, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, 16, stride).get_binary())
+                    bufs.append(buf)
+                    ld_st.append(AccessType.LD)
+                    strides.append(stride)
                     if tensor.op == conv_op:
-                        if stride >= (1<<16):
-                            inst_array.append(GenAddrHighInstruction(buf, AccessType.ST, 16, stride).get_binary())
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, 16, stride).get_binary())
+                        bufs.append(buf)
+                        ld_st.append(AccessType.ST)
+                        strides.append(stride)
+                inst.gen_addr(bufs, ld_st, 16, strides)
 
                 num_outer_loops += 1
 
         if num_outer_loops == 0:
-            inst_array.append(LoopInstruction(16, 16, 0).get_binary())
+            inst.loop(16, 16, 0)
             for buf, s in outer_loop_strides[l].items():
                 tensor = tensor_mapping[buf]
-                inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, 16, 0).get_binary())
+                inst.gen_addr(buf, AccessType.LD, 16, 0)
                 if tensor.op == conv_op:
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, 16, 0).get_binary())
+                    inst.gen_addr(buf, AccessType.ST, 16, 0)
 
         ih = (oh - 1) * conv_op.stride[-2] + kh
         iw = (ow - 1) * conv_op.stride[-1] + kw
@@ -279,28 +319,25 @@ class GraphCompiler(object):
         for buf, tile_shape in padded_tile_shape_mapping.items():
             num_loops = 0
             tensor = tensor_mapping[buf]
-            inst_array.append(LDMemInstruction(buf, tensor.dtype.bits//8, buf+1, 1).get_binary())
+            inst.ld_mem(buf, tensor.dtype.bits//8, buf+1, 1)
             if buf == 1:
-                inst_array.append(STMemInstruction(buf, tensor.dtype.bits//8, buf+1, 1).get_binary())
+                inst.st_mem(buf, tensor.dtype.bits//8, buf+1, 1)
             shape = tensor_tile_shape[buf]
             for dim in reversed(range(len(tile_shape))):
                 s = tile_shape[dim]
                 if s > 1:
                     stride = (np.prod(shape[dim+1:]) * 1 * tensor.dtype.bits) / 8
-                    inst_array.append(LoopInstruction(buf+1, buf+1, s-1).get_binary())
-                    if stride >= (1<<16):
-                        inst_array.append(GenAddrHighInstruction(buf, AccessType.LD, buf+1, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, buf+1, stride).get_binary())
+                    inst.loop(buf+1, buf+1, s-1)
                     if buf == 1:
-                        if stride >= (1<<16):
-                            inst_array.append(GenAddrHighInstruction(buf, AccessType.ST, buf+1, stride).get_binary())
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, buf+1, stride).get_binary())
+                        inst.gen_addr(buf, (AccessType.LD, AccessType.ST), buf+1, (stride, stride))
+                    else:
+                        inst.gen_addr(buf, AccessType.LD, buf+1, stride)
                     num_loops += 1
             if num_loops == 0:
-                inst_array.append(LoopInstruction(buf+1, buf+1, 0).get_binary())
-                inst_array.append(GenAddrLowInstruction(buf, AccessType.LD, buf+1, 0).get_binary())
+                inst.loop(buf+1, buf+1, 0)
+                inst.gen_addr(buf, AccessType.LD, buf+1, 0)
                 if buf == 1:
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.ST, buf+1, 0).get_binary())
+                    inst.gen_addr(buf, AccessType.ST, buf+1, 0)
 
         inner_loop_strides = {
             'IC/ic': {
@@ -355,7 +392,9 @@ class GraphCompiler(object):
             it = inner_loop_tiling[l]
 
             if it > 1:
-                inst_array.append(LoopInstruction(0, 0, it-1).get_binary())
+                inst.loop(0, 0, it-1)
+                # Strides of the loop, encoded together
+                bufs, rd_wr, strides = [], [], []
                 for buf, s in inner_loop_strides[l].items():
                     dim, dim_stride = s
                     tensor = tensor_mapping[buf]
@@ -363,39 +402,105 @@ class GraphCompiler(object):
                     stride = np.prod(tile_shape[dim+1:]) * dim_stride
                     if stride >= (1<<16):
                         raise ValueError('stride for inner loop is too high: {}'.format(stride))
-                        # inst_array.append(GenAddrHighInstruction(buf, AccessType.RD, 0, stride).get_binary())
-                    inst_array.append(GenAddrLowInstruction(buf, AccessType.RD, 0, stride).get_binary())
+                    bufs.append(buf)
+                    rd_wr.append(AccessType.RD)
+                    strides.append(stride)
                     if tensor.op == conv_op:
-                        inst_array.append(GenAddrLowInstruction(buf, AccessType.WR, 0, stride).get_binary())
-                        if stride >= (1<<16):
-                            raise ValueError('stride for inner loop is too high: {}'.format(stride))
-                            # inst_array.append(GenAddrHighInstruction(buf, AccessType.WR, 0, stride).get_binary())
+                        bufs.append(buf)
+                        rd_wr.append(AccessType.WR)
+                        strides.append(stride)
+                inst.gen_addr(bufs, rd_wr, 0, strides)
                 num_inner_loops += 1
 
         if num_inner_loops == 0:
-            inst_array.append(LoopInstruction(0, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.IBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.WBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.OBUF, AccessType.WR, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.OBUF, AccessType.RD, 0, 0).get_binary())
-            inst_array.append(GenAddrLowInstruction(ScratchPad.BIAS, AccessType.RD, 0, 0).get_binary())
+            inst.loop(0, 0, 0)
+            inst.gen_addr((ScratchPad.IBUF, ScratchPad.WBUF, ScratchPad.OBUF, ScratchPad.OBUF, ScratchPad.BIAS),
+                          (AccessType.RD, AccessType.RD, AccessType.WR, AccessType.RD, AccessType.RD), 0, (0, 0, 0, 0, 0))
 
         # PU operations now
         pu_inst = self.pu_compiler.compile_layer(tiling, conv_op.output_tensors, pu_op, simd_lanes=array_m)
-        for i in pu_inst:
-            inst_array.append(i)
-        inst_array.append(BlockEndInstruction(last).get_binary())
+        inst.add_instructions(pu_inst)
+        inst.block_end(last)
 
-        return inst_array
+        return inst
+
+    def _get_block_tensors(self, macro_node):
+        """
+        Returns the tensor of each relocation symbol of the instructions of
+        macro_node
+        """
+        conv_op = macro_node.sys_array_op
+        tensors = {
+            'data': conv_op.data,
+            'weights': conv_op.weights,
+            'bias': conv_op.bias,
+            'output': conv_op.output_tensors,
+            'pu_output': conv_op.output_tensors,
+        }
+        if len(macro_node.pu_op) > 0:
+            tensors['pu_output'] = macro_node.pu_op[-1].output_tensors
+        for op in macro_node.pu_op:
+            if isinstance(op, BatchNorm):
+                tensors['bn_mean'] = op.mean
+                tensors['bn_scale'] = op.scale
+        return tensors
+
+    def _get_block_addresses(self, macro_node):
+        """
+        Returns the address of each relocation symbol of the instructions of
+        macro_node
+        """
+        return dict((symbol, t.fpga_addr) for symbol, t in self._get_block_tensors(macro_node).items())
+
+    def _add_block_relocations(self, macro_node, relocations, position):
+        # Program relocations use tensor names as symbols, since the symbols
+        # of a block are only unique within it
+        tensors = self._get_block_tensors(macro_node)
+        for r in relocations:
+            t = tensors[r.symbol]
+            self.relocations.append(Relocation(position + r.position, r.scratchpad_ID, r.index, t.name, r.offset))
+            self.relocation_addresses[t.name] = t.fpga_addr
+
+    def get_ddr_slots(self, num_slots=2):
+        """
+        Returns num_slots DDRSlot of the graph compiled last, for
+        FPGAManager.infer_stream. Slot 0 uses the addresses of the compiled
+        instructions. Every other slot gets new DDR regions for the input and
+        output tensors, and a copy of the instructions relocated to them.
+        Intermediate tensors are shared, since one slot runs at a time.
+        """
+        assert self.instructions is not None, 'No graph compiled'
+        slots = [DDRSlot(self.input_tensor.fpga_addr, self.output_tensor.fpga_addr, self.instructions)]
+        for i in range(1, num_slots):
+            input_addr = self.fpga_manager.alloc_bytes(self.input_tensor.fpga_size_in_bytes)
+            output_addr = self.fpga_manager.alloc_bytes(self.output_tensor.fpga_size_in_bytes)
+            addresses = dict(self.relocation_addresses)
+            addresses[self.input_tensor.name] = input_addr
+            addresses[self.output_tensor.name] = output_addr
+            slots.append(DDRSlot(input_addr, output_addr,
+                                 relocate(self.instructions, self.relocations, addresses)))
+        return slots
 
     def compile_macro_node(self, graph, acc_obj):
         pass
 
-    def compile(self, graph, acc_obj):
+    def compile(self, graph, acc_obj, inst_file='inst.bin'):
+        """
+        Compiles graph for acc_obj, and returns the instructions as an int32
+        array. They are also written to inst_file (unless None) as
+        little-endian int32, see read_instructions.
+        """
 
         array_n, array_m = acc_obj.N, acc_obj.M
         assert isinstance(graph, Graph)
-        inst_binary = []
+        inst_blocks = []
+
+        # Only keep the tiling, predicted cycles and relocations of this graph
+        self.conv_tiling = OrderedDict()
+        self.conv_cycles = OrderedDict()
+        self.relocations = []
+        self.relocation_addresses = {}
+        position = 0
 
         self.log.debug('#'*50)
         self.log.debug('Combining graph ops to create macro op')
@@ -459,6 +564,23 @@ class GraphCompiler(object):
             for op in macro_node.pu_op:
                 self.log.debug('\t\t{}'.format(op.name))
 
+            conv_op = macro_node.sys_array_op
+            last = i == len(macro_node_array) - 1
+            block_key = get_block_key(macro_node, acc_obj, last)
+            cached = self.compile_cache.get(block_key)
+            if cached is not None:
+                self.log.debug('Reusing the compiled block of an identical macro op')
+                self.conv_tiling[conv_op] = cached.tiling
+                self.conv_cycles[conv_op] = cached.cycles
+                self.log.debug('Allocating tensors for macro op: {}'.format(macro_node.name))
+                self._alloc_tensor(graph)
+                inst_array = relocate(cached.instructions, cached.relocations, self._get_block_addresses(macro_node))
+                inst_blocks.append(InstructionBlock(macro_node, inst_array))
+                self._add_block_relocations(macro_node, cached.relocations, position)
+                position += len(inst_array)
+                self.log.debug('#'*50)
+                continue
+
             self.log.debug('Optimizing tiling for Convolution layer {}'.format(macro_node.sys_array_op.name))
             pool_stride = None
             pool_kernel = None
@@ -475,25 +597,30 @@ class GraphCompiler(object):
                 self.log.debug('{}Loop: {:>6}, Tile: {}'.format(indent * '==', loop, tile))
                 indent += 1
 
-            last = i == len(macro_node_array) - 1
             self.log.debug('Allocating tensors for macro op: {}'.format(macro_node.name))
             self._alloc_tensor(graph)
-            inst_array = self._conv_compile(conv_op=macro_node.sys_array_op, pu_op=macro_node.pu_op, tiling=optimal_tiling, array_n=array_n, array_m=array_m, last=last)
-            inst_binary.append(InstructionBlock(macro_node, inst_array))
+            inst = self._conv_compile(conv_op=macro_node.sys_array_op, pu_op=macro_node.pu_op, tiling=optimal_tiling, array_n=array_n, array_m=array_m, last=last)
+            inst_blocks.append(InstructionBlock(macro_node, inst.get_array()))
+            self.compile_cache.put(block_key, CompiledBlock(optimal_tiling, self.conv_cycles[conv_op],
+                                                            inst.get_array(), inst.relocations))
+            self._add_block_relocations(macro_node, inst.relocations, position)
+            position += inst.size
             self.log.debug('#'*50)
 
         self.log.debug('Compiling macro ops - done!')
 
-        inst_array = []
-        for i in inst_binary:
-            inst = i.Instructions
-            op_name = i.Op_name
-            for _i in inst:
-                inst_array.append(_i)
-            # inst_array += inst
-
-        with open('inst.bin', 'w') as f:
-            for inst in inst_array:
-                f.write('{}'.format(inst))
-                f.write('\n')
-        return np.array(inst_array, dtype=np.int32)
+        inst = InstructionBuffer(sum(len(i.Instructions) for i in inst_blocks))
+        for i in inst_blocks:
+            inst.extend(i.Instructions)
+
+        if inst_file is not None:
+            inst.tofile(inst_file)
+
+        self.instructions = inst.get_array()
+        self.input_tensor = macro_node_array[0].sys_array_op.data
+        last_node = macro_node_array[-1]
+        if len(last_node.pu_op) > 0:
+            self.output_tensor = last_node.pu_op[-1].output_tensors
+        else:
+            self.output_tensor = last_node.sys_array_op.output_tensors
+        return self.instructions
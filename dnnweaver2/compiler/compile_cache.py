@@ -0,0 +1,152 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from dnnweaver2.tensorOps.cnn import LeakyReLU
+
+# Bump when the compiler or the optimizer changes, so that stale on-disk
+# entries are not returned
+CACHE_VERSION = 1
+
+# A compiled macro node, independent of where its tensors are allocated
+#   tiling: tiling of the convolution, as left in GraphCompiler.conv_tiling
+#   cycles: predicted cycles of the convolution
+#   instructions: int32 binaries of the block
+#   relocations: list of Relocation of the base addresses in instructions
+CompiledBlock = namedtuple('CompiledBlock', ['tiling', 'cycles', 'instructions', 'relocations'])
+
+def _freeze(x):
+    # Nested lists and numpy scalars to hashable tuples and Python scalars
+    if isinstance(x, (list, tuple)):
+        return tuple(_freeze(i) for i in x)
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+def _get_tensor_key(t):
+    return (_freeze(t.shape), _freeze(t.fpga_pad), t.dtype.op_str,
+            t.dtype.bits, getattr(t.dtype, 'frac_bits', None))
+
+def _get_op_key(op):
+    key = [type(op).__name__,
+           tuple(_get_tensor_key(t) for t in op.input_tensors),
+           _get_tensor_key(op.output_tensors)]
+    for attr in ('stride', 'pad', 'pooling_kernel'):
+        if hasattr(op, attr):
+            key.append((attr, _freeze(getattr(op, attr))))
+    if isinstance(op, LeakyReLU):
+        key.append(tuple(np.asarray(op.scalar.data, dtype=np.float64).ravel().tolist()))
+    return tuple(key)
+
+def get_block_key(macro_node, acc_obj, last):
+    """
+    Returns a canonical key for the instructions of a macro node: the shapes,
+    paddings (fpga_pad) and dtypes of the tensors of its ops, the conv and
+    pool parameters, the accelerator configuration that the tiling depends
+    on (including the array size), and whether it is the last block
+    """
+    return (CACHE_VERSION,
+            acc_obj.N, acc_obj.M, acc_obj.prec,
+            tuple(sorted(acc_obj.sram.items())), acc_obj.mem_if_width,
+            bool(last),
+            _get_op_key(macro_node.sys_array_op),
+            tuple(_get_op_key(op) for op in macro_node.pu_op))
+
+class CompileCache(object):
+    """
+    Two-level cache of CompiledBlock: an in-memory LRU and an optional
+    SQLite file shared across runs, e.g. across redeployments of a model
+    """
+
+    def __init__(self, max_entries=1024, filename=None):
+        self.max_entries = max_entries
+        self.filename = filename
+        self._lru = OrderedDict()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.logger = logging.getLogger('{}.{}'.format(__name__, 'CompileCache'))
+
+    def _get_db(self):
+        if self._db is None and self.filename is not None:
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._db = sqlite3.connect(self.filename)
+            self._db.execute('CREATE TABLE IF NOT EXISTS compile_cache (key TEXT PRIMARY KEY, value BLOB)')
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _insert_lru(self, key, value):
+        self._lru.pop(key, None)
+        self._lru[key] = value
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns a copy of the cached CompiledBlock for key, or None on a miss
+        """
+        if key in self._lru:
+            value = self._lru.pop(key)
+            self._lru[key] = value
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        db = self._get_db()
+        if db is not None:
+            row = db.execute('SELECT value FROM compile_cache WHERE key = ?', (self._digest(key),)).fetchone()
+            if row is not None:
+                value = pickle.loads(bytes(row[0]))
+                self._insert_lru(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return copy.deepcopy(value)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        value = copy.deepcopy(value)
+        self._insert_lru(key, value)
+        db = self._get_db()
+        if db is not None:
+            blob = sqlite3.Binary(pickle.dumps(value, protocol=2))
+            db.execute('INSERT OR REPLACE INTO compile_cache (key, value) VALUES (?, ?)', (self._digest(key), blob))
+            db.commit()
+
+    def clear(self):
+        self._lru.clear()
+        db = self._get_db()
+        if db is not None:
+            db.execute('DELETE FROM compile_cache')
+            db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self):
+        return len(self._lru)
+
+    def __str__(self):
+        ret = 'Compile cache: {} hits ({} from disk), {} misses, {} entries in memory'.format(
+                self.hits, self.disk_hits, self.misses, len(self._lru))
+        if self.filename is not None:
+            ret += ', file: {}'.format(self.filename)
+        return ret
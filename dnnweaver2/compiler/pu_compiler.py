@@ -33,6 +33,8 @@ class PUCompiler(object):
     def compile_layer(self, conv_tiling, conv_out_tensor, pu_ops, simd_lanes=4):
         """
         Compiler for PU layers
+        Returns:
+            list of instructions, see InstructionBuffer.add_instructions
         """
 
         pool_pad = ((0,0), (0,0), (0,0), (0,0))
@@ -142,15 +144,15 @@ class PUCompiler(object):
 
         pu_inst_list.append(BaseAddressInstruction(0,0,0))
 
-        pu_inst_list.append(BaseAddressInstruction(1,0,t_out_addr))
-        pu_inst_list.append(BaseAddressInstruction(1,1,t_out_addr))
+        pu_inst_list.append(BaseAddressInstruction(1,0,t_out_addr,'pu_output',pad_offset))
+        pu_inst_list.append(BaseAddressInstruction(1,1,t_out_addr,'pu_output',pad_offset))
 
         if ld0_required:
-            pu_inst_list.append(BaseAddressInstruction(2,0,bn_mean_addr))
-            pu_inst_list.append(BaseAddressInstruction(2,1,bn_mean_addr))
+            pu_inst_list.append(BaseAddressInstruction(2,0,bn_mean_addr,'bn_mean'))
+            pu_inst_list.append(BaseAddressInstruction(2,1,bn_mean_addr,'bn_mean'))
         if ld1_required:
-            pu_inst_list.append(BaseAddressInstruction(3,0,bn_scale_addr))
-            pu_inst_list.append(BaseAddressInstruction(3,1,bn_scale_addr))
+            pu_inst_list.append(BaseAddressInstruction(3,0,bn_scale_addr,'bn_scale'))
+            pu_inst_list.append(BaseAddressInstruction(3,1,bn_scale_addr,'bn_scale'))
 
         pu_inst_list.append(LoopInstruction(0, 0, pool_kw-1))
         pu_inst_list.append(GenAddrLowInstruction(0, 0, 0, oc))
@@ -381,11 +383,8 @@ class PUCompiler(object):
         for i in self.rf:
             assert i == 0
 
-        inst_array = []
         if len(pu_inst_list) > 1:
             pu_inst_list[0] = PUBlockStart(len(pu_inst_list)-2)
-            for i in pu_inst_list:
-                inst_array.append(i.get_binary())
-            return inst_array
+            return pu_inst_list
         else:
             return None
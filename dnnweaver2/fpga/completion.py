@@ -0,0 +1,205 @@
+import os
+import select
+import logging
+import numpy as np
+from collections import namedtuple, OrderedDict
+from time import time, sleep
+
+# Ways FPGAManager waits for an execution to finish
+#   event: block on the user interrupt of the XDMA events device
+#   poll: poll the state register with exponential backoff
+wait_modes = ['event', 'poll']
+
+# Timing of one execution, in seconds
+#   queue_wait: from the input being ready on the host to the start
+#   execution: from the start to the completion being seen, including the
+#              notification latency
+#   predicted: execution time predicted from the compiler's tiling, or None
+#   state_reads: reads of the state register while waiting
+#   mode: one of wait_modes
+ExecutionTiming = namedtuple('ExecutionTiming', ['queue_wait', 'execution', 'predicted', 'state_reads', 'mode'])
+
+# Waits shorter than this are spun instead of slept, since sleep overshoots
+# by tens of microseconds
+spin_threshold = 1e-4
+
+def _pause(seconds):
+    if seconds <= 0:
+        return
+    if seconds >= spin_threshold:
+        sleep(seconds)
+        return
+    end = time() + seconds
+    while time() < end:
+        # Let the other threads of infer_stream run
+        sleep(0)
+
+class _Deadline(object):
+    def __init__(self, timeout):
+        self.end = None if timeout is None else time() + timeout
+
+    def remaining(self):
+        if self.end is None:
+            return None
+        return max(0., self.end - time())
+
+    def expired(self):
+        return self.end is not None and time() >= self.end
+
+def _timeout_error(timeout):
+    return IOError('fpga execution did not finish within {} s'.format(timeout))
+
+class BackoffPoller(object):
+    """
+    Polls the fpga state with exponential backoff. With a predicted
+    execution time, it sleeps through most of it, and caps the polling
+    interval to a fraction of it, so that short layers are not stuck behind
+    a long sleep. The prediction is scaled by the measured over the predicted
+    time of the previous executions.
+    """
+    mode = 'poll'
+
+    def __init__(self, min_interval=2e-6, max_interval=1e-3, factor=2.,
+            early=0.9, overshoot=0.125, smoothing=0.25):
+        """
+        Args:
+            min_interval: first polling interval
+            max_interval: largest polling interval
+            early: fraction of the expected time slept before polling
+            overshoot: largest polling interval, as a fraction of the
+                       expected time
+            smoothing: weight of the last execution in the scale
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.early = early
+        self.overshoot = overshoot
+        self.smoothing = smoothing
+        self.scale = 1.
+
+    def get_expected(self, predicted):
+        if predicted is None:
+            return None
+        return predicted * self.scale
+
+    def calibrate(self, execution, predicted, state_reads):
+        """
+        Updates the scale of the predictions with a measured execution time.
+        If the first read after the early sleep already saw the fpga done,
+        the execution time is only an upper bound, so the scale shrinks
+        instead.
+        """
+        if predicted is None or predicted <= 0:
+            return
+        if state_reads > 1:
+            self.scale += self.smoothing * (execution / predicted - self.scale)
+        else:
+            self.scale -= self.smoothing * self.scale
+
+    def wait(self, is_done, start, predicted=None, timeout=None):
+        """
+        Returns once is_done() is True, and the number of calls to it.
+        Raises IOError after timeout seconds.
+        Args:
+            start: time() of the start of the execution
+            predicted: predicted execution time in seconds, or None
+        """
+        deadline = _Deadline(timeout)
+        interval = self.min_interval
+        max_interval = self.max_interval
+        expected = self.get_expected(predicted)
+        if expected is not None:
+            max_interval = min(max_interval, max(self.min_interval, expected * self.overshoot))
+            early_wait = start + expected * self.early - time()
+            if timeout is not None:
+                early_wait = min(early_wait, deadline.remaining())
+            _pause(early_wait)
+
+        reads = 1
+        while not is_done():
+            if deadline.expired():
+                raise _timeout_error(timeout)
+            _pause(interval)
+            interval = min(interval * self.factor, max_interval)
+            reads += 1
+        return reads
+
+class EventWaiter(object):
+    """
+    Waits for the user interrupt the fpga raises at the end of an
+    execution, on an XDMA events device (e.g. /dev/xdma0_events_0). The
+    device is readable once the interrupt fired, and reading it returns the
+    number of interrupts (4 Bytes) and clears them.
+    """
+    mode = 'event'
+
+    def __init__(self, events_device, log_level=logging.INFO):
+        self.log = logging.getLogger('FPGA Events')
+        self.log.setLevel(log_level)
+        self.log.debug('Opening device: {}'.format(events_device))
+        self.fd = os.open(events_device, os.O_RDONLY)
+        if hasattr(select, 'epoll'):
+            self.epoll = select.epoll()
+            self.epoll.register(self.fd, select.EPOLLIN)
+        else:
+            self.epoll = None
+
+    def _wait_event(self, timeout):
+        if self.epoll is not None:
+            ready = len(self.epoll.poll(-1 if timeout is None else timeout)) > 0
+        else:
+            ready = len(select.select([self.fd], [], [], timeout)[0]) > 0
+        if ready:
+            os.read(self.fd, 4)
+        return ready
+
+    def clear(self):
+        """
+        Drops the interrupts that fired before, e.g. before a start
+        """
+        while self._wait_event(0):
+            pass
+
+    def calibrate(self, execution, predicted, state_reads):
+        pass
+
+    def wait(self, is_done, start, predicted=None, timeout=None):
+        """
+        Returns once is_done() is True, and the number of calls to it. The
+        state is read again after each interrupt, so a stale or shared
+        interrupt only costs one read. Raises IOError after timeout seconds.
+        """
+        deadline = _Deadline(timeout)
+        reads = 1
+        while not is_done():
+            if not self._wait_event(deadline.remaining()):
+                raise _timeout_error(timeout)
+            reads += 1
+        return reads
+
+    def close(self):
+        if self.epoll is not None:
+            self.epoll.close()
+        os.close(self.fd)
+
+def get_timing_summary(timings):
+    """
+    Returns the mean and p99 of the queue wait and execution times, and the
+    mean execution over the predicted time, of a list of ExecutionTiming
+    """
+    summary = OrderedDict()
+    summary['executions'] = len(timings)
+    if len(timings) == 0:
+        return summary
+    queue_wait = np.array([t.queue_wait for t in timings])
+    execution = np.array([t.execution for t in timings])
+    summary['mean queue wait'] = float(queue_wait.mean())
+    summary['p99 queue wait'] = float(np.percentile(queue_wait, 99))
+    summary['mean execution'] = float(execution.mean())
+    summary['p99 execution'] = float(np.percentile(execution, 99))
+    summary['mean state reads'] = float(np.mean([t.state_reads for t in timings]))
+    ratios = [t.execution / t.predicted for t in timings if t.predicted]
+    if len(ratios) > 0:
+        summary['execution / predicted'] = float(np.mean(ratios))
+    return summary
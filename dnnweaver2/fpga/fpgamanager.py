@@ -1,13 +1,20 @@
 import sys
 import logging
 import numpy as np
-import itertools
 import array
 import math
+import threading
+from collections import namedtuple, deque
 from time import time, sleep
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-from dnnweaver2.fpga.memspace import FPGAMemSpace
+from dnnweaver2.fpga.memspace import FPGAMemSpace, get_aligned_array
+from dnnweaver2.fpga.completion import ExecutionTiming, BackoffPoller, EventWaiter
 from dnnweaver2.tensorOps.cnn import Convolution, BatchNorm
+from dnnweaver2.isa import read_instructions
 
 
 def ddr_to_np_array(ddr, start, end, dtype):
@@ -17,61 +24,160 @@ def ceilAByB(a, b):
     return int(math.ceil(a / float(b)))
 
 def _pad_tensor(t, pad_value=0):
-    return np.pad(t.data, t.fpga_pad, 'constant', constant_values=(pad_value, pad_value))
+    return pad_to_ddr(t.data, t.fpga_pad, pad_value)
+
+def _get_unpad_slices(pad, shape):
+    return tuple(slice(p[0], p[0] + n) for p, n in zip(pad, shape))
+
+def pad_to_ddr(data, pad, pad_value=0):
+    """
+    Returns data padded with pad_value, as np.pad with mode 'constant'
+    """
+    padded_shape = tuple(n + p[0] + p[1] for n, p in zip(data.shape, pad))
+    ddr_arr = np.empty(padded_shape, dtype=data.dtype)
+    ddr_arr.fill(pad_value)
+    ddr_arr[_get_unpad_slices(pad, data.shape)] = data
+    return ddr_arr
+
+def unpad_from_ddr(ddr_arr, pad, shape):
+    """
+    Inverse of pad_to_ddr: returns the view of ddr_arr without the padding
+    """
+    return ddr_arr[_get_unpad_slices(pad, shape)]
+
+def _get_blocked_view(ddr_arr, padded_shape, array_m):
+    # The (oc / array_m, kh, kw, ic, array_m) DDR layout, with the block
+    # dimensions first: (oc / array_m, array_m, kh, kw, ic)
+    oc, kh, kw, ic = padded_shape
+    return ddr_arr.reshape(oc // array_m, kh, kw, ic, array_m).transpose(0, 4, 1, 2, 3)
+
+def _get_blocked_index(pad, shape, array_m):
+    oc = np.arange(pad[0][0], pad[0][0] + shape[0])
+    return (oc // array_m, oc % array_m) + _get_unpad_slices(pad[1:], shape[1:])
+
+def weights_to_ddr(data, pad, array_m):
+    """
+    Returns the (oc, kh, kw, ic) weights in data, padded with zeros, in the
+    DDR layout (oc / array_m, kh, kw, ic, array_m), with a single copy
+    """
+    padded_shape = tuple(n + p[0] + p[1] for n, p in zip(data.shape, pad))
+    assert padded_shape[0] % array_m == 0
+    ddr_arr = np.zeros(padded_shape, dtype=data.dtype)
+    _get_blocked_view(ddr_arr, padded_shape, array_m)[_get_blocked_index(pad, data.shape, array_m)] = data
+    oc, kh, kw, ic = padded_shape
+    return ddr_arr.reshape(oc // array_m, kh, kw, ic, array_m)
+
+def ddr_to_weights(ddr_arr, pad, shape, array_m):
+    """
+    Inverse of weights_to_ddr: returns the (oc, kh, kw, ic) weights of shape
+    shape from their DDR layout
+    """
+    padded_shape = tuple(n + p[0] + p[1] for n, p in zip(shape, pad))
+    return _get_blocked_view(ddr_arr, padded_shape, array_m)[_get_blocked_index(pad, shape, array_m)]
+
+def _get_flat_indices(idx_list, stride_list):
+    index = np.zeros(idx_list, dtype=np.int64)
+    for dim, (n, stride) in enumerate(zip(idx_list, stride_list)):
+        shape = [1] * len(idx_list)
+        shape[dim] = n
+        index += (np.arange(n, dtype=np.int64) * stride).reshape(shape)
+    return index
+
+def _get_strided_view(flat_arr, idx_list, stride_list):
+    """
+    Returns flat_arr viewed with shape idx_list and element strides
+    stride_list, or None if the view would go outside flat_arr
+    """
+    if any(n == 0 for n in idx_list):
+        return flat_arr[:0].reshape(idx_list)
+    if any(stride < 0 for stride in stride_list):
+        return
+    last = sum(stride * (n - 1) for n, stride in zip(idx_list, stride_list))
+    if last >= flat_arr.size:
+        return
+    return np.lib.stride_tricks.as_strided(flat_arr, shape=idx_list,
+            strides=[stride * flat_arr.itemsize for stride in stride_list])
 
 def data_transform(arr, idx_list, stride_list, verbose=False):
-#    t1 = time()
-    arr_size = arr.size
-    shape = arr.shape
-    arr = arr.flatten()
-#    t2 = time()
-    ddr_arr = np.empty(arr_size, dtype=arr.dtype)
-#    t3 = time()
-    stride_list = np.array(stride_list)
-#    t4 = time()
-    ddr_idx = 0
-#    dot_sum = 0.0
-#    rest_sum = 0.0
-    for indices in itertools.product(*[range(x) for x in idx_list]):
-#        t4_1 = time()
-        input_idx = np.dot(stride_list, indices)
-#        t4_2 = time()
-#        dot_sum += t4_2 - t4_1
-        if verbose:
-            print(stride_list, indices, input_idx, arr[input_idx])
-        ddr_arr[ddr_idx] = arr[input_idx]
-        ddr_idx += 1
-#        t4_3 = time()
-#        rest_sum = t4_3 - t4_2
-#    t5 = time()
-#    string = "data_transform time: %.4f %.4f %.4f %.4f %.4f %.4f" % ((t2-t1), (t3-t2), (t4-t3), (t5-t4), dot_sum, rest_sum)
-#    sys.stdout.write("\r" + str(string) + "\n")
-#    sys.stdout.flush()
-
-    # ddr_arr = ddr_arr.reshape(shape)
+    """
+    Returns the elements of arr in DDR order: element k is
+    arr.flat[np.dot(stride_list, indices)] for the k-th indices in the
+    row-major order of idx_list. arr is viewed with that shape and strides,
+    and copied once.
+    """
+    idx_list = [int(n) for n in idx_list]
+    stride_list = [int(stride) for stride in stride_list]
+    arr = np.ascontiguousarray(arr).reshape(-1)
+    ddr_arr = np.empty(arr.size, dtype=arr.dtype)
+    view = _get_strided_view(arr, idx_list, stride_list)
+    if view is None:
+        # Raises IndexError for indices outside arr
+        view = arr[_get_flat_indices(idx_list, stride_list)]
+    ddr_arr[:view.size] = view.reshape(-1)
     if verbose:
-        print(ddr_arr.flatten().reshape(ddr_arr.size/4,4))
+        print(ddr_arr.reshape(ddr_arr.size // 4, 4))
     return ddr_arr
 
+def data_transform_inverse(ddr_arr, idx_list, stride_list, shape):
+    """
+    Inverse of data_transform: returns an array of shape shape with each
+    element of ddr_arr back where data_transform read it from. Elements that
+    data_transform does not read are zero.
+    """
+    idx_list = [int(n) for n in idx_list]
+    stride_list = [int(stride) for stride in stride_list]
+    arr = np.zeros(int(np.prod(shape)), dtype=ddr_arr.dtype)
+    num_elements = int(np.prod(idx_list))
+    ddr_arr = np.asarray(ddr_arr).reshape(-1)[:num_elements].reshape(idx_list)
+    view = _get_strided_view(arr, idx_list, stride_list)
+    if view is None:
+        arr[_get_flat_indices(idx_list, stride_list)] = ddr_arr
+    else:
+        view[...] = ddr_arr
+    return arr.reshape(shape)
+
 def np_array_to_ddr(arr, idx_list, stride_list, verbose=False):
-#    t1 = time()
-    ddr_arr = data_transform(arr, idx_list, stride_list, verbose).flatten()
-#    _tin_ddr = np.transpose(padded_data.reshape(tin.fpga_size), (0,3,1,2))
-#    print (_tin_ddr.shape)
-#    if (tin_ddr - _tin_ddr).sum() != 0:
-#        print ("DIFF")
-#    else:
-#        print ("SAME")
-#    sys.exit()
-
-#    t2 = time()
-#    dtype_str = get_dtype_str(np.int8)
-#    t3 = time()
-#    string = "np_array_to_ddr time: %.4f %.4f" % ((t2-t1), (t3-t2))
-#    sys.stdout.write("\r" + str(string) + "\n")
-#    sys.stdout.flush()
-#    return np.array(array.array(dtype_str, ddr_arr.tobytes()), dtype=np.int8)
-    return ddr_arr
+    return data_transform(arr, idx_list, stride_list, verbose)
+
+# DDR region for one input in flight
+#   input_addr: address of the padded input tensor
+#   output_addr: address of the padded output tensor
+#   instructions: instruction binary compiled for these addresses, written
+#                 to the instruction buffer before each start, or None to
+#                 keep the loaded instructions
+DDRSlot = namedtuple('DDRSlot', ['input_addr', 'output_addr', 'instructions'])
+
+# DDR slots of FPGAManager.load_program: two, so that the transfers of one
+# input overlap with the execution of the previous one
+num_ddr_slots = 2
+
+# Number of ExecutionTiming kept by FPGAManager
+timing_history = 1024
+
+# Marks the end of a stream between the threads of FPGAManager.infer_stream
+_end_of_stream = object()
+
+def _put(q, item, stop):
+    # Blocks until there is room in q, or stop is set
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _end_of_stream
+
+class _StreamError(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
 
 def get_dtype_str(dtype):
     if dtype == np.int8:
@@ -89,7 +195,14 @@ class FPGAManager(object):
             pci_cl_ctrl_device='/dev/xdma0_user',
             c2h_dma_device='/dev/xdma0_c2h_0',
             h2c_dma_device='/dev/xdma0_h2c_0',
-            log_level=logging.INFO):
+            log_level=logging.INFO,
+            events_device=None):
+        """
+        Args:
+            events_device: XDMA events device of the user interrupt the
+                           fpga raises when done, e.g. /dev/xdma0_events_0;
+                           the state register is polled when None
+        """
         self.log = logging.getLogger('FPGA Manager')
         self.log.setLevel(log_level)
         self.fpga_memspace = FPGAMemSpace(
@@ -99,6 +212,15 @@ class FPGAManager(object):
                 log_level=logging.INFO)
         self.input_op = None
         self.output_t = None
+        if events_device is not None:
+            self.waiter = EventWaiter(events_device, log_level=log_level)
+        else:
+            self.waiter = BackoffPoller()
+        self.predicted_time = None
+        self.timings = deque(maxlen=timing_history)
+        self._ready_time = None
+        self._start_time = None
+        self.ddr_slots = None
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
     def send_input_nparr(self, input_nparr):
@@ -107,10 +229,9 @@ class FPGAManager(object):
         op.data.data = input_nparr
         tin = op.data
         self.log.debug('Sending tensor {} to fpga'.format(op.data))
-        pad = op.pad
-        b, I, _, ic = tin.fpga_shape
         padded_data = _pad_tensor(tin)
         self.fpga_memspace.write('ddr', tin.fpga_addr, padded_data)
+        self._ready_time = time()
         self.log.debug('tensor data: \n{}'.format(tin.data))
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
@@ -125,12 +246,7 @@ class FPGAManager(object):
         return self.output_t.dtype.frac_bits
 
     def _unpad_tensor(self, t, data):
-        return data[
-                t.fpga_pad[0][0]:t.fpga_pad[0][0]+t.shape[0],
-                t.fpga_pad[1][0]:t.fpga_pad[1][0]+t.shape[1],
-                t.fpga_pad[2][0]:t.fpga_pad[2][0]+t.shape[2],
-                t.fpga_pad[3][0]:t.fpga_pad[3][0]+t.shape[3]
-                ]
+        return unpad_from_ddr(data, t.fpga_pad, t.shape)
 
     # TODO: this is not a general impl. Needs to be cleaned up after hotchips.
     def recv_output_nparr(self):
@@ -139,10 +255,132 @@ class FPGAManager(object):
         self.log.debug('{}'.format(t))
         self.log.debug('OP name: {}'.format(op.name))
         self.log.debug('OP output address: {}'.format(t.fpga_addr))
-        got_out_fpga = np.array(array.array('h', self.fpga_memspace.read('ddr', t.fpga_addr, t.fpga_size_in_bytes)), dtype=np.int16).reshape(t.fpga_shape)
+        got_out_fpga = self.fpga_memspace.read_into('ddr', t.fpga_addr, get_aligned_array(t.fpga_shape, np.int16))
         got_out_fpga = self._unpad_tensor(t, got_out_fpga)
         return got_out_fpga
 
+    def get_default_slots(self):
+        """
+        Returns the DDR slots set up by load_program, or else the DDR slot
+        of the input and output tensors of the graph
+        """
+        if self.ddr_slots is not None:
+            return self.ddr_slots
+        return [DDRSlot(self.input_op.data.fpga_addr, self.output_t.fpga_addr, None)]
+
+    def load_program(self, compiler, num_slots=num_ddr_slots):
+        """
+        Writes the instructions of the graph compiled last by compiler (a
+        GraphCompiler), and sets up num_slots DDR slots for infer_stream
+        with compiler.get_ddr_slots. Call after initialize_graph: the output
+        region of every slot starts as a copy of the graph's.
+        """
+        slots = compiler.get_ddr_slots(num_slots)
+        self.send_instructions(slots[0].instructions)
+        t = self.output_t
+        initial_output = self.fpga_memspace.read_into('ddr', t.fpga_addr,
+                get_aligned_array(t.fpga_size_in_bytes, np.uint8))
+        for slot in slots[1:]:
+            self.fpga_memspace.write('ddr', slot.output_addr, initial_output)
+        self.ddr_slots = slots
+
+    def _prepare_inputs(self, inputs, prepared, stop):
+        tin = self.input_op.data
+        try:
+            for input_nparr in inputs:
+                padded_data = pad_to_ddr(np.asarray(input_nparr), tin.fpga_pad)
+                if not _put(prepared, (time(), padded_data), stop):
+                    return
+        except Exception:
+            _put(prepared, _StreamError(sys.exc_info()), stop)
+            return
+        _put(prepared, _end_of_stream, stop)
+
+    def _run_inputs(self, slots, prepared, outputs, stop):
+        """
+        Runs the prepared inputs on the fpga, and queues the raw outputs.
+        With one slot, each input is written once the previous execution is
+        done and its output read. With more slots, input N is written to a
+        free slot while input N-1 runs, and output N-1 is read while input N
+        runs.
+        """
+        running = None
+        try:
+            n = 0
+            while True:
+                item = _get(prepared, stop)
+                if item is _end_of_stream or isinstance(item, _StreamError):
+                    break
+                ready_time, padded_data = item
+                slot = slots[n % len(slots)]
+                if len(slots) > 1:
+                    self.fpga_memspace.write('ddr', slot.input_addr, padded_data)
+                if running is not None:
+                    self.wait_fpga_execution()
+                    if len(slots) == 1:
+                        self._read_output(running, outputs, stop)
+                        running = None
+                if len(slots) == 1:
+                    self.fpga_memspace.write('ddr', slot.input_addr, padded_data)
+                if slot.instructions is not None:
+                    self.fpga_memspace.write('pci_cl_data', 0, slot.instructions)
+                self.start(ready_time)
+                if running is not None:
+                    self._read_output(running, outputs, stop)
+                running = slot
+                n += 1
+            if running is not None:
+                self.wait_fpga_execution()
+                self._read_output(running, outputs, stop)
+            _put(outputs, item, stop)
+        except Exception:
+            _put(outputs, _StreamError(sys.exc_info()), stop)
+
+    def _read_output(self, slot, outputs, stop):
+        t = self.output_t
+        raw = self.fpga_memspace.read_into('ddr', slot.output_addr, get_aligned_array(t.fpga_shape, np.int16))
+        _put(outputs, raw, stop)
+
+    def infer_stream(self, inputs, slots=None):
+        """
+        Runs every input of the iterable inputs on the fpga, and yields
+        their outputs in order, as recv_output_nparr.
+
+        Padding input N+1 on the host overlaps with the fpga running input
+        N, and so does unpadding output N-1 in the caller. The transfers
+        overlap with the execution too when more than one DDR slot is
+        given: slots[k] is used for inputs k, k + len(slots), ..., and
+        needs its own instructions, see load_program.
+        Args:
+            slots: list of DDRSlot, defaults to get_default_slots(): the
+                   double-buffered slots of load_program, or one slot
+        """
+        if slots is None:
+            slots = self.get_default_slots()
+        # At most one prepared input waits while another is written, and
+        # one raw output while the caller handles the previous one
+        prepared = queue.Queue(maxsize=1)
+        outputs = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._prepare_inputs, args=(inputs, prepared, stop)),
+                   threading.Thread(target=self._run_inputs, args=(slots, prepared, outputs, stop))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                raw = outputs.get()
+                if raw is _end_of_stream:
+                    break
+                if isinstance(raw, _StreamError):
+                    exc_type, exc_value, exc_tb = raw.exc_info
+                    raise exc_value
+                yield self._unpad_tensor(self.output_t, raw)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
     def initialize_graph_tensors(self, graph):
         self.log.debug('Initializing tensors')
         for tname, t in graph.tensor_registry.items():
@@ -188,8 +426,7 @@ class FPGAManager(object):
                 self.log.debug('Sending tensor {} to fpga addr {}'.format(tw, tw.fpga_addr))
                 oc, kh, kw, ic = tw.fpga_shape
                 assert oc % array_m == 0
-                tw_data = _pad_tensor(tw).reshape(int(oc/array_m),array_m,kh,kw,ic)
-                tw_ddr = np.transpose(tw_data, (0,2,3,4,1)).copy()
+                tw_ddr = weights_to_ddr(tw.data, tw.fpga_pad, array_m)
                 self.fpga_memspace.write('ddr', tw.fpga_addr, tw_ddr)
                 self.log.debug('tensor data: \n{}'.format(tw.data))
 
@@ -222,6 +459,16 @@ class FPGAManager(object):
                 self.fpga_memspace.write('ddr', scale.fpga_addr, scale_ddr)
                 self.log.debug('tensor data: \n{}'.format(scale.data))
 
+    def send_instructions(self, instructions):
+        """
+        Writes the instructions to the instruction buffer, from the int32
+        array returned by GraphCompiler.compile, or from the file it wrote,
+        memory mapped
+        """
+        if not isinstance(instructions, np.ndarray):
+            instructions = read_instructions(instructions, mmap=True)
+        self.fpga_memspace.write('pci_cl_data', 0, instructions)
+
     def write(self, namespace, addr, data):
         self.fpga_memspace.write(namespace, addr, data)
 
@@ -231,14 +478,53 @@ class FPGAManager(object):
     def get_fpga_state(self):
         return self.fpga_memspace.read('pci_cl_ctrl', 8)
 
-    def wait_fpga_execution(self):
-        state = self.get_fpga_state()
-        if state != 0:
-            while state != 0:
-                state = self.get_fpga_state()
-#                sleep(0.0001)
-
-    def start(self):
+    def set_predicted_cycles(self, cycles, frequency):
+        """
+        Sets the predicted cycles of one execution, e.g. from
+        GraphCompiler.get_predicted_cycles, to calibrate the polling. None
+        clears the prediction.
+        """
+        if cycles is None:
+            self.predicted_time = None
+        else:
+            self.predicted_time = float(cycles) / frequency
+
+    def _is_done(self):
+        return self.get_fpga_state() == 0
+
+    def wait_fpga_execution(self, timeout=None):
+        """
+        Waits for the execution started last to finish, and records its
+        ExecutionTiming. Raises IOError after timeout seconds.
+        """
+        start = self._start_time if self._start_time is not None else time()
+        state_reads = self.waiter.wait(self._is_done, start, self.predicted_time, timeout)
+        if self._start_time is None:
+            return
+        execution = time() - start
+        self.waiter.calibrate(execution, self.predicted_time, state_reads)
+        queue_wait = start - self._ready_time if self._ready_time is not None else 0.
+        self.timings.append(ExecutionTiming(queue_wait, execution, self.predicted_time,
+                                            state_reads, self.waiter.mode))
+        self._ready_time = None
+        self._start_time = None
+
+    def get_last_timing(self):
+        """
+        Returns the ExecutionTiming of the last execution waited for, or None
+        """
+        return self.timings[-1] if len(self.timings) > 0 else None
+
+    def start(self, ready_time=None):
+        """
+        Starts the fpga. ready_time is the time() the input was ready at,
+        for the queue wait; defaults to the end of send_input_nparr.
+        """
+        if ready_time is not None:
+            self._ready_time = ready_time
+        if self.waiter.mode == 'event':
+            self.waiter.clear()
+        self._start_time = time()
         self.fpga_memspace.write('pci_cl_ctrl', 0, 1)
         self.fpga_memspace.write('pci_cl_ctrl', 0, 0)
 
@@ -2,7 +2,6 @@ import logging
 import mmap
 import os
 import numpy as np
-import array
 import codecs
 
 decode_hex = codecs.getdecoder("hex_codec")
@@ -11,18 +10,105 @@ def to_bytes(n, length, endianess='big'):
     s = decode_hex(('0'*(len(h) % 2) + h).zfill(length*2))[0]
     return s if endianess == 'big' else s[::-1]
 
+# Offset of the instruction buffer in the DMA address space
+inst_buffer_addr = 0x100000000
+# Size of the control registers mapped from the user device
+pci_cl_ctrl_size = 32*1024
+# Largest transfer in one call to the DMA devices
+dma_chunk_size = 1<<23
+# Alignment of the buffers from get_aligned_array
+dma_alignment = 4096
+
+def get_aligned_array(shape, dtype, alignment=dma_alignment):
+    """
+    Returns an uninitialized array whose data starts at a multiple of
+    alignment bytes, to read DMA transfers into
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    buf = np.empty(size + alignment, dtype=np.uint8)
+    offset = (-buf.ctypes.data) % alignment
+    return buf[offset:offset+size].view(dtype).reshape(shape)
+
+def _get_byte_view(data):
+    """
+    Returns a memoryview of the bytes of data, without a copy for
+    contiguous arrays
+    """
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data)
+    else:
+        data = np.frombuffer(data, dtype=np.uint8)
+    return memoryview(data.reshape(-1).view(np.uint8))
+
+def _write_all(fd, data, offset, chunk_size=dma_chunk_size):
+    buf = _get_byte_view(data)
+    pos = 0
+    while pos < len(buf):
+        chunk = buf[pos:pos+chunk_size]
+        if hasattr(os, 'pwritev'):
+            written = os.pwritev(fd, [chunk], offset+pos)
+        else:
+            os.lseek(fd, offset+pos, os.SEEK_SET)
+            written = os.write(fd, chunk)
+        pos += written
+
+def _read_into(fd, out, offset, chunk_size=dma_chunk_size):
+    assert out.flags.c_contiguous and out.flags.writeable
+    buf = _get_byte_view(out)
+    pos = 0
+    while pos < len(buf):
+        chunk = buf[pos:pos+chunk_size]
+        if hasattr(os, 'preadv'):
+            num_read = os.preadv(fd, [chunk], offset+pos)
+        elif hasattr(os, 'readv'):
+            os.lseek(fd, offset+pos, os.SEEK_SET)
+            num_read = os.readv(fd, [chunk])
+        else:
+            # Python 2: one copy from the bytes read
+            os.lseek(fd, offset+pos, os.SEEK_SET)
+            data = os.read(fd, len(chunk))
+            num_read = len(data)
+            chunk[:num_read] = data
+        if num_read == 0:
+            raise IOError('Short read at address {}: {} of {} Bytes'.format(offset+pos, pos, len(buf)))
+        pos += num_read
+    return out
+
+def create_stand_in_device(path, ddr_size=1<<30, inst_size=1<<24):
+    """
+    Creates regular files in directory path that FPGAMemSpace can open in
+    place of the XDMA devices, to test without hardware. The DDR and the
+    instruction buffer are one sparse file, used for both DMA directions,
+    so reads return what was written.
+    Returns:
+        dict with the device arguments of FPGAMemSpace (and FPGAManager)
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    pci_cl_ctrl_device = os.path.join(path, 'user')
+    with open(pci_cl_ctrl_device, 'wb') as f:
+        f.truncate(pci_cl_ctrl_size)
+    ddr_device = os.path.join(path, 'ddr')
+    with open(ddr_device, 'wb') as f:
+        f.truncate(max(ddr_size, inst_buffer_addr + inst_size))
+    return {'pci_cl_ctrl_device': pci_cl_ctrl_device,
+            'c2h_dma_device': ddr_device,
+            'h2c_dma_device': ddr_device}
+
 class FPGAMemSpace(object):
     def __init__(self,
             pci_cl_ctrl_device='/dev/xdma/card0/user',
             c2h_dma_device='/dev/xdma/card0/c2h0',
             h2c_dma_device='/dev/xdma/card0/h2c0',
-            log_level=logging.INFO):
+            log_level=logging.INFO,
+            chunk_size=dma_chunk_size):
         self.log = logging.getLogger('FPGA Memspace')
         self.log.setLevel(log_level)
 
         self.log.debug('Opening device: {}'.format(pci_cl_ctrl_device))
         self.pci_cl_ctrl_fd = open(pci_cl_ctrl_device, 'r+b', buffering=0)
-        self.pci_cl_ctrl_mmap = mmap.mmap(self.pci_cl_ctrl_fd.fileno(), 32*1024, prot=mmap.PROT_READ|mmap.PROT_WRITE)
+        self.pci_cl_ctrl_mmap = mmap.mmap(self.pci_cl_ctrl_fd.fileno(), pci_cl_ctrl_size, prot=mmap.PROT_READ|mmap.PROT_WRITE)
 
         self.log.debug('Opening device: {}'.format(h2c_dma_device))
         self.h2c_fd = os.open(h2c_dma_device, os.O_RDWR)
@@ -30,24 +116,42 @@ class FPGAMemSpace(object):
         self.log.debug('Opening device: {}'.format(c2h_dma_device))
         self.c2h_fd = os.open(c2h_dma_device, os.O_RDWR)
 
-        self.inst_buffer_addr = 0x100000000
+        self.inst_buffer_addr = inst_buffer_addr
+        self.chunk_size = chunk_size
 
     def write(self, namespace, addr, data):
+        """
+        Writes data to namespace. Contiguous numpy arrays are sent from
+        their own buffer, in chunks of at most chunk_size Bytes.
+        """
         assert namespace in ('pci_cl_data', 'pci_cl_ctrl', 'ddr')
 
         if namespace == 'pci_cl_ctrl':
             self.pci_cl_ctrl_mmap.seek(addr)
             self.pci_cl_ctrl_mmap.write(to_bytes(data, 4, 'little'))
         elif namespace == 'pci_cl_data':
-            os.lseek(self.h2c_fd, addr+self.inst_buffer_addr, 0)
-            os.write(self.h2c_fd, data)
+            _write_all(self.h2c_fd, data, addr+self.inst_buffer_addr, self.chunk_size)
         else:
-            self.log.debug('Writing data {} with dtype {} to address {}'.format(
-                data, data.dtype, addr))
-            os.lseek(self.h2c_fd, addr, 0)
-            os.write(self.h2c_fd, data)
+            self.log.debug('Writing data with dtype {} and size {} to address {}'.format(
+                data.dtype, data.size, addr))
+            _write_all(self.h2c_fd, data, addr, self.chunk_size)
+
+    def read_into(self, namespace, addr, out):
+        """
+        Reads out.nbytes Bytes from namespace into the contiguous array out,
+        e.g. from get_aligned_array, and returns out
+        """
+        assert namespace in ('pci_cl_data', 'ddr')
+        if namespace == 'pci_cl_data':
+            addr += self.inst_buffer_addr
+        self.log.debug('Reading tensor of size {} Bytes from address {}'.format(out.nbytes, addr))
+        return _read_into(self.c2h_fd, out, addr, self.chunk_size)
 
     def read(self, namespace, addr, size=None):
+        """
+        Reads a control register, or size Bytes from the instruction buffer
+        (as int32) or from the DDR (as uint8)
+        """
         assert namespace in ('pci_cl_data', 'pci_cl_ctrl', 'ddr')
 
         if namespace == 'pci_cl_ctrl':
@@ -58,10 +162,6 @@ class FPGAMemSpace(object):
             v = '0x'+''.join([hex(ord(i))[2:].zfill(2) for i in reversed(v)])
             return int(v, 16)
         elif namespace == 'pci_cl_data':
-            os.lseek(self.c2h_fd, addr+self.inst_buffer_addr, 0)
-            return np.array(array.array('i', os.read(self.c2h_fd, size)), dtype=np.int32)
+            return self.read_into(namespace, addr, get_aligned_array(int(size) // 4, np.int32))
         else:
-            self.log.debug('Reading tensor of size {} Bytes from address {}'.format(size, addr))
-            os.lseek(self.c2h_fd, addr, 0)
-            return os.read(self.c2h_fd, int(size))
-
+            return self.read_into(namespace, addr, get_aligned_array(int(size), np.uint8))
@@ -1,4 +1,6 @@
 import math
+import numpy as np
+from collections import namedtuple
 
 
 class OPCodes:
@@ -181,11 +183,17 @@ class PUBlockStart(BFInstruction):
 
 class BaseAddressInstruction(BFInstruction):
 
-    def __init__(self, scratchpad_ID, index, address):
+    def __init__(self, scratchpad_ID, index, address, symbol=None, offset=0):
+        """
+        symbol and offset mark address as offset Bytes into the tensor named
+        symbol, for relocation (see InstructionBuffer.add_instructions)
+        """
         # print('Scratchpad: {}; address: {}'.format(scratchpad_ID, address))
         self.scratchpad_ID = scratchpad_ID
         self.index = index
         self.address = address
+        self.symbol = symbol
+        self.offset = offset
         addr_index = (address >> (index*21))
         immediate = addr_index % (1 << 21)
         loop_id = addr_index >> 16
@@ -319,3 +327,208 @@ class GenAddrHighInstruction(BFInstruction):
         op_spec += self.ld_st << 0
         self.op_spec = op_spec
         return super(GenAddrHighInstruction, self).get_binary()
+
+# A base address of a block of instructions that depends on where a tensor
+# is allocated
+#   position: index of the base address instruction in the block
+#   symbol: name of the tensor in the block
+#   offset: Bytes from the start of the tensor
+Relocation = namedtuple('Relocation', ['position', 'scratchpad_ID', 'index', 'symbol', 'offset'])
+
+def _get_spec(bitwidth):
+    return int(math.log(bitwidth) / math.log(2))
+
+def pack_instructions(op_code, op_spec, loop_id, immediate):
+    """
+    Vectorized BFInstruction.get_binary: returns the int32 binaries of the
+    instructions with the given fields, as arrays or scalars
+    """
+    op_code, op_spec, loop_id, immediate = np.broadcast_arrays(
+            *[np.asarray(f, dtype=np.int64) for f in (op_code, op_spec, loop_id, immediate)])
+    assert ((op_code   >= 0) & (op_code   < (1 << 5))).all()
+    assert ((op_spec   >= 0) & (op_spec   < (1 << 6))).all()
+    assert ((loop_id   >= 0) & (loop_id   < (1 << 5))).all()
+    assert ((immediate >= 0) & (immediate < (1 << 16))).all()
+    binary = (op_code << 28) + (op_spec << 21) + (loop_id << 16) + immediate
+    return binary.astype(np.uint32).view(np.int32)
+
+def pack_base_address(scratchpad_ID, index, address):
+    """
+    Vectorized BaseAddressInstruction.get_binary
+    """
+    scratchpad_ID, index, address = [np.asarray(f, dtype=np.int64) for f in (scratchpad_ID, index, address)]
+    addr_index = address >> (index*21)
+    return pack_instructions(OPCodes.BASE_ADDR, (scratchpad_ID << 3) + index,
+                             (addr_index >> 16) % (1 << 5), addr_index % (1 << 16))
+
+def relocate(instructions, relocations, addresses):
+    """
+    Returns a copy of instructions with the base address of each relocation
+    set to offset Bytes into the tensor at addresses[symbol]
+    """
+    instructions = np.array(instructions, dtype=np.int32)
+    if len(relocations) == 0:
+        return instructions
+    position, scratchpad_ID, index, symbol, offset = zip(*relocations)
+    address = np.array([addresses[s] for s in symbol], dtype=np.int64) + np.array(offset, dtype=np.int64)
+    instructions[list(position)] = pack_base_address(scratchpad_ID, index, address)
+    return instructions
+
+def pack_gen_addr(scratchpad_ID, ld_st, loop_id, strides):
+    """
+    Returns the int32 binaries of the address generation of each stride in
+    strides: a GenAddrHighInstruction for strides of 16 bits or more,
+    followed by a GenAddrLowInstruction
+    Args:
+        scratchpad_ID, ld_st: scalars or arrays with one entry per stride
+    """
+    strides = np.asarray(strides, dtype=np.int64).reshape(-1)
+    scratchpad_ID, ld_st = [np.broadcast_to(np.asarray(f, dtype=np.int64), strides.shape)
+                            for f in (scratchpad_ID, ld_st)]
+    high = strides >= (1 << 16)
+    # Position of each low instruction, after the high instructions so far
+    low_pos = np.arange(len(strides)) + np.cumsum(high)
+    n = len(strides) + int(high.sum())
+    op_code = np.empty(n, dtype=np.int64)
+    immediate = np.empty(n, dtype=np.int64)
+    op_spec = np.empty(n, dtype=np.int64)
+    op_code[low_pos] = OPCodes.GENADDRLO
+    immediate[low_pos] = strides % (1 << 16)
+    op_spec[low_pos] = (scratchpad_ID << 3) + ld_st
+    high_pos = low_pos[high] - 1
+    op_code[high_pos] = OPCodes.GENADDRHI
+    immediate[high_pos] = strides[high] >> 16
+    op_spec[high_pos] = op_spec[low_pos[high]]
+    return pack_instructions(op_code, op_spec, loop_id, immediate)
+
+# Below this many strides, gen_addr encodes in Python: the numpy calls of
+# pack_gen_addr cost more than they save
+vectorize_min_strides = 64
+
+def _to_int32(binary):
+    binary = int(binary) & 0xffffffff
+    return binary - (1 << 32) if binary >= (1 << 31) else binary
+
+class InstructionBuffer(object):
+    """
+    Growable int32 buffer of instruction binaries. The encoders append the
+    binaries of the instruction classes above without creating them.
+    Base addresses given a symbol are listed in relocations.
+    """
+
+    def __init__(self, capacity=1024):
+        self.data = np.empty(capacity, dtype=np.int32)
+        self.size = 0
+        self.relocations = []
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n):
+        if self.size + n > len(self.data):
+            data = np.empty(max(2 * len(self.data), self.size + n), dtype=np.int32)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, binary):
+        self._reserve(1)
+        self.data[self.size] = _to_int32(binary)
+        self.size += 1
+
+    def extend(self, binaries):
+        """
+        Appends int32 arrays, or lists of binaries as from get_binary
+        """
+        if not isinstance(binaries, np.ndarray):
+            binaries = [_to_int32(b) for b in binaries]
+        binaries = np.asarray(binaries, dtype=np.int32).reshape(-1)
+        self._reserve(len(binaries))
+        self.data[self.size:self.size + len(binaries)] = binaries
+        self.size += len(binaries)
+
+    def add_instructions(self, instructions):
+        """
+        Appends the binaries of instruction objects, keeping the relocations
+        of BaseAddressInstructions with a symbol
+        """
+        for i in instructions:
+            if isinstance(i, BaseAddressInstruction) and i.symbol is not None:
+                self.base_address(i.scratchpad_ID, i.index, i.address, i.symbol, i.offset)
+            else:
+                self.append(i.get_binary())
+
+    def get_array(self):
+        """
+        Returns a view of the binaries
+        """
+        return self.data[:self.size]
+
+    def tofile(self, filename):
+        """
+        Writes the binaries to filename, as little-endian int32, for
+        read_instructions
+        """
+        self.get_array().astype('<i4').tofile(filename)
+
+    def _append_fields(self, op_code, op_spec, loop_id, immediate):
+        assert op_code   >= 0 and op_code   < (1 << 5)
+        assert op_spec   >= 0 and op_spec   < (1 << 6)
+        assert loop_id   >= 0 and loop_id   < (1 << 5)
+        assert immediate >= 0 and immediate < (1 << 16)
+        self.append((op_code << 28) + (op_spec << 21) + (loop_id << 16) + immediate)
+
+    def setup(self, op0_bitwidth, op1_bitwidth):
+        self._append_fields(OPCodes.SETUP, (_get_spec(op0_bitwidth) << 3) + _get_spec(op1_bitwidth), 0, 0)
+
+    def base_address(self, scratchpad_ID, index, address, symbol=None, offset=0):
+        """
+        Appends a base address. With a symbol, address is offset Bytes into
+        the tensor named symbol, and a Relocation is recorded.
+        """
+        if symbol is not None:
+            self.relocations.append(Relocation(self.size, scratchpad_ID, index, symbol, offset))
+        addr_index = address >> (index*21)
+        self._append_fields(OPCodes.BASE_ADDR, (scratchpad_ID << 3) + index,
+                            (addr_index >> 16) % (1 << 5), addr_index % (1 << 16))
+
+    def loop(self, loop_level, loop_id, loop_iterations):
+        self._append_fields(OPCodes.LOOP, loop_level, loop_id, loop_iterations)
+
+    def ld_mem(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        self._append_fields(OPCodes.LDMEM, (scratchpad_ID << 3) + _get_spec(mem_bitwidth), loop_id, access_size)
+
+    def st_mem(self, scratchpad_ID, mem_bitwidth, loop_id, access_size):
+        self._append_fields(OPCodes.STMEM, (scratchpad_ID << 3) + _get_spec(mem_bitwidth), loop_id, access_size)
+
+    def gen_addr(self, scratchpad_ID, ld_st, loop_id, strides):
+        """
+        Appends pack_gen_addr(scratchpad_ID, ld_st, loop_id, strides)
+        """
+        if np.ndim(strides) > 0 and len(strides) >= vectorize_min_strides:
+            self.extend(pack_gen_addr(scratchpad_ID, ld_st, loop_id, strides))
+            return
+        if np.ndim(strides) == 0:
+            strides = (strides,)
+        n = len(strides)
+        if np.ndim(scratchpad_ID) == 0:
+            scratchpad_ID = (scratchpad_ID,) * n
+        if np.ndim(ld_st) == 0:
+            ld_st = (ld_st,) * n
+        for sp, ls, stride in zip(scratchpad_ID, ld_st, strides):
+            stride = int(stride)
+            op_spec = (sp << 3) + ls
+            if stride >= (1 << 16):
+                self._append_fields(OPCodes.GENADDRHI, op_spec, loop_id, stride >> 16)
+            self._append_fields(OPCodes.GENADDRLO, op_spec, loop_id, stride % (1 << 16))
+
+    def block_end(self, last=False):
+        self._append_fields(OPCodes.BLOCK_END, 0, 0, int(last))
+
+def read_instructions(filename, mmap=False):
+    """
+    Returns the int32 binaries written by InstructionBuffer.tofile, memory
+    mapped if mmap is True
+    """
+    if mmap:
+        return np.memmap(filename, dtype='<i4', mode='r')
+    return np.fromfile(filename, dtype='<i4')
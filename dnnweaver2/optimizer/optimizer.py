@@ -4,11 +4,12 @@ import time
 import logging
 
 from itertools import permutations
-from multiprocessing import Pool, cpu_count
 
 from dnnweaver2.utils.utils import ceil_a_by_b, log2
 from dnnweaver2.simulator.loop_stack import LoopStack
 from dnnweaver2.simulator.stats import Stats
+from dnnweaver2.simulator.accelerator import Accelerator
+from dnnweaver2.optimizer.worker_pool import get_pool, close_pool, get_chunksize
 
 import numpy as np
 
@@ -188,7 +189,40 @@ def get_stats_fast(conv_params, tiling, order_type, verbose=False):
 
     return stats
 
-def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequential=True):
+def pack_conv_params(conv_params):
+    """
+    Flattens conv_params (with pool kernel/stride) into a tuple of numbers,
+    so that tasks sent to the worker pool do not pickle the Accelerator
+    """
+    acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride = conv_params
+    return (acc_obj.N, acc_obj.M, acc_obj.prec,
+            acc_obj.sram['ibuf'], acc_obj.sram['wbuf'], acc_obj.sram['obuf'], acc_obj.sram['bbuf'],
+            acc_obj.mem_if_width, acc_obj.frequency,
+            K, O, S, IC, OC, B, iprec, wprec, im2col,
+            tuple(energy_cost), tuple(pool_kernel), tuple(pool_stride))
+
+# Last tuple unpacked by this process; a worker usually sees the same
+# layer for every chunk it is handed
+_unpacked_conv_params = (None, None)
+
+def unpack_conv_params(packed_params):
+    """
+    Inverse of pack_conv_params
+    """
+    global _unpacked_conv_params
+    if _unpacked_conv_params[0] == packed_params:
+        return _unpacked_conv_params[1]
+    N, M, prec, ibuf, wbuf, obuf, bbuf, mem_if_width, frequency = packed_params[:9]
+    sram = {'ibuf': ibuf, 'wbuf': wbuf, 'obuf': obuf, 'bbuf': bbuf}
+    acc_obj = Accelerator(N, M, prec, sram, mem_if_width, frequency)
+    conv_params = (acc_obj,) + tuple(packed_params[9:])
+    _unpacked_conv_params = (packed_params, conv_params)
+    return conv_params
+
+def _optimize_for_order_packed(packed_params, order_type):
+    return _optimize_for_order(unpack_conv_params(packed_params), order_type)
+
+def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequential=True, processes=None, chunksize=None):
     # Generate permutations for the order
     loops = ['B/b', 'OW/ow', 'OH/oh', 'IC/ic', 'OC/oc']
     order = set(permutations(loops))
@@ -206,13 +240,14 @@ def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequenti
     conv_params_with_pool = acc_obj, K, O, S, IC, OC, B, iprec, wprec, im2col, energy_cost, pool_kernel, pool_stride
 
     if not sequential:
-        _bound_optimizer_method = functools.partial(_optimize_for_order, conv_params_with_pool)
+        # The shared pool is reused across layers; each task only carries
+        # the packed numeric params and one order
+        _bound_optimizer_method = functools.partial(_optimize_for_order_packed, pack_conv_params(conv_params_with_pool))
+        chunksize = get_chunksize(len(order), processes, chunksize)
 
         try:
-            pool = Pool(cpu_count())
-            results = pool.map_async(_bound_optimizer_method, order).get(10000)
-            pool.close()
-            pool.join()
+            pool = get_pool(processes)
+            results = pool.map_async(_bound_optimizer_method, order, chunksize).get(10000)
 
             # for o in order:
             #     _bound_optimizer_method(o)
@@ -237,8 +272,7 @@ def optimize_for_order(conv_params, pool_kernel=None, pool_stride=None, sequenti
             return best_tiling, best_order, cycles_array, energy_array
 
         except KeyboardInterrupt:
-            pool.terminate()
-            pool.join()
+            close_pool(terminate=True)
             return
 
     else:
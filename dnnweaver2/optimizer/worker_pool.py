@@ -0,0 +1,59 @@
+import atexit
+import logging
+
+from multiprocessing import Pool, cpu_count
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'WorkerPool'))
+logger.setLevel(logging.INFO)
+
+# A single pool of optimizer workers shared by all layers and networks, and
+# by the dnnweaver2 and bitfusion optimizers. Forking cpu_count() processes
+# per layer costs more than the search itself for small layers, so the pool
+# is created once and reused.
+_pool = None
+_pool_processes = None
+
+def get_pool(processes=None):
+    """
+    Returns the shared worker pool, creating it on first use
+    Args:
+        processes: number of workers (defaults to cpu_count()). Asking for a
+                   different number of workers replaces the existing pool.
+    """
+    global _pool, _pool_processes
+    if processes is None:
+        processes = cpu_count()
+    if _pool is not None and _pool_processes != processes:
+        close_pool()
+    if _pool is None:
+        logger.debug('Creating worker pool with {} processes'.format(processes))
+        _pool = Pool(processes)
+        _pool_processes = processes
+    return _pool
+
+def close_pool(terminate=False):
+    """
+    Shuts down the shared worker pool. The next get_pool() creates a new one.
+    """
+    global _pool, _pool_processes
+    if _pool is None:
+        return
+    if terminate:
+        _pool.terminate()
+    else:
+        _pool.close()
+    _pool.join()
+    _pool = None
+    _pool_processes = None
+
+def get_chunksize(num_tasks, processes=None, chunksize=None):
+    """
+    Splits num_tasks evenly across the workers unless chunksize is given
+    """
+    if chunksize is not None:
+        return max(1, chunksize)
+    if processes is None:
+        processes = _pool_processes or cpu_count()
+    return max(1, -(-num_tasks // processes))
+
+atexit.register(close_pool)
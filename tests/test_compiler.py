@@ -0,0 +1,33 @@
+import unittest
+
+from dnnweaver2.benchmarks.test import get_graph
+from dnnweaver2.compiler import GraphCompiler, FPGASpec
+from dnnweaver2.simulator.accelerator import Accelerator
+
+
+def get_accelerator():
+    sram = {'ibuf': 16*32*512, 'wbuf': 16*32*32*512, 'obuf': 64*32*512, 'bbuf': 16*32*512}
+    return Accelerator(32, 32, 16, sram, 256, 150e6)
+
+
+class GraphCompilerTest(unittest.TestCase):
+
+    def test_predicted_cycles_of_recompile(self):
+        acc_obj = get_accelerator()
+        compiler = GraphCompiler(FPGASpec())
+
+        compiler.compile(get_graph(), acc_obj, inst_file=None)
+        predicted = compiler.get_predicted_cycles()
+        num_convs = len(compiler.conv_cycles)
+        self.assertGreater(predicted, 0)
+
+        # A new graph with the same layers, e.g. a redeployed model; its
+        # compile hits the compile cache
+        compiler.compile(get_graph(), acc_obj, inst_file=None)
+        self.assertEqual(compiler.get_predicted_cycles(), predicted)
+        self.assertEqual(len(compiler.conv_cycles), num_convs)
+        self.assertEqual(len(compiler.conv_tiling), num_convs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from time import time
+
+import numpy as np
+
+from dnnweaver2.benchmarks.test import get_graph
+from dnnweaver2.compiler import GraphCompiler, FPGASpec
+from dnnweaver2.fpga.fpgamanager import FPGAManager
+from dnnweaver2.fpga.memspace import create_stand_in_device, get_aligned_array
+from dnnweaver2.tensorOps.cnn import Convolution
+
+from tests.test_compiler import get_accelerator
+
+
+class StandInFPGAManager(FPGAManager):
+    """
+    Runs on a stand-in device. An execution takes delay seconds, and fills
+    the output region of the running slot with the largest input value.
+    """
+    delay = 0.05
+
+    def __init__(self, **kwargs):
+        super(StandInFPGAManager, self).__init__(**kwargs)
+        self.done = threading.Event()
+        self.done.set()
+        self.executions = []
+        self.input_writes = []
+
+    def _is_done(self):
+        return self.done.is_set()
+
+    def start(self, ready_time=None):
+        super(StandInFPGAManager, self).start(ready_time)
+        slot = self.get_running_slot()
+        self.done.clear()
+        start = time()
+
+        def run():
+            tin = self.input_op.data
+            x = self.fpga_memspace.read_into('ddr', slot.input_addr, get_aligned_array(tin.fpga_shape, np.int16))
+            y = np.empty(self.output_t.fpga_shape, dtype=np.int16)
+            y.fill(x.max())
+            self.fpga_memspace.write('ddr', slot.output_addr, y)
+            self.executions.append((start, time()))
+            self.done.set()
+        timer = threading.Timer(self.delay, run)
+        timer.daemon = True
+        timer.start()
+
+    def get_running_slot(self):
+        # The slot whose instructions are loaded
+        slots = self.get_default_slots()
+        if len(slots) == 1:
+            return slots[0]
+        size = len(slots[0].instructions)
+        loaded = self.fpga_memspace.read_into('pci_cl_data', 0, np.empty(size, dtype=np.int32))
+        for slot in slots:
+            if np.array_equal(slot.instructions, loaded):
+                return slot
+
+
+class InferStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.graph = get_graph()
+        self.compiler = GraphCompiler(FPGASpec())
+        self.compiler.compile(self.graph, get_accelerator(), inst_file=None)
+
+        self.fpga = StandInFPGAManager(**create_stand_in_device(self.path))
+        self.fpga.find_sink_op(self.graph)
+        self.fpga.input_op = [op for op in self.graph.op_registry.values() if isinstance(op, Convolution)][0]
+
+        # Time of each write of an input to the DDR
+        memspace_write = self.fpga.fpga_memspace.write
+        def write(namespace, addr, data):
+            memspace_write(namespace, addr, data)
+            if namespace == 'ddr' and addr in [s.input_addr for s in self.fpga.get_default_slots()]:
+                self.fpga.input_writes.append(time())
+        self.fpga.fpga_memspace.write = write
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_stream(self, num_inputs):
+        shape = self.fpga.input_op.data.shape
+        inputs = [np.full(shape, i + 1, dtype=np.int16) for i in range(num_inputs)]
+        outputs = list(self.fpga.infer_stream(iter(inputs)))
+        self.assertEqual(len(outputs), num_inputs)
+        for i, y in enumerate(outputs):
+            self.assertEqual(y.shape, self.fpga.output_t.shape)
+            self.assertTrue((y == i + 1).all())
+
+    def test_double_buffered_slots(self):
+        self.fpga.load_program(self.compiler)
+        slots = self.fpga.get_default_slots()
+        self.assertEqual(len(slots), 2)
+        self.assertNotEqual(slots[0].input_addr, slots[1].input_addr)
+        self.assertNotEqual(slots[0].output_addr, slots[1].output_addr)
+
+        num_inputs = 6
+        self.run_stream(num_inputs)
+        self.assertEqual(len(self.fpga.executions), num_inputs)
+        # Input i + 1 is transferred while input i runs
+        for i in range(num_inputs - 1):
+            start, end = self.fpga.executions[i]
+            self.assertTrue(start < self.fpga.input_writes[i + 1] < end)
+
+    def test_single_slot(self):
+        num_inputs = 3
+        self.run_stream(num_inputs)
+        # Without load_program, input i + 1 waits for input i to finish
+        for i in range(num_inputs - 1):
+            start, end = self.fpga.executions[i]
+            self.assertGreater(self.fpga.input_writes[i + 1], end)
+
+
+if __name__ == '__main__':
+    unittest.main()
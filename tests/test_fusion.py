@@ -0,0 +1,70 @@
+import unittest
+
+from bitfusion.src.benchmarks.benchmarks import get_bench_nn
+from bitfusion.src.simulator.accelerator import Accelerator
+from bitfusion.src.simulator.stats import Stats
+from bitfusion.src.simulator import fusion
+
+
+def get_tiling(B, IC, OC, OH, OW):
+    # (number of tiles, tile size); only the number of tiles matters here
+    return {'B/b': (B, 1), 'IC/ic': (IC, 1), 'OC/oc': (OC, 1), 'OH/oh': (OH, 1), 'OW/ow': (OW, 1)}
+
+def get_stats(dram_reads, dram_writes, act_writes):
+    stats = Stats()
+    stats.total_cycles = 100000
+    stats.mem_stall_cycles = 50000
+    stats.reads['dram'] = dram_reads
+    stats.writes['dram'] = dram_writes
+    stats.writes['act'] = act_writes
+    return stats
+
+
+class FusionPairTest(unittest.TestCase):
+
+    producer = 'conv0/Convolution'
+    consumer = 'conv1/Convolution'
+    order = ('B/b', 'OH/oh', 'OW/ow', 'OC/oc', 'IC/ic')
+
+    def setUp(self):
+        self.graph = get_bench_nn('LeNet-5')
+        sram = {'act': 1 << 20, 'wgt': 1 << 20, 'out': 1 << 20}
+        self.acc_obj = Accelerator(16, 32, 8, 2, sram, 256, 500e6)
+        self.stats = dict((name, get_stats(1 << 16, 1 << 16, 1 << 16))
+                          for name, op in self.graph.op_registry.items()
+                          if isinstance(op, fusion.compute_ops))
+        self.stats[self.producer] = get_stats(1 << 16, 1 << 24, 1 << 16)
+        self.stats[self.consumer] = get_stats(1 << 20, 1 << 16, 1 << 18)
+
+    def get_pair(self, consumer_tiling, consumer_order):
+        tilings = {self.producer: (get_tiling(1, 1, 1, 4, 4), self.order),
+                   self.consumer: (consumer_tiling, consumer_order)}
+        fused, pairs = fusion.get_fused_stats(self.graph, self.stats, tilings, self.acc_obj)
+        pair, = [p for p in pairs if p.producer == self.producer]
+        self.assertEqual(pair.consumer, self.consumer)
+        return pair, fused
+
+    def test_compatible(self):
+        pair, fused = self.get_pair(get_tiling(1, 1, 2, 2, 2), self.order)
+        self.assertTrue(pair.on_chip)
+        self.assertEqual(pair.consumer_dram_bits_saved, 1 << 18)
+        self.assertEqual(fused[self.consumer].reads['dram'], (1 << 20) - (1 << 18))
+
+    def test_incompatible_order(self):
+        # The consumer walks the columns outside the rows
+        order = ('B/b', 'OW/ow', 'OH/oh', 'OC/oc', 'IC/ic')
+        pair, fused = self.get_pair(get_tiling(1, 1, 2, 2, 2), order)
+        self.assertFalse(pair.on_chip)
+        self.assertEqual(pair.consumer_dram_bits_saved, 0)
+        self.assertEqual(fused[self.consumer].reads['dram'], 1 << 20)
+
+    def test_incompatible_tiles(self):
+        # Three row tiles do not line up with the four of the producer
+        pair, fused = self.get_pair(get_tiling(1, 1, 2, 3, 2), self.order)
+        self.assertFalse(pair.on_chip)
+        self.assertEqual(pair.consumer_dram_bits_saved, 0)
+        self.assertEqual(fused[self.consumer].reads['dram'], 1 << 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
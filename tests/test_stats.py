@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from bitfusion.src.simulator.stats import Stats, StatsBatch
+
+class StatsOverflowTest(unittest.TestCase):
+
+    def get_stats(self, value):
+        stats = Stats()
+        stats.total_cycles = value
+        stats.reads['dram'] = value
+        return stats
+
+    def test_add(self):
+        big = 2**62 + 1
+        total = self.get_stats(big) + self.get_stats(big)
+        self.assertEqual(total.reads['dram'], 2 * big)
+        total = self.get_stats(big)
+        total += self.get_stats(big)
+        self.assertEqual(total.reads['dram'], 2 * big)
+        self.assertEqual(total.total_cycles, 2 * big)
+
+    def test_mul(self):
+        stats = self.get_stats(2**40) * 2**30
+        self.assertEqual(stats.reads['dram'], 2**70)
+        stats = self.get_stats(3) * 5
+        self.assertEqual(stats.data.dtype, np.int64)
+        self.assertEqual(stats.reads['dram'], 15)
+
+    def test_batch_sum(self):
+        big = 2**62 + 1
+        batch = StatsBatch.from_stats([self.get_stats(big)] * 4)
+        self.assertEqual(batch.sum().reads['dram'], 4 * big)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,7 @@ warnings.filterwarnings('ignore')
 import bitfusion.src.benchmarks.benchmarks as benchmarks
 from bitfusion.src.simulator.stats import Stats
 from bitfusion.src.simulator.simulator import Simulator
+from bitfusion.src.simulator.layer_cache import LayerCache
 from bitfusion.src.sweep.sweep import SimulatorSweep, check_pandas_or_run
 from bitfusion.src.utils.utils import *
 from bitfusion.src.optimizer.optimizer import optimize_for_order, get_stats_fast
@@ -34,8 +35,10 @@ config_file = sys.argv[1]
 print("Using config file: {}".format(config_file))
 
 # Create simulator object
+# Per-layer results are cached on disk, so repeated runs skip the search
 verbose = False
-bf_e_sim = Simulator(config_file, verbose)
+layer_cache = LayerCache(filename=os.path.join(results_dir, 'layer_cache.sqlite'))
+bf_e_sim = Simulator(config_file, verbose, layer_cache=layer_cache)
 bf_e_energy_costs = bf_e_sim.get_energy_cost()
 print(bf_e_sim)
 
@@ -44,31 +47,17 @@ print('')
 print('*'*50)
 print(energy_tuple)
 
-sim_sweep_columns = ['N', 'M',
-        'Max Precision (bits)', 'Min Precision (bits)',
-        'Network', 'Layer',
-        'Cycles', 'Memory wait cycles',
-        'WBUF Read', 'WBUF Write',
-        'OBUF Read', 'OBUF Write',
-        'IBUF Read', 'IBUF Write',
-        'DRAM Read', 'DRAM Write',
-        'Bandwidth (bits/cycle)',
-        'WBUF Size (bits)', 'OBUF Size (bits)', 'IBUF Size (bits)',
-        'Batch size']
-
+# Sweep results are appended to this file as they are simulated; use a
+# .sqlite extension to store them in SQLite instead of csv
 filename = 'bitfusion-eyeriss-sim-sweep'+bf_e_sim.suffix+"_b"+str(batch_size)+'.csv'
 bf_e_sim_sweep_csv = os.path.join(results_dir, filename)
-if os.path.exists(bf_e_sim_sweep_csv):
-    print("{} does not exist. Good".format(filename))
-    bf_e_sim_sweep_df = pandas.read_csv(bf_e_sim_sweep_csv)
-else:
-    bf_e_sim_sweep_df = pandas.DataFrame(columns=sim_sweep_columns)
 print('Got BitFusion Eyeriss, Numbers')
 
-bf_e_results = check_pandas_or_run(bf_e_sim, bf_e_sim_sweep_df,
+bf_e_results = check_pandas_or_run(bf_e_sim, None,
         bf_e_sim_sweep_csv, batch_size=batch_size, config_file=config_file)
 bf_e_results = bf_e_results.groupby('Network',as_index=False).agg(np.sum)
 area_stats = bf_e_sim.get_area()
+print(bf_e_sim.layer_cache)
 print("Done")
 
 def get_eyeriss_energy(df):